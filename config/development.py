@@ -24,11 +24,48 @@ LOG_PATH = "/tmp/"
 # mongo配置
 DB_HOST = "mongodb://127.0.0.1:27017"
 DB_PORT = 27017
+# mongo从库配置, 供列表等读多场景使用; 副本集可与主库使用同一地址, 由读偏好路由到从节点
+DB_HOST_R = DB_HOST
+DB_PORT_R = DB_PORT
+DB_READ_PREFERENCE_R = 'SECONDARY_PREFERRED'
+
+# mongo连接池配置, 异步(motor)和同步(pymongo)客户端分开
+DB_POOL_SETTINGS = {
+    'maxPoolSize': 100,
+    'minPoolSize': 5,
+    'waitQueueTimeoutMS': 2000,         # 等待空闲连接超时
+    'connectTimeoutMS': 3000,
+    'socketTimeoutMS': 10000,
+    'serverSelectionTimeoutMS': 5000,
+}
+DB_SYNC_POOL_SETTINGS = {
+    'maxPoolSize': 100,
+    'minPoolSize': 0,
+}
+
+# mongo集合级配置: 读偏好(pymongo ReadPreference 属性名)、写关注(WriteConcern 参数)
+# 例: {'like_history': {'read_preference': 'SECONDARY_PREFERRED', 'write_concern': {'w': 1}}}
+DB_COLLECTION_SETTINGS = {}
+
+# mongo查询耗时统计, 超过 DB_SLOW_QUERY_MS 毫秒记录慢查询日志
+DB_PROFILE_ENABLED = True
+DB_SLOW_QUERY_MS = 100
+
+# 访问日志按 handler 采样, 每 N 次请求输出 1 次(慢请求与错误请求始终输出)
+LOG_SAMPLE_RATES = {
+    'GetMyBadgesHandler': 10,
+}
+
+# 是否检查并报告未命中声明索引的查询(见 cores/database/db_index.py)
+DB_INDEX_CHECK = True
 
 # redis配置
 REDIS_HOST = "127.0.0.1"
 REDIS_PORT = 6379
 REDIS_PASSWORD = None
+# redis从库配置
+REDIS_HOST_R = REDIS_HOST
+REDIS_PORT_R = REDIS_PORT
 REDIS_DB_DEFAULT = 0        # 默认
 REDIS_DB_FUNC_CACHE = 1     # function
 REDIS_DB_USER_SESSION = 2   # 用户
@@ -40,10 +77,19 @@ ALL_REDIS_DBS = (
     REDIS_DB_SNAP, REDIS_DB_LONG
 )
 
+# redis连接池配置
+REDIS_POOL_MIN_SIZE = 0
+REDIS_POOL_MAX_SIZE = 20
+REDIS_TIMEOUT = 3.2             # 异步连接超时, 等一次syn重试
+REDIS_SOCKET_TIMEOUT = 0.5      # 同步连接或者执行时间
+
 # 登录超时
 USER_SESSION_EXT = 60 * 60 * 24 * 30
 AUDIT_SESSION_EXT = 60 * 60 * 24 * 7
 
+# 服务运行统计接口访问口令 (线上环境必须配置)
+SERVER_STATS_TOKEN = ''
+
 # CDN 资源
 ALIYUN_OSS_ACCESS_KEY_ID = ""
 ALIYUN_OSS_SECRET_ACCESS_KEY = ""
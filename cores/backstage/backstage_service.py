@@ -2,18 +2,61 @@
 """
 后台服务 service 方法
 """
+import hashlib
+
 from config import config
+from cores.const import const_err, const_mix
+from cores.utils import json_codec
+
+
+# 进程内缓存, 配置变更通过 SIGHUP 滚动重启 worker 生效
+_oss_conf = None
+_app_conf_response = None
 
 
 def get_oss_conf():
     """
-    获取oss配置信息
+    获取oss配置信息, 每个进程只构造一次
+    注意: 返回共享数据, 调用方不能修改
     :return: 
     """
-    return {
-        'endpoint': config.ALIYUN_OSS_ENDPOINT,
-        'img_bucket': config.ALIYUN_OSS_IMAGE_BUCKET,
-        'img_dir': config.ALIYUN_OSS_IMAGE_DIR,
-        'video_bucket': config.ALIYUN_OSS_VIDEO_BUCKET,
-        'video_dir': config.ALIYUN_OSS_VIDEO_DIR,
-    }
+    global _oss_conf
+    if _oss_conf is None:
+        _oss_conf = {
+            'endpoint': config.ALIYUN_OSS_ENDPOINT,
+            'img_bucket': config.ALIYUN_OSS_IMAGE_BUCKET,
+            'img_dir': config.ALIYUN_OSS_IMAGE_DIR,
+            'video_bucket': config.ALIYUN_OSS_VIDEO_BUCKET,
+            'video_dir': config.ALIYUN_OSS_VIDEO_DIR,
+        }
+    return _oss_conf
+
+
+def get_app_conf_response():
+    """
+    获取客户端配置项的完整响应, 每个进程只编码一次
+    :return: (响应内容 bytes, 强 ETag)
+    """
+    global _app_conf_response
+    if _app_conf_response is None:
+        result = const_mix.get_app_conf()
+
+        # OSS相关信息
+        result['oss_conf'] = get_oss_conf()
+
+        # 当前域名
+        result['host'] = config.PROJECT_HOST
+
+        content = json_codec.dumps({'ret': const_err.CODE_SUCCESS, 'data': result, 'msg': ''}).encode('utf8')
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        _app_conf_response = (content, etag)
+    return _app_conf_response
+
+
+def clear_conf_cache():
+    """
+    清除配置缓存, 进程内修改配置后(如测试用例)调用, 线上通过 SIGHUP 重启 worker 重新加载
+    """
+    global _oss_conf, _app_conf_response
+    _oss_conf = None
+    _app_conf_response = None
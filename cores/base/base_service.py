@@ -2,7 +2,6 @@
 """
 基础 service 方法
 """
-import copy
 import datetime
 import random
 import time
@@ -10,11 +9,12 @@ import ujson
 import asyncio
 from functools import wraps
 from uuid import uuid4
-from bson import ObjectId
+from bson import ObjectId, json_util
 from config import config
 from cores.const import const_user, const_base
 from cores.database import db
 from cores.utils import logger
+from cores.utils.entity_cache import LocalLRUCache
 
 
 def get_random_str(str_len=8, seed=None):
@@ -57,6 +57,54 @@ def async_run(fun):
     return ret
 
 
+# 单阶段耗时超过该值(毫秒)时打印各阶段耗时
+SLOW_STAGE_MS = 200
+
+
+async def gather_stages(stages, label='', timings=None):
+    """
+    按依赖关系并发执行多个查询, 无依赖关系的查询同时发出
+    用法:
+        results = await gather_stages({
+            'like_uids': (lambda r: query_like_uids(pid), []),
+            'user_map': (lambda r: get_user_map_by_uids(r['like_uids']), ['like_uids']),
+            'tag_map': (lambda r: get_tag_map_by_tids(tids), []),
+        })
+    :param stages: {阶段名: (func, [依赖的阶段名])}, func(results) 返回 awaitable, results 中包含已完成的依赖结果
+    :param label: 打印慢查询日志时的标识
+    :param timings: 传入 dict 时记录各阶段耗时(毫秒)
+    :return: {阶段名: 结果}
+    """
+    for name, (_, deps) in stages.items():
+        for dep in deps:
+            if dep not in stages:
+                raise ValueError('stage %s depends on unknown stage %s' % (name, dep))
+
+    timings = {} if timings is None else timings
+    results = {}
+    futures = {}
+
+    async def run_stage(name):
+        func, deps = stages[name]
+        if deps:
+            await asyncio.gather(*[futures[dep] for dep in deps])
+        start = time.time()
+        results[name] = await func(results)
+        timings[name] = int((time.time() - start) * 1000)
+
+    for name in stages:
+        futures[name] = asyncio.ensure_future(run_stage(name))
+    try:
+        await asyncio.gather(*futures.values())
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    if timings and max(timings.values()) >= SLOW_STAGE_MS:
+        logger.warn('[gather_stages] %s slow stages: %s' % (label, timings))
+    return results
+
+
 # ----------------- 登录session管理 ------------------
 class AioRedisSession:
     """
@@ -65,6 +113,14 @@ class AioRedisSession:
     aiord = None
     aiord_r = None
 
+    # 进程内 session 缓存, 修改或删除时通过 redis pub/sub 通知所有进程失效
+    local_cache = LocalLRUCache(max_size=10000, ttl=5)
+    invalidate_channel = 'session_invalidate'
+
+    # 延长 session 检查间隔(秒), 同一 sid 间隔内只检查一次
+    extend_check_interval = 60 * 10
+    extend_checked_cache = LocalLRUCache(max_size=10000, ttl=extend_check_interval)
+
     @classmethod
     async def init(cls):
         # assert cls.aiord is None
@@ -75,13 +131,56 @@ class AioRedisSession:
                 # 从库
                 db.get_aioredis_r(config.REDIS_DB_USER_SESSION)
             )
+            asyncio.ensure_future(cls.listen_invalidation())
+
+    @classmethod
+    async def listen_invalidation(cls):
+        """
+        订阅 session 失效通知, 删除进程内缓存
+        """
+        while True:
+            try:
+                channel, = await cls.aiord.subscribe(cls.invalidate_channel)
+                while await channel.wait_message():
+                    sid = await channel.get(encoding='utf-8')
+                    cls.local_cache.delete(sid)
+            except Exception as e:
+                logger.error('[AioRedisSession] listen invalidation failed, %s' % str(e))
+
+            # 订阅断开期间可能错过通知, 清空进程内缓存后重新订阅
+            cls.local_cache.clear()
+            await asyncio.sleep(1)
+
+    @classmethod
+    async def invalidate_local(cls, sid):
+        """
+        失效所有进程的 session 缓存
+        """
+        cls.local_cache.delete(sid)
+        await cls.aiord.publish(cls.invalidate_channel, sid)
 
     @classmethod
     async def open_session(cls, sid):
+        data = cls.local_cache.get(sid)
+        if data is not None:
+            return data
+
         raw_data = await cls.aiord_r.get(cls.prefixed(sid))
         data = ujson.loads(raw_data) if raw_data else {}
+        if data:
+            cls.local_cache.set(sid, data)
         return data
 
+    @classmethod
+    def need_extend_check(cls, sid):
+        """
+        是否需要检查延长 session, 同一 sid 每 extend_check_interval 秒最多一次
+        """
+        if cls.extend_checked_cache.get(sid):
+            return False
+        cls.extend_checked_cache.set(sid, True)
+        return True
+
     @classmethod
     async def create_new_session(cls, uid, user_info, expire_time=config.USER_SESSION_EXT, login_from_type=const_user.LOGIN_FROM_TYPE_PHONE):
         # 重复登录旧session失效
@@ -131,6 +230,7 @@ class AioRedisSession:
             seconds=expire,
             value=ujson.dumps(data),
         )
+        await cls.invalidate_local(sid)
 
     @classmethod
     async def expire_session(cls, sid, expire=config.USER_SESSION_EXT):
@@ -145,6 +245,7 @@ class AioRedisSession:
         使用 session_id 删除 session
         """
         await cls.aiord.delete(cls.prefixed(sid))
+        await cls.invalidate_local(sid)
 
     @classmethod
     async def delete_session_by_uid(cls, uid, login_from_type=const_user.LOGIN_FROM_TYPE_PHONE):
@@ -409,6 +510,104 @@ def attach_ct_lt_to_next_cursor_info(next_cursor_info, cursor_info, new_objs):
     return next_cursor_info
 
 
+def build_seek_sorts(sorts):
+    """
+    给排序条件补充 _id 作为唯一排序键, 保证 seek 分页顺序稳定
+    :param sorts: [(key, direction), ...]
+    :return:
+    """
+    if not sorts:
+        return sorts
+    sorts = list(sorts)
+    if '_id' not in [key for key, _ in sorts]:
+        sorts.append(('_id', sorts[-1][1]))
+    return sorts
+
+
+# seek 排序值允许的类型, 其余(如 dict、list、正则)可能被解析为查询操作符
+SEEK_VALUE_TYPES = (str, int, float, ObjectId, datetime.datetime)
+
+
+def get_seek_values_from_cursor_info(cursor_info, sorts):
+    """
+    获取cursor中记录的上一页末尾排序值
+    seek 来自客户端, 只接受与排序条件一一对应的标量值, 防止注入查询操作符
+    :param cursor_info: 当前页cursor
+    :param sorts: 经过 build_seek_sorts 处理的排序条件
+    :return: 排序值列表, 没有seek信息或不合法时为 None
+    """
+    seek = cursor_info.get('seek') if cursor_info else None
+    if not seek or not isinstance(seek, str) or not sorts or cursor_info.get('seek_keys') != [key for key, _ in sorts]:
+        return None
+
+    try:
+        seek_values = json_util.loads(seek)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(seek_values, list) or len(seek_values) != len(sorts):
+        return None
+    if not all(isinstance(value, SEEK_VALUE_TYPES) for value in seek_values):
+        return None
+    return seek_values
+
+
+def build_seek_query_dict(query_dict, sorts, cursor_info):
+    """
+    根据cursor中记录的上一页末尾排序值构造范围查询条件
+    cursor中没有seek信息(旧版offset分页)或排序条件不一致时, 退化为offset分页
+    :param query_dict: 原查询条件
+    :param sorts: 经过 build_seek_sorts 处理的排序条件
+    :param cursor_info: 当前页cursor
+    :return: (查询条件, 需要skip的数目)
+    """
+    offset = cursor_info.get('offset', 0) if cursor_info else 0
+    offset = offset if offset >= 0 else 0
+
+    seek_values = get_seek_values_from_cursor_info(cursor_info, sorts)
+    if seek_values is None:
+        return query_dict, offset
+
+    # (k1 < v1) or (k1 == v1 and k2 < v2) or ...
+    or_conds = []
+    for i, (key, direction) in enumerate(sorts):
+        cond = {sorts[j][0]: seek_values[j] for j in range(i)}
+        cond[key] = {'$lt' if direction < 0 else '$gt': seek_values[i]}
+        or_conds.append(cond)
+
+    seek_query_dict = {'$or': or_conds}
+    if query_dict:
+        seek_query_dict = {'$and': [query_dict, seek_query_dict]}
+    return seek_query_dict, 0
+
+
+def build_next_seek_cursor_info(sorts, offset, limit, last_obj):
+    """
+    构造下一页cursor, 同时保留offset以兼容旧客户端
+    :param sorts: 经过 build_seek_sorts 处理的排序条件
+    :param offset: 当前页offset
+    :param limit: 每页数目
+    :param last_obj: 当前页最后一条原始数据
+    :return:
+    """
+    next_cursor_info = {
+        'offset': offset + limit,
+        'limit': limit,
+    }
+    if not sorts or not last_obj:
+        return next_cursor_info
+
+    # 排序字段缺失时无法构造范围条件, 继续使用offset分页
+    seek_values = []
+    for key, _ in sorts:
+        if last_obj.get(key) is None:
+            return next_cursor_info
+        seek_values.append(last_obj[key])
+
+    next_cursor_info['seek'] = json_util.dumps(seek_values)
+    next_cursor_info['seek_keys'] = [key for key, _ in sorts]
+    return next_cursor_info
+
+
 # ----------------- 版本检测 ------------------
 def later_or_equal_version(v1, v2):
     """
@@ -504,6 +703,14 @@ def script_performance_monitor(limit_seconds=60*60):
     return decorator
 
 
+# 图片签名样式: 原图、浏览图、缩略图
+IMAGE_SIGN_STYLES = (None, 'image/resize,w_720', 'image/resize,w_360')
+
+# 签名过期时间按时间桶对齐, 同一桶内同一图片的签名链接不变, 便于CDN缓存
+IMAGE_SIGN_EXPIRE_BUCKET = 60 * 60
+image_sign_cache = LocalLRUCache(max_size=20000, ttl=IMAGE_SIGN_EXPIRE_BUCKET)
+
+
 def build_img_infos(img_infos):
     """
     构造新版图片元素
@@ -513,38 +720,36 @@ def build_img_infos(img_infos):
     if not img_infos:
         return imgs
 
+    img_infos = [img_info for img_info in img_infos if isinstance(img_info, dict)]
+
+    # 整页图片一次批量签名
+    sign_items = [(img_info.get('url', ''), style) for img_info in img_infos for style in IMAGE_SIGN_STYLES]
+    signed_map = sign_oss_image_urls(sign_items)
+
     for img_info in img_infos:
-        if not isinstance(img_info, dict):
-            continue
-        img_item = build_img_infos_item(img_info)
+        img_item = build_img_infos_item(img_info, signed_map=signed_map)
         imgs.append(img_item)
     return imgs
 
 
-def build_img_infos_item(raw_info):
+def build_img_infos_item(raw_info, signed_map=None):
     """
     构造完整的图片信息
+    :param raw_info: 原始图片信息, 只读
+    :param signed_map: 已批量签名的链接 {(url, style): sign_url}
     :return:
     """
     if not isinstance(raw_info, dict):
         return {}
-    raw_info = copy.deepcopy(raw_info)
-    # 原图链接
-    raw_url = raw_info.get('url', '')
-    if raw_url and raw_url[:4] != 'http':
-        raw_url = sign_oss_image_url(raw_url)
-    # 浏览图
-    view_url = raw_info.get('url', '')
-    if view_url and view_url[:4] != 'http':
-        view_url = sign_oss_image_url(view_url, style='image/resize,w_720')
-    # 缩略图
-    thumb_url = raw_info.get('url', '')
-    if thumb_url and thumb_url[:4] != 'http':
-        thumb_url = sign_oss_image_url(thumb_url, style='image/resize,w_360')
+    url = raw_info.get('url', '')
+    if signed_map is None:
+        signed_map = sign_oss_image_urls([(url, style) for style in IMAGE_SIGN_STYLES])
+    # 原图、浏览图、缩略图链接
+    raw_url, view_url, thumb_url = [signed_map.get((url, style), url) for style in IMAGE_SIGN_STYLES]
     # 返回结果
     image = {
         'type': raw_info.get('type', const_base.IMAGE_TYPE_NORMAL),
-        'url': raw_info.get('url', ''),
+        'url': url,
         'raw_url': raw_url,
         'view_url': view_url,
         'thumb_url': thumb_url,
@@ -554,6 +759,32 @@ def build_img_infos_item(raw_info):
     return image
 
 
+def sign_oss_image_urls(items, expires=60 * 60 * 12):
+    """
+    批量签名图片, 复用缓存中同一过期时间桶的签名
+    :param items: [(image_url, style)]
+    :param expires: 最短有效时间, 实际过期时间向上对齐到时间桶
+    :return: {(image_url, style): sign_url}, http 链接原样返回
+    """
+    result = {}
+    now_ts = int(time.time())
+    expire_at = (now_ts + expires) // IMAGE_SIGN_EXPIRE_BUCKET * IMAGE_SIGN_EXPIRE_BUCKET + IMAGE_SIGN_EXPIRE_BUCKET
+    for image_url, style in items:
+        if (image_url, style) in result:
+            continue
+        if not image_url or image_url[:4] == 'http':
+            result[(image_url, style)] = image_url
+            continue
+
+        key = (image_url, style, expire_at)
+        sign_url = image_sign_cache.get(key)
+        if sign_url is None:
+            sign_url = _sign_oss_image_url(image_url, expire_at - now_ts, style=style)
+            image_sign_cache.set(key, sign_url, ttl=expire_at - expires - now_ts)
+        result[(image_url, style)] = sign_url
+    return result
+
+
 def sign_oss_image_url(image_url, expires=60 * 60 * 12, style=None):
     """
     签名图片
@@ -568,10 +799,14 @@ def sign_oss_image_url(image_url, expires=60 * 60 * 12, style=None):
         # 格式转换 style = 'image/format,png'
     :return:
     """
+    return sign_oss_image_urls([(image_url, style)], expires=expires)[(image_url, style)]
+
+
+def _sign_oss_image_url(image_url, expires, style=None):
+    """
+    调用 oss 签名图片
+    """
     return ''
-    # if image_url[:4] == 'http':
-    #     return image_url
-    #
     # params = None
     # if style:
     #     params = {'x-oss-process': style}
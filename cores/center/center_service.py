@@ -8,25 +8,34 @@ from bson import ObjectId
 
 from cores.const import const_mix, const_base
 from cores.database import mongo_async, db
+from cores.base import base_service
 from cores.favor import favor_service
 from cores.user import user_service
-from cores.utils.badge import BasicBadgeManager
+from cores.follow import follow_service
+from cores.utils.badge import AioBasicBadgeManager, aio_get_multi_badge_num
 
 # 粉我的新增缓存
 NEW_FANS_TO_ME_NUM = 150
 NEW_FANS_TO_ME_KEY = 'user(%s)_new_fans_to_me'
-new_fans_to_me_badge = BasicBadgeManager(NEW_FANS_TO_ME_KEY, expire_time=60*60*24*7)
+new_fans_to_me_badge = AioBasicBadgeManager(NEW_FANS_TO_ME_KEY, expire_time=60*60*24*7)
 
 # 赞我的新增缓存
 NEW_LIKE_TO_ME_MAX_NUM = 200
 NEW_LIKE_TO_ME_KEY = 'user(%s)_new_like_to_me'
-new_like_to_me_badge = BasicBadgeManager(NEW_LIKE_TO_ME_KEY, expire_time=60*60*24*7)
+new_like_to_me_badge = AioBasicBadgeManager(NEW_LIKE_TO_ME_KEY, expire_time=60*60*24*7)
 
 
 # 评论我的新增缓存
 NEW_COMMENT_TO_ME_NUM = 200
 NEW_COMMENT_TO_ME_KEY = 'user(%s)_new_comment_to_me'
-new_comment_to_me_badge = BasicBadgeManager(NEW_COMMENT_TO_ME_KEY, expire_time=60*60*24*7)
+new_comment_to_me_badge = AioBasicBadgeManager(NEW_COMMENT_TO_ME_KEY, expire_time=60*60*24*7)
+
+# 可见通知索引, 按 ntype + uid 分别维护 (uid 为空表示全局通知), score 为通知创建时间
+NOTICE_INDEX_KEY = 'notice_index_%s_%s'
+NOTICE_INDEX_MAX_NUM = 500
+NOTICE_INDEX_EXPIRE = 60 * 60 * 24 * 30
+# 索引已构建标识, score 固定为 -1, 不参与未读计数
+NOTICE_INDEX_BUILT_MEMBER = '_built'
 
 
 def build_comment_to_me_badge_item(uid, oid, otype):
@@ -40,18 +49,22 @@ def build_comment_to_me_badge_item(uid, oid, otype):
     return '%s##%s##%s' % (uid, oid, otype)
 
 
-def build_user_home_page_for_handler(dst_favor, dst_user, my_favor):
+async def build_user_home_page_for_handler(dst_favor, dst_user, my_favor):
     """
     构造查看的其他用户主页信息
     :return:
     """
+    # 双方的关注状态
+    dst_uid = str(dst_user['_id'])
+    my_favor = await follow_service.with_follow_state(my_favor, uids=[dst_uid])
+    dst_favor = await follow_service.with_follow_state(dst_favor, uids=[my_favor['uid']] if my_favor else [])
     result = user_service.build_user_info_by_favor(dst_user, need_passwd=False, viewer_favor_info=my_favor, user_favor_info=dst_favor)
 
     # 该用户关注的其他用户数量
-    result['f_user_num'] = len(dst_favor['f_uids'])
+    result['f_user_num'] = max(dst_favor.get('f_user_num', 0), 0)
 
     # 该用户关注的主题数量
-    result['f_tag_num'] = len(dst_favor['f_tids'])
+    result['f_tag_num'] = max(dst_favor.get('f_tag_num', 0), 0)
 
     # 该用户粉丝数量
     result['fans_num'] = dst_favor.get('fans_num', 0)
@@ -68,7 +81,7 @@ async def build_my_home_page_for_handler(my_favor, raw_user):
     """
 
     # 基础信息
-    result = build_user_home_page_for_handler(my_favor, raw_user, my_favor)
+    result = await build_user_home_page_for_handler(my_favor, raw_user, my_favor)
 
     # 发帖、评论数目
     result['post_num'] = my_favor.get('post_num', 0)
@@ -82,14 +95,10 @@ async def build_my_home_page_for_handler(my_favor, raw_user):
     result['likes_post_to_me'] = my_favor.get('likes_post_to_me', 0)
     result['likes_cmt_to_me'] = my_favor.get('likes_cmt_to_me', 0)
 
-    # 赞我的新增数目
-    result['new_likes_to_me'] = new_like_to_me_badge.get_badge_num(result['uid'])
-
-    # 评论我的新增数目
-    result['new_cmt_to_me'] = new_comment_to_me_badge.get_badge_num(result['uid'])
-
-    # 新增粉丝数目
-    result['new_fans_to_me'] = new_fans_to_me_badge.get_badge_num(result['uid'])
+    # 赞我的、评论我的、新增粉丝数目
+    badge_nums, _ = await aio_get_multi_badge_num(
+        result['uid'], [new_like_to_me_badge, new_comment_to_me_badge, new_fans_to_me_badge])
+    result['new_likes_to_me'], result['new_cmt_to_me'], result['new_fans_to_me'] = badge_nums
 
     return result
 
@@ -100,41 +109,98 @@ async def get_user_badges(uid):
     """
     result = dict()
 
-    # 赞我的新增数目
-    result['new_likes_to_me'] = new_like_to_me_badge.get_badge_num(uid)
-
-    # 评论我的新增数目
-    result['new_cmt_to_me'] = new_comment_to_me_badge.get_badge_num(uid)
-
-    # 新增粉丝数目
-    result['new_fans_to_me'] = new_fans_to_me_badge.get_badge_num(uid)
+    # 赞我的、评论我的、新增粉丝数目, 以及最后阅读通知时间, 一次 pipeline 获取
+    badge_nums, extra_values = await aio_get_multi_badge_num(
+        uid, [new_like_to_me_badge, new_comment_to_me_badge, new_fans_to_me_badge],
+        extra_keys=[favor_service.LAST_READ_NOTICE_CT_KEY % uid])
+    result['new_likes_to_me'], result['new_cmt_to_me'], result['new_fans_to_me'] = badge_nums
 
     # 新增我的通知
-    new_notices_to_me = await get_new_notices_to_me(uid, 100, [const_mix.NOTICE_TYPE_SYS])
-    result['new_notices_to_me'] = len(new_notices_to_me)
+    last_read_notice_ct = await favor_service.get_user_last_read_notice_ct(uid, cached_value=extra_values[0])
+    result['new_notices_to_me'] = await get_new_notice_num_to_me(uid, 100, [const_mix.NOTICE_TYPE_SYS], last_read_notice_ct=last_read_notice_ct)
 
     return result
 
 
-async def get_new_notices_to_me(uid, limit, ntypes=None):
+def build_notice_index_key(ntype, uid):
+    """
+    构造可见通知索引key
+    """
+    return NOTICE_INDEX_KEY % (ntype, uid or 'all')
+
+
+async def rebuild_notice_index(ntype, uid):
+    """
+    从数据库重建可见通知索引, 只保留最近 NOTICE_INDEX_MAX_NUM 条
+    """
+    notice_col = db.get_motordb_col_notice()
+    query_dict = build_notice_query_dict(uids=uid or '', notice_types=ntype, status=const_mix.NOTICE_STATUS_VISIBLE)
+    notice_list = await mongo_async.mongo_find_sort_skip_limit(
+        notice_col, query_dict, [('ct', -1)], 0, NOTICE_INDEX_MAX_NUM, projection={'ct': True})
+
+    pairs = [-1, NOTICE_INDEX_BUILT_MEMBER]
+    for notice in notice_list or []:
+        pairs.extend([notice['ct'], str(notice['_id'])])
+
+    key = build_notice_index_key(ntype, uid)
+    pipe = db.long_aioredis.pipeline()
+    pipe.zadd(key, *pairs)
+    pipe.expire(key, NOTICE_INDEX_EXPIRE)
+    await pipe.execute()
+
+
+async def add_notice_to_index(ntype, uid, nid, ct):
+    """
+    可见通知加入索引, 索引不存在时等待读取时重建
+    """
+    key = build_notice_index_key(ntype, uid)
+    pipe = db.long_aioredis.pipeline()
+    pipe.zadd(key, ct, nid)
+    # 保留构建标识(rank 0)和最近的通知
+    pipe.zremrangebyrank(key, 1, -(NOTICE_INDEX_MAX_NUM + 1))
+    await pipe.execute()
+
+
+async def remove_notice_from_index(ntype, uid, nid):
+    """
+    通知移出索引
     """
-    获取用户的未读信息
+    await db.long_aioredis.zrem(build_notice_index_key(ntype, uid), nid)
+
+
+async def get_new_notice_num_to_me(uid, limit, ntypes=None, last_read_notice_ct=None):
+    """
+    获取用户的未读通知数目, 包括全局通知和发给用户的通知
     :param uid:
-    :param limit:
+    :param limit: 最大计数
+    :param ntypes: 通知类型列表
+    :param last_read_notice_ct: 最后阅读通知时间, 不传时自动获取
     :return:
     """
     # 最近读取时间
-    favor = await favor_service.get_user_favor(uid)
-    last_read_notice_ct = favor.get('last_read_notice_ct', 0)
+    if last_read_notice_ct is None:
+        last_read_notice_ct = await favor_service.get_user_last_read_notice_ct(uid)
 
-    # 计算未读消息数目
+    # 全局通知、个人通知索引
     ntypes = ntypes or const_mix.ALL_NOTICE_TYPES
-    notice_col = db.get_motordb_col_notice()
-    query_dict = build_notice_query_dict(
-        uids=['', uid], notice_types=ntypes, status=[const_mix.NOTICE_STATUS_VISIBLE], ct_gt=last_read_notice_ct)
-    projection = {'_id': True}
-    new_notices_to_me = await mongo_async.mongo_find_limit(notice_col, query_dict, limit, projection)
-    return new_notices_to_me
+    index_items = [(ntype, index_uid) for ntype in ntypes for index_uid in ['', uid]]
+
+    for i in range(2):
+        pipe = db.long_aioredis.pipeline()
+        for ntype, index_uid in index_items:
+            key = build_notice_index_key(ntype, index_uid)
+            pipe.zscore(key, NOTICE_INDEX_BUILT_MEMBER)
+            pipe.zcount(key, last_read_notice_ct + 1, float('inf'))
+        values = await pipe.execute()
+
+        # 索引不存在时重建后重新计数
+        not_built_items = [index_items[j] for j in range(len(index_items)) if values[2 * j] is None]
+        if not not_built_items or i > 0:
+            break
+        for ntype, index_uid in not_built_items:
+            await rebuild_notice_index(ntype, index_uid)
+
+    return min(sum(values[1::2]), limit)
 
 
 def build_notice_query_dict(uids=None, notice_types=None, status=None, ct_gte=None, ct_lt=None, ct_gt=None, rgns=None):
@@ -208,17 +274,16 @@ async def query_notice_list_for_handler(cursor_info, uid, query_dict=None, sorts
     limit = cursor_info.get('limit', const_mix.NOTICES_PAGE_PER_NUM)
     limit = limit if limit < const_mix.NOTICES_PAGE_PER_NUM else const_mix.NOTICES_PAGE_PER_NUM
 
-    # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
-
-    # 获取数据列表
+    # 获取数据列表, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
     notice_col = db.get_motordb_col_notice()
-    notice_list = await mongo_async.mongo_find_sort_skip_limit(notice_col, query_dict, sorts, offset, limit+1)
+    notice_list = await mongo_async.mongo_find_sort_skip_limit(notice_col, seek_query_dict, sorts, skip, limit+1)
     has_more = bool(len(notice_list) > limit)
     notice_list = notice_list[:limit]
+
+    # 下一次分页信息
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, notice_list[-1] if notice_list else None)
     if not notice_list:
         return False, next_cursor_info, []
 
@@ -256,6 +321,11 @@ async def create_new_notice(ntype, status, title, text=None, uid=None, extra=Non
     if extra and isinstance(extra, dict):
         new_notice.update(extra)
     new_id = await mongo_async.mongo_insert_one(notice_col, new_notice, returnid=True)
+
+    # 更新未读通知索引
+    if new_id and status == const_mix.NOTICE_STATUS_VISIBLE:
+        await add_notice_to_index(ntype, new_notice['uid'], str(new_id), new_notice['ct'])
+
     return str(new_id)
 
 
@@ -288,7 +358,16 @@ async def update_notice_by_nid(nid, status=None, ntype=None, title=None, text=No
     if uid is not None:
         set_dict['uid'] = uid
 
-    await mongo_async.mongo_update_one(notice_col, {'_id': ObjectId(nid)}, {'$set': set_dict})
+    old_notice = await mongo_async.mongo_find_one_and_update(notice_col, {'_id': ObjectId(nid)}, {'$set': set_dict}, return_document=False)
+    if not old_notice:
+        return
+
+    # 更新未读通知索引
+    new_notice = dict(old_notice, **set_dict)
+    if old_notice['status'] == const_mix.NOTICE_STATUS_VISIBLE:
+        await remove_notice_from_index(old_notice['ntype'], old_notice['uid'], nid)
+    if new_notice['status'] == const_mix.NOTICE_STATUS_VISIBLE:
+        await add_notice_to_index(new_notice['ntype'], new_notice['uid'], nid, new_notice['ct'])
 
 
 
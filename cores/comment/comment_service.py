@@ -12,7 +12,9 @@ from cores.database import db, mongo_async
 from cores.favor import favor_service
 from cores.base import base_service
 from cores.user import user_service
+from cores.follow import follow_service
 from cores.post import post_service
+from cores.utils.counter_aggregator import counter_aggregator
 
 
 def build_comment_query_sort(sort_type):
@@ -69,30 +71,37 @@ def build_comment_query_dict(uid=None, pid=None, status=None, cid=None, ct_lt=No
     return query_dict
 
 
-async def get_comment_info_list_for_handler(uid, cursor_info, query_dict, sorts, favor_info=None):
+async def get_comment_info_list_for_handler(uid, cursor_info, query_dict, sorts, favor_info=None, read_replica=True):
     """
     获取帖子下的评论列表
+    :param read_replica: 是否从库读取
     :return:
     """
     offset = cursor_info.get('offset', 0) if cursor_info else 0
     limit = cursor_info.get('limit', const_cmt.COMMENT_PAGE_PER_NUM) if cursor_info else const_cmt.COMMENT_PAGE_PER_NUM
     limit = const_cmt.COMMENT_PAGE_PER_NUM_MAX if limit > const_cmt.COMMENT_PAGE_PER_NUM_MAX else limit
 
-    # 获取当前帖子下评论列表
-    comment_col = db.get_motordb_col_comment()
-    comments = await mongo_async.mongo_find_sort_skip_limit(comment_col, query_dict, sorts, offset, limit+1)
+    # 获取当前帖子下评论列表, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
+    comment_col = db.get_motordb_col_comment_r() if read_replica else db.get_motordb_col_comment()
+    comments = await mongo_async.mongo_find_sort_skip_limit(comment_col, seek_query_dict, sorts, skip, limit+1)
     has_more = bool(len(comments) > limit)
     comments = comments[:limit]
     if not comments:
         return False, copy.deepcopy(cursor_info), []
 
-    # 获取用户信息映射表
+    # 并发查询用户信息映射表和赞踩列表
     uids = [comment['uid'] for comment in comments]
-    user_map = await user_service.get_user_map_by_uids(uids)
-
-    # 构造赞踩列表
     cids = [str(comment['_id']) for comment in comments]
-    like_cids, disliked_cids = await favor_service.get_user_liked_disliked_cids(uid, cids)
+    stage_results = await base_service.gather_stages({
+        'user_map': (lambda r: user_service.get_user_map_by_uids(uids), []),
+        'like_info': (lambda r: favor_service.get_user_liked_disliked_cids(uid, cids), []),
+        'viewer_favor': (lambda r: follow_service.with_follow_state(favor_info, uids=uids), []),
+    }, label='get_comment_info_list_for_handler')
+    user_map = stage_results['user_map']
+    like_cids, disliked_cids = stage_results['like_info']
+    favor_info = stage_results['viewer_favor']
 
     # 构造返回列表
     result = []
@@ -103,10 +112,7 @@ async def get_comment_info_list_for_handler(uid, cursor_info, query_dict, sorts,
         )
 
     # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, comments[-1])
 
     return has_more, next_cursor_info, result
 
@@ -258,7 +264,8 @@ def build_comment_base_info(comment, user_map, user_like_cids, user_dislike_cids
     :param sub_comment_map: 子评论映射表
     :return:
     """
-    # 评论基本数据
+    # 评论基本数据, 叠加尚未落库的计数
+    comment = counter_aggregator.overlay('comment', comment)
     cid = str(comment['_id'])
     result = {
         'cid': cid,
@@ -304,17 +311,8 @@ async def increase_comment_count_stat(cid, likes_inc_num=0, dislikes_inc_num=0):
     # 更新修改时间
     set_dict = {'ut': int(time.time())}
 
-    # 保存修改数据
-    update_dict = {}
-    if inc_dict:
-        update_dict['$inc'] = inc_dict
-    if set_dict:
-        update_dict['$set'] = set_dict
-    if not update_dict:
-        return cid
-
-    # 修改计数
-    await mongo_async.mongo_find_one_and_update(comment_col, {'_id': ObjectId(cid)}, update_dict, upsert=False, return_document=True)
+    # 修改计数, 合并后定时落库
+    counter_aggregator.increase(comment_col, cid, inc_dict, set_dict)
     return cid
 
 
@@ -76,6 +76,14 @@ USER_QUERY_SORT_FANS = 2  # 粉丝数
 # 注册频率限制
 REGISTER_FREQUENCY_LIMIT_SEC = 5
 
+# 游客注册频率限制: 同一IP在滑动窗口内的最多次数
+GUEST_REGISTER_IP_LIMIT = 30
+GUEST_REGISTER_IP_WINDOW_SEC = 60
+
+# 发送验证码频率限制: 同一设备的令牌桶, 每秒补充令牌数与容量
+VERIFICATION_CODE_DEVICE_RATE = 1.0 / 60
+VERIFICATION_CODE_DEVICE_CAPACITY = 5
+
 # 登录状态
 LOGIN_TYPE_GUEST = 0
 LOGIN_TYPE_NORMAL = 1
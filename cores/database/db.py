@@ -3,7 +3,8 @@
 from config import config
 import redis
 import aioredis
-from cores.database import mongo_sync, mongo_async
+from cores.database import mongo_sync, mongo_async, pool_stats, db_index
+from cores.utils.request_timing import TimedRedis
 
 
 # ---------- 同步redis
@@ -18,7 +19,7 @@ def get_redis(db=config.REDIS_DB_DEFAULT):
         port=config.REDIS_PORT,
         db=db,
         password=config.REDIS_PASSWORD,
-        socket_timeout=0.5,  # 连接或者执行时间
+        socket_timeout=config.REDIS_SOCKET_TIMEOUT,  # 连接或者执行时间
     )
     return redis_cli
 
@@ -40,31 +41,38 @@ def init_redis():
 
 # ---------- 异步redis
 default_aioredis = None
+func_aioredis = None
 snap_aioredis = None
 long_aioredis = None
 
 async def get_aioredis(db):
-    return await aioredis.create_redis_pool(
+    my_redis = await aioredis.create_redis_pool(
         (config.REDIS_HOST, config.REDIS_PORT),
         db=db,
         password=config.REDIS_PASSWORD,
-        minsize=0,
-        maxsize=20,
-        timeout=3.2,  # 等一次syn重试
-        encoding='utf8'
+        minsize=config.REDIS_POOL_MIN_SIZE,
+        maxsize=config.REDIS_POOL_MAX_SIZE,
+        timeout=config.REDIS_TIMEOUT,
+        encoding='utf8',
+        commands_factory=TimedRedis,
     )
+    pool_stats.register_aioredis_pool('db%s' % db, my_redis)
+    return my_redis
 
 
 async def get_aioredis_r(db):
-    return await aioredis.create_redis_pool(
-        (config.REDIS_HOST, config.REDIS_PORT),
+    my_redis = await aioredis.create_redis_pool(
+        (config.REDIS_HOST_R, config.REDIS_PORT_R),
         db=db,
         password=config.REDIS_PASSWORD,
-        minsize=0,
-        maxsize=20,
-        timeout=3.2,
-        encoding='utf8'
+        minsize=config.REDIS_POOL_MIN_SIZE,
+        maxsize=config.REDIS_POOL_MAX_SIZE,
+        timeout=config.REDIS_TIMEOUT,
+        encoding='utf8',
+        commands_factory=TimedRedis,
     )
+    pool_stats.register_aioredis_pool('db%s_r' % db, my_redis)
+    return my_redis
 
 
 async def init_aioredis():
@@ -75,6 +83,10 @@ async def init_aioredis():
     if not default_aioredis:
         default_aioredis = await get_aioredis(config.REDIS_DB_DEFAULT)
 
+    global func_aioredis
+    if not func_aioredis:
+        func_aioredis = await get_aioredis(config.REDIS_DB_FUNC_CACHE)
+
     global snap_aioredis
     if not snap_aioredis:
         snap_aioredis = await get_aioredis(config.REDIS_DB_SNAP)
@@ -106,6 +118,25 @@ def get_motordb_col_post():
     return motordb_col_post
 
 
+# 从库读取, 用于列表等允许短暂延迟的读多场景
+motordb_col_post_r = None
+def get_motordb_col_post_r():
+    global motordb_col_post_r
+    if not motordb_col_post_r:
+        motordb_col_post_r = mongo_async.mongo_collection(
+            DB_COMMUNITY, 'post', config.DB_HOST_R, config.DB_PORT_R, read_preference=config.DB_READ_PREFERENCE_R)
+    return motordb_col_post_r
+
+
+db_index.declare_indexes('post', get_motordb_col_post, [
+    [('status', 1), ('rt', -1)],                # 推荐候选
+    [('status', 1), ('ct', -1)],                # 最新帖子
+    [('status', 1), ('rec_score', -1)],         # 最热帖子
+    [('uid', 1), ('status', 1), ('ct', -1)],    # 用户帖子
+    [('tids', 1), ('ct', -1)],                  # 标签下帖子
+])
+
+
 # --------- 推荐帖子浏览历史记录
 col_post_recommend_history = None
 def get_col_post_recommend_history():
@@ -123,6 +154,12 @@ def get_motordb_col_post_recommend_history():
     return motordb_col_post_recommend_history
 
 
+db_index.declare_indexes('post_recommend_history', get_motordb_col_post_recommend_history, [
+    ([('uid', 1), ('pid', 1)], {'unique': True}),
+    [('uid', 1), ('ct', -1)],
+])
+
+
 # --------- 账户
 col_user = None
 def get_col_user():
@@ -140,6 +177,12 @@ def get_motordb_col_user():
     return motordb_col_user
 
 
+db_index.declare_indexes('user', get_motordb_col_user, [
+    [('name', 1)],
+    [('status', 1), ('ct', -1)],
+])
+
+
 # --------- 第三方账户
 col_user_third = None
 def get_col_user_third():
@@ -191,6 +234,22 @@ def get_motordb_col_tag():
     return motordb_col_tag
 
 
+# 从库读取, 用于列表等允许短暂延迟的读多场景
+motordb_col_tag_r = None
+def get_motordb_col_tag_r():
+    global motordb_col_tag_r
+    if not motordb_col_tag_r:
+        motordb_col_tag_r = mongo_async.mongo_collection(
+            DB_COMMUNITY, 'tag', config.DB_HOST_R, config.DB_PORT_R, read_preference=config.DB_READ_PREFERENCE_R)
+    return motordb_col_tag_r
+
+
+db_index.declare_indexes('tag', get_motordb_col_tag, [
+    [('status', 1), ('post_num', -1)],
+    [('ut', 1)],                                # 标签字典增量刷新
+])
+
+
 # --------- 评论
 col_comment = None
 def get_col_comment():
@@ -208,6 +267,23 @@ def get_motordb_col_comment():
     return motordb_col_comment
 
 
+# 从库读取, 用于列表等允许短暂延迟的读多场景
+motordb_col_comment_r = None
+def get_motordb_col_comment_r():
+    global motordb_col_comment_r
+    if not motordb_col_comment_r:
+        motordb_col_comment_r = mongo_async.mongo_collection(
+            DB_COMMUNITY, 'comment', config.DB_HOST_R, config.DB_PORT_R, read_preference=config.DB_READ_PREFERENCE_R)
+    return motordb_col_comment_r
+
+
+db_index.declare_indexes('comment', get_motordb_col_comment, [
+    [('pid', 1), ('status', 1), ('rec_score', -1), ('ct', -1)],
+    [('pid', 1), ('status', 1), ('ct', -1)],
+    [('uid', 1), ('ct', -1)],
+])
+
+
 # --------- 用户喜好
 col_favor = None
 def get_col_favor():
@@ -242,6 +318,13 @@ def get_motordb_col_fan_history():
     return motordb_col_fan_history
 
 
+db_index.declare_indexes('fan_history', get_motordb_col_fan_history, [
+    ([('from_uid', 1), ('to_uid', 1)], {'unique': True}),
+    [('from_uid', 1), ('ct', -1)],
+    [('to_uid', 1), ('ct', -1)],
+])
+
+
 # --------- 用户点赞历史记录
 col_like_history = None
 def get_col_like_history():
@@ -259,12 +342,19 @@ def get_motordb_col_like_history():
     return motordb_col_like_history
 
 
+db_index.declare_indexes('like_history', get_motordb_col_like_history, [
+    ([('from_uid', 1), ('oid', 1), ('otype', 1), ('action', 1)], {'unique': True}),
+    [('oid', 1), ('otype', 1), ('action', 1), ('contribute_score', -1), ('ct', -1)],
+    [('to_uid', 1), ('otype', 1), ('action', 1), ('ct', -1)],
+])
+
+
 # --------- 用户关注话题记录
 col_favor_tag_history = None
 def get_col_favor_tag_history():
     global col_favor_tag_history
     if not col_favor_tag_history:
-        col_favor_tag_history = mongo_async.mongo_collection(DB_COMMUNITY, 'favor_tag_history', config.DB_HOST, config.DB_PORT)
+        col_favor_tag_history = mongo_sync.mongo_collection(DB_COMMUNITY, 'favor_tag_history', config.DB_HOST, config.DB_PORT)
     return col_favor_tag_history
 
 
@@ -276,6 +366,12 @@ def get_motordb_col_favor_tag_history():
     return motordb_col_favor_tag_history
 
 
+db_index.declare_indexes('favor_tag_history', get_motordb_col_favor_tag_history, [
+    ([('tid', 1), ('uid', 1)], {'unique': True}),
+    [('uid', 1), ('ct', -1)],
+])
+
+
 # --------- APP配置信息
 col_app_conf = None
 def get_col_app_conf():
@@ -310,6 +406,11 @@ def get_motordb_col_notice():
     return motordb_col_notice
 
 
+db_index.declare_indexes('notices', get_motordb_col_notice, [
+    [('uid', 1), ('ntype', 1), ('status', 1), ('ct', -1)],
+])
+
+
 # ----------- 管理员信息表
 col_admin = None
 def get_col_admin():
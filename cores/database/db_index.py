@@ -0,0 +1,167 @@
+# -*- coding:utf-8 -*-
+"""
+mongo 索引注册: 集合索引声明、启动时后台创建缺失索引、检查未命中索引的查询
+"""
+from config import config
+from cores.utils import logger
+
+
+# 集合索引声明 {col_name: (motor集合获取方法, [(keys, options)])}
+COLLECTION_INDEXES = {}
+
+# 已报告过的未命中索引查询形状, 每种只报告一次
+reported_query_shapes = set()
+
+
+def declare_indexes(col_name, col_getter, indexes):
+    """
+    声明集合索引
+    :param col_name: 集合名
+    :param col_getter: motor 集合获取方法
+    :param indexes: [[(key, direction), ...]] 或 [([(key, direction), ...], {'unique': True})]
+    """
+    items = []
+    for index in indexes:
+        keys, options = (index[0], index[1]) if isinstance(index, tuple) else (index, {})
+        items.append((keys, options))
+    COLLECTION_INDEXES[col_name] = (col_getter, items)
+
+
+def build_index_name(keys):
+    """
+    与 mongo 默认规则一致的索引名, 如 uid_1_ct_-1
+    """
+    return '_'.join(['%s_%s' % (key, direction) for key, direction in keys])
+
+
+def build_index_key_spec(keys):
+    """
+    索引字段与方向, 用于判断索引是否已存在(与索引名无关)
+    """
+    return tuple([(key, int(direction) if isinstance(direction, float) else direction) for key, direction in keys])
+
+
+async def get_exist_index_key_specs(col):
+    """
+    获取集合已有索引的字段与方向
+    """
+    index_info = await col.index_information()
+    return set([build_index_key_spec(info['key']) for info in index_info.values()])
+
+
+async def get_missing_indexes(col_name):
+    """
+    获取集合缺失的声明索引
+    :return: [(keys, options)]
+    """
+    col_getter, items = COLLECTION_INDEXES[col_name]
+    exist_specs = await get_exist_index_key_specs(col_getter())
+    return [(keys, options) for keys, options in items if build_index_key_spec(keys) not in exist_specs]
+
+
+async def ensure_indexes():
+    """
+    后台逐个创建缺失的声明索引, 已存在相同字段的索引(不论名称)不重复创建
+    单个索引创建失败(如唯一索引存在重复数据)不影响其他索引
+    :return: {col_name: [新建索引名]}
+    """
+    result = {}
+    for col_name, (col_getter, _) in COLLECTION_INDEXES.items():
+        col = col_getter()
+        try:
+            missing_indexes = await get_missing_indexes(col_name)
+        except Exception as e:
+            logger.error('[db_index] %s index_information failed, %s' % (col_name, str(e)))
+            continue
+
+        for keys, options in missing_indexes:
+            name = build_index_name(keys)
+            try:
+                await col.create_index(keys, name=name, background=True, **options)
+            except Exception as e:
+                logger.error('[db_index] %s create index %s failed, %s' % (col_name, name, str(e)))
+                continue
+            result.setdefault(col_name, []).append(name)
+            logger.info('[db_index] %s create index %s' % (col_name, name))
+    return result
+
+
+async def remove_duplicate_docs(col, keys):
+    """
+    删除唯一索引字段重复的文档, 每组保留 _id 最小(最早写入)的一条, 创建唯一索引前使用
+    :param keys: 唯一索引字段 [(key, direction), ...]
+    :return: 删除的文档数
+    """
+    pipeline = [
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': {key: '$' + key for key, _ in keys}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    remove_ids = []
+    async for group in col.aggregate(pipeline, allowDiskUse=True):
+        remove_ids.extend(group['ids'][1:])
+
+    deleted_count = 0
+    for i in range(0, len(remove_ids), 1000):
+        ret = await col.delete_many({'_id': {'$in': remove_ids[i:i + 1000]}})
+        deleted_count += ret.deleted_count
+    return deleted_count
+
+
+def collect_query_fields(query_dict):
+    """
+    获取查询条件中用到的字段, 展开 $and/$or
+    """
+    fields = set()
+    for key, value in (query_dict or {}).items():
+        if key in ('$and', '$or'):
+            for sub_query in value:
+                fields |= collect_query_fields(sub_query)
+        elif not key.startswith('$'):
+            fields.add(key)
+    return fields
+
+
+def is_query_indexed(col_name, query_dict, sorts=None):
+    """
+    判断查询能否使用声明的索引: 索引前缀为查询字段, 随后的索引字段与排序一致(同向或整体反向)
+    只按 _id 查询或只以 _id 作为末尾排序键时视为可用
+    """
+    fields = collect_query_fields(query_dict)
+    sort_keys = [(key, direction) for key, direction in (sorts or []) if key != '_id']
+    if not sort_keys and (not fields or fields == {'_id'} or '_id' in fields):
+        return True
+    sort_fields = [key for key, _ in sort_keys]
+
+    for keys, _ in COLLECTION_INDEXES.get(col_name, (None, []))[1]:
+        # 等值/范围查询前缀
+        i = 0
+        while i < len(keys) and keys[i][0] in fields and keys[i][0] not in sort_fields:
+            i += 1
+        if i == 0 and not fields.issubset(sort_fields):
+            continue
+
+        # 排序字段
+        tail = keys[i:i + len(sort_keys)]
+        if [key for key, _ in tail] != sort_fields:
+            continue
+        signs = set([direction == sort_direction for (_, direction), (_, sort_direction) in zip(tail, sort_keys)])
+        if len(signs) <= 1:
+            return True
+    return False
+
+
+def report_unindexed_query(col_name, query_dict, sorts=None):
+    """
+    报告未命中声明索引的查询, 开启 config.DB_INDEX_CHECK 时生效
+    """
+    if not config.DB_INDEX_CHECK or col_name not in COLLECTION_INDEXES:
+        return
+
+    shape = (col_name, tuple(sorted(collect_query_fields(query_dict))), tuple(sorts or []))
+    if shape in reported_query_shapes:
+        return
+    reported_query_shapes.add(shape)
+
+    if not is_query_indexed(col_name, query_dict, sorts):
+        logger.warn('[db_index] unindexed query on %s, fields %s, sorts %s' % shape)
@@ -6,30 +6,53 @@ mongo 异步基础方法
 import motor.motor_tornado
 import logging
 from bson.json_util import dumps
+from pymongo import ReadPreference, WriteConcern
 from pymongo.errors import PyMongoError, AutoReconnect, OperationFailure, BulkWriteError
 
+from config import config
+from cores.database import pool_stats, db_index
+from cores.utils.query_profiler import profile_query
+
 
 # 共享连接池
 db_connection_map = {}
 
 
-def mongo_collection(db_name, col_name, host, port):
+def get_db_connection(host, port):
+    """
+    获取共享的 MotorClient, 连接池参数见 config.DB_POOL_SETTINGS
+    """
+    global db_connection_map
+    if not db_connection_map.get((host, port)):
+        listener = pool_stats.get_mongo_pool_listener('motor')
+        db_connection = motor.motor_tornado.MotorClient(host, port, event_listeners=[listener], **config.DB_POOL_SETTINGS)
+        db_connection_map[(host, port)] = db_connection
+    return db_connection_map[(host, port)]
+
+
+def build_collection_options(col_name, read_preference=None):
+    """
+    构造集合的读偏好、写关注参数, 见 config.DB_COLLECTION_SETTINGS
+    :param read_preference: 指定读偏好(ReadPreference 属性名), 优先于集合配置
+    """
+    col_settings = config.DB_COLLECTION_SETTINGS.get(col_name) or {}
+    options = {}
+    read_preference = read_preference or col_settings.get('read_preference')
+    if read_preference:
+        options['read_preference'] = getattr(ReadPreference, read_preference)
+    if col_settings.get('write_concern'):
+        options['write_concern'] = WriteConcern(**col_settings['write_concern'])
+    return options
+
+
+def mongo_collection(db_name, col_name, host, port, read_preference=None):
     """
     获取db.collection
+    :param read_preference: 读偏好, 如从库读取使用 'SECONDARY_PREFERRED'
     """
     try:
-        global db_connection_map
-        if not db_connection_map.get((host, port)):
-            pool_settings = {
-                'maxPoolSize': 100,  # default is 100
-                'minPoolSize': 5,  # default is 0
-            }
-            db_connection = motor.motor_tornado.MotorClient(host, port, **pool_settings)
-            db_connection_map[(host, port)] = db_connection
-
-        db_connection = db_connection_map[(host, port)]
-        db = db_connection.get_database(db_name)
-        col = db[col_name]
+        db = get_db_connection(host, port).get_database(db_name)
+        col = db.get_collection(col_name, **build_collection_options(col_name, read_preference))
     except AutoReconnect as e:
         logging.error('connect failed, host %s, port %d, %s' % (host, port, str(e)))
         return None
@@ -39,11 +62,10 @@ def mongo_collection(db_name, col_name, host, port):
 
 def mongo_db(db_name, host, port):
     """
-    获取db
+    获取db, 共享连接池
     """
     try:
-        db_connection = motor.motor_tornado.MotorClient(host, port)
-        db = db_connection.get_database(db_name)
+        db = get_db_connection(host, port).get_database(db_name)
     except AutoReconnect as e:
         logging.error('connect failed, host %s, port %d, %s' % (host, port, str(e)))
         return None
@@ -51,6 +73,7 @@ def mongo_db(db_name, host, port):
     return db
 
 
+@profile_query('insert_one')
 async def mongo_insert_one(col, item, returnid=False):
     """
     插入一条数据
@@ -67,6 +90,7 @@ async def mongo_insert_one(col, item, returnid=False):
         return False
 
 
+@profile_query('insert_many')
 async def mongo_insert_many(col, item, ordered=True):
     """
     插入多条数据
@@ -81,6 +105,7 @@ async def mongo_insert_many(col, item, ordered=True):
         return False
 
 
+@profile_query('find_one')
 async def mongo_find_one(col, query, projection=None):
     """
     查找一条数据
@@ -96,6 +121,7 @@ async def mongo_find_one(col, query, projection=None):
         return False
 
 
+@profile_query('update_many')
 async def mongo_update(col, query, update, up=False):
     """
     更新多条数据
@@ -108,6 +134,7 @@ async def mongo_update(col, query, update, up=False):
         return False
 
 
+@profile_query('update_one')
 async def mongo_update_one(col, query, update, up=False, returnid=False):
     """
     更新一条数据
@@ -123,6 +150,7 @@ async def mongo_update_one(col, query, update, up=False, returnid=False):
         return False
 
 
+@profile_query('delete_one')
 async def mongo_delete_one(col, query):
     """
     删除一条数据
@@ -135,10 +163,12 @@ async def mongo_delete_one(col, query):
         return False
 
 
+@profile_query('find')
 async def mongo_find(col, query, projection=None):
     """
     查找多条数据
     """
+    db_index.report_unindexed_query(col.name, query)
     try:
         if projection:
             cursor = col.find(query, projection=projection)
@@ -151,6 +181,7 @@ async def mongo_find(col, query, projection=None):
         return False
 
 
+@profile_query('find')
 async def mongo_find_limit(col, query, limit, projection=None):
     """
     查找多条数据（分页）
@@ -167,6 +198,7 @@ async def mongo_find_limit(col, query, limit, projection=None):
         return False
 
 
+@profile_query('count')
 async def mongo_find_count(col, query, limit=None):
     """
     统计数据数量
@@ -184,6 +216,7 @@ async def mongo_find_count(col, query, limit=None):
         return False
 
 
+@profile_query('find')
 async def mongo_find_sort(col, query, sort, projection=None):
     """
     查找多条数据（排序）
@@ -200,10 +233,12 @@ async def mongo_find_sort(col, query, sort, projection=None):
         return False
 
 
+@profile_query('find')
 async def mongo_find_sort_skip_limit(col, query, sort, skip, limit, projection=None):
     """
     查找多条数据（分页-排序）
     """
+    db_index.report_unindexed_query(col.name, query, sort)
     try:
         if projection:
             cursor = col.find(query, projection=projection).skip(skip).limit(limit)
@@ -218,6 +253,7 @@ async def mongo_find_sort_skip_limit(col, query, sort, skip, limit, projection=N
         return False
 
 
+@profile_query('find_one_and_update')
 async def mongo_find_one_and_update(col, query, update, upsert=False, return_document=True):
     """
     查找并修改一条数据
@@ -236,6 +272,7 @@ async def mongo_find_one_and_update(col, query, update, upsert=False, return_doc
         return None
 
 
+@profile_query('distinct')
 async def mongo_distinct(col, key, query_dict):
     """
     滤重查找
@@ -248,6 +285,7 @@ async def mongo_distinct(col, key, query_dict):
         return False
 
 
+@profile_query('delete_many')
 async def mongo_delete(col, query):
     """
     删除多条数据
@@ -260,6 +298,7 @@ async def mongo_delete(col, query):
         return False
 
 
+@profile_query('aggregate')
 async def mongo_aggregate(col, pipeline):
     """
     聚合查找
@@ -273,6 +312,7 @@ async def mongo_aggregate(col, pipeline):
         return False
 
 
+@profile_query('group')
 async def mongo_group(col, para_key, para_condition, para_initial, para_reduce):
     """
     分组查找
@@ -286,14 +326,26 @@ async def mongo_group(col, para_key, para_condition, para_initial, para_reduce):
         return False
 
 
-async def mongo_bulk_write(col, requests, ordered=True):
+@profile_query('bulk_write')
+async def mongo_bulk_write(col, requests, ordered=True, returnresult=False):
     """
     批量更新
+    :param returnresult: True 返回各操作实际生效的计数 {'upserted_count', 'deleted_count', 'modified_count', 'upserted_ids', 'error_count'}
+    upserted_ids 为 {操作序号: 新文档_id}, error_count 为失败的操作数
     """
     try:
-        await col.bulk_write(requests, ordered=ordered)
+        ret = await col.bulk_write(requests, ordered=ordered)
+        if returnresult:
+            return {'upserted_count': ret.upserted_count, 'deleted_count': ret.deleted_count, 'modified_count': ret.modified_count,
+                    'upserted_ids': ret.upserted_ids, 'error_count': 0}
         return True
     except BulkWriteError as bwe:
-        logging.error("mongo_bulk_write failed, updates %r, reason %s" % (requests, str(bwe.details[:1024])))
+        logging.error("mongo_bulk_write failed, updates %r, reason %s" % (requests, str(bwe.details)[:1024]))
+        if returnresult:
+            # 部分失败(如并发 upsert 唯一索引冲突)时返回已生效的计数
+            details = bwe.details
+            return {'upserted_count': details.get('nUpserted', 0), 'deleted_count': details.get('nRemoved', 0), 'modified_count': details.get('nModified', 0),
+                    'upserted_ids': {item['index']: item['_id'] for item in details.get('upserted', [])},
+                    'error_count': len(details.get('writeErrors', [])) + len(details.get('writeConcernErrors', []))}
         return False
 
@@ -5,6 +5,8 @@ mongo 同步基础方法
 
 from pymongo.errors import PyMongoError, AutoReconnect, OperationFailure, BulkWriteError
 from pymongo import MongoClient
+from config import config
+from cores.database import mongo_async, pool_stats
 from cores.utils import logger
 from bson.json_util import dumps
 
@@ -19,17 +21,14 @@ def mongo_collection(db_name, col_name, host, port):
     try:
         global db_connection_map
         if not db_connection_map.get((host, port)):
-            pool_settings = {
-                'maxPoolSize': 100,  # default is 100
-                'minPoolSize': 0,  # default is 0
-            }
-            db_connection = MongoClient(host, port, **pool_settings)
+            listener = pool_stats.get_mongo_pool_listener('pymongo')
+            db_connection = MongoClient(host, port, event_listeners=[listener], **config.DB_SYNC_POOL_SETTINGS)
             db_connection_map[(host, port)] = db_connection
     except AutoReconnect as e:
         logger.error('connect failed, host %s, port %d, %s' % (host, port, str(e)))
         return None
     database = db_connection_map[(host, port)].get_database(db_name)
-    return database.get_collection(col_name)
+    return database.get_collection(col_name, **mongo_async.build_collection_options(col_name))
 
 
 def mongo_insert_one(col, item):
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""
+连接池统计: mongo 连接池事件计数、aioredis 连接池占用
+"""
+from pymongo import monitoring
+
+
+class MongoPoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    mongo 连接池事件监听, 按 (客户端名称, 服务地址) 统计
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # {address: {}}
+        self.stats = {}
+
+    def _get(self, address):
+        address = '%s:%s' % address
+        item = self.stats.get(address)
+        if item is None:
+            item = self.stats[address] = {
+                'connections': 0,       # 当前连接数
+                'checked_out': 0,       # 使用中连接数
+                'waiting': 0,           # 等待获取连接数
+                'max_waiting': 0,       # 最大等待数
+                'check_out_failed': 0,  # 获取连接失败(超时等)次数
+            }
+        return item
+
+    def pool_created(self, event):
+        self._get(event.address)
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        self.stats.pop('%s:%s' % event.address, None)
+
+    def connection_created(self, event):
+        self._get(event.address)['connections'] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        item = self._get(event.address)
+        item['connections'] = max(item['connections'] - 1, 0)
+
+    def connection_check_out_started(self, event):
+        item = self._get(event.address)
+        item['waiting'] += 1
+        item['max_waiting'] = max(item['max_waiting'], item['waiting'])
+
+    def connection_check_out_failed(self, event):
+        item = self._get(event.address)
+        item['waiting'] = max(item['waiting'] - 1, 0)
+        item['check_out_failed'] += 1
+
+    def connection_checked_out(self, event):
+        item = self._get(event.address)
+        item['waiting'] = max(item['waiting'] - 1, 0)
+        item['checked_out'] += 1
+
+    def connection_checked_in(self, event):
+        item = self._get(event.address)
+        item['checked_out'] = max(item['checked_out'] - 1, 0)
+
+
+# 已注册的 mongo 连接池监听 {name: listener}
+mongo_pool_listeners = {}
+
+# 已注册的 aioredis 连接池 [(name, redis)]
+aioredis_pools = []
+
+
+def get_mongo_pool_listener(name):
+    """
+    获取 mongo 连接池监听, 创建客户端时传入 event_listeners
+    """
+    if name not in mongo_pool_listeners:
+        mongo_pool_listeners[name] = MongoPoolStatsListener(name)
+    return mongo_pool_listeners[name]
+
+
+def register_aioredis_pool(name, my_redis):
+    """
+    注册 aioredis 连接池
+    """
+    aioredis_pools.append((name, my_redis))
+
+
+def get_pool_stats():
+    """
+    获取所有连接池统计
+    """
+    mongo_stats = {}
+    for name, listener in mongo_pool_listeners.items():
+        mongo_stats[name] = {address: dict(item) for address, item in listener.stats.items()}
+
+    redis_stats = []
+    for name, my_redis in aioredis_pools:
+        pool = my_redis.connection
+        redis_stats.append({
+            'name': name,
+            'size': pool.size,
+            'in_use': pool.size - pool.freesize,
+            'minsize': pool.minsize,
+            'maxsize': pool.maxsize,
+        })
+
+    return {
+        'mongo': mongo_stats,
+        'redis': redis_stats,
+    }
@@ -2,10 +2,11 @@
 """
 favor service 方法
 """
-import copy
 import time
+import asyncio
 
 from bson import ObjectId
+from pymongo import UpdateOne, DeleteOne
 
 from cores.const import const_mix, const_base
 from cores.database import db, mongo_async
@@ -14,11 +15,174 @@ from cores.base import base_service
 from cores.user import user_service
 from cores.comment import comment_service
 from cores.post import post_service
+from cores.follow import follow_service
+from cores.utils import json_codec
+from cores.utils.counter_aggregator import counter_aggregator
+from cores.utils.entity_cache import AioEntityCache
+
+# 最后阅读通知时间的 redis 镜像, 供小红点轮询使用
+LAST_READ_NOTICE_CT_KEY = 'user(%s)_last_read_notice_ct'
+LAST_READ_NOTICE_CT_EXPIRE = 60 * 60 * 24 * 7
+
+# 用户赞踩状态缓存(hash: oid -> action), 按 (uid, otype) 区分, 0 表示已取消赞踩
+# 超过 LIKE_STATE_MAX_LEN 个字段时整体删除, 读取时回源重建
+LIKE_STATE_KEY = 'like_state_%s_%s'
+LIKE_STATE_EXPIRE = 60 * 60 * 24 * 7
+LIKE_STATE_MAX_LEN = 2000
+LIKE_STATE_NONE = 0
+
+# 浏览过但无赞踩的 oid(set), 按 (uid, otype) 区分, 创建后固定时间过期, 读取不续期
+LIKE_STATE_NONE_KEY = 'like_state_none_%s_%s'
+LIKE_STATE_NONE_EXPIRE = 60 * 10
+
+# 读取赞踩状态, 状态缓存缺失时查询无赞踩集合
+# KEYS[1]: 状态缓存, KEYS[2]: 无赞踩集合; ARGV: oid 列表
+LIKE_STATE_GET_SCRIPT = """
+local states = redis.call('HMGET', KEYS[1], unpack(ARGV))
+for i, oid in ipairs(ARGV) do
+    if not states[i] and redis.call('SISMEMBER', KEYS[2], oid) == 1 then
+        states[i] = '0'
+    end
+end
+return states
+"""
+
+# 回填赞踩状态: 只回填状态缓存中缺失的字段, 不覆盖并发写入的新状态; 无赞踩写入集合
+# KEYS[1]: 状态缓存, KEYS[2]: 无赞踩集合
+# ARGV: 过期时间, 无赞踩集合过期时间, 字段数上限, 无赞踩, oid1, 状态1, oid2, 状态2, ...
+LIKE_STATE_FILL_SCRIPT = """
+for i = 5, #ARGV, 2 do
+    if ARGV[i + 1] ~= ARGV[4] then
+        redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+    elseif redis.call('HEXISTS', KEYS[1], ARGV[i]) == 0 then
+        redis.call('SADD', KEYS[2], ARGV[i])
+    end
+end
+if redis.call('HLEN', KEYS[1]) > tonumber(ARGV[3]) then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if redis.call('TTL', KEYS[2]) == -1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# 取消赞踩: 缓存为该动作或缓存缺失时置为无赞踩, 防止并发回源写入旧状态
+# KEYS[1]: 缓存key; ARGV[1]: oid, ARGV[2]: 取消的动作, ARGV[3]: 无赞踩, ARGV[4]: 过期时间
+LIKE_STATE_CANCEL_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], ARGV[1])
+if not state or state == ARGV[2] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# 赞我的收件箱: 点赞时写入预渲染的精简条目(点赞者、内容摘要与 ct), 通知页一次范围读取, 按 uid 区分
+# 条目顺序(zset: hid -> ct), 同一 ct 按 hid 倒序, 与 like_history 的 (ct, _id) 倒序一致
+# 条目内容(hash: hid -> 条目json, 反查字段 -> hid, 以及标识字段)
+LIKE_INBOX_KEY = 'like_inbox_%s'
+LIKE_INBOX_ENTRY_KEY = 'like_inbox_entry_%s'
+LIKE_INBOX_EXPIRE = 60 * 60 * 24 * 7
+# 收件箱最多保留的条目数, 更早的记录回源数据库分页
+LIKE_INBOX_MAX_LEN = 500
+# 反查字段: (点赞者, 内容) -> hid, 取消赞时使用
+LIKE_INBOX_REVERSE_FIELD = 'r_%s_%s_%s'
+# 收件箱已构建标识, 收件箱为空时仍然存在
+LIKE_INBOX_BUILT_FIELD = '_built'
+# 收件箱已截断标识: 数据库中可能存在收件箱之外的更早记录
+LIKE_INBOX_TRUNCATED_FIELD = '_truncated'
+# 条目中帖子、评论文本摘要长度
+LIKE_INBOX_TEXT_LEN = 60
+
+# 收件箱已构建时写入条目, 超出长度上限时删除最早的条目并标记截断
+# KEYS[1]: 条目顺序, KEYS[2]: 条目内容
+# ARGV: hid, ct, 条目json, 反查字段, 长度上限, 过期时间, 已构建标识, 已截断标识
+LIKE_INBOX_PUSH_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], ARGV[7]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[4], ARGV[1])
+local overflow = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[5])
+if overflow > 0 then
+    local hids = redis.call('ZRANGE', KEYS[1], 0, overflow - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, overflow - 1)
+    for _, hid in ipairs(hids) do
+        local entry = redis.call('HGET', KEYS[2], hid)
+        if entry then
+            redis.call('HDEL', KEYS[2], cjson.decode(entry)['r'])
+        end
+        redis.call('HDEL', KEYS[2], hid)
+    end
+    redis.call('HSET', KEYS[2], ARGV[8], 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+# 取消赞时按反查字段删除条目
+# KEYS[1]: 条目顺序, KEYS[2]: 条目内容; ARGV[1]: 反查字段
+LIKE_INBOX_PULL_SCRIPT = """
+local hid = redis.call('HGET', KEYS[2], ARGV[1])
+if hid then
+    redis.call('ZREM', KEYS[1], hid)
+    redis.call('HDEL', KEYS[2], hid, ARGV[1])
+end
+return 1
+"""
+
+# 按 (ct, hid) 倒序 seek 读取一页条目, 收件箱未构建时返回 nil
+# KEYS[1]: 条目顺序, KEYS[2]: 条目内容; ARGV: 上一页末尾hid, 上一页末尾ct, 读取数目, 已构建标识, 已截断标识
+# 返回 {是否已截断, 条目json, ...}
+LIKE_INBOX_READ_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], ARGV[4]) == 0 then
+    return false
+end
+local limit = tonumber(ARGV[3])
+local hids = {}
+if ARGV[1] == '' then
+    hids = redis.call('ZREVRANGE', KEYS[1], 0, limit - 1)
+else
+    -- 跳过 ct 相同且 hid 不小于上一页末尾的条目
+    local seek_ct = tonumber(ARGV[2])
+    local offset = 0
+    while #hids < limit do
+        local items = redis.call('ZREVRANGEBYSCORE', KEYS[1], seek_ct, '-inf', 'WITHSCORES', 'LIMIT', offset, limit)
+        if #items == 0 then
+            break
+        end
+        for i = 1, #items, 2 do
+            if #hids < limit and (tonumber(items[i + 1]) < seek_ct or items[i] < ARGV[1]) then
+                hids[#hids + 1] = items[i]
+            end
+        end
+        offset = offset + #items / 2
+    end
+end
+local result = {redis.call('HEXISTS', KEYS[2], ARGV[5])}
+if #hids > 0 then
+    local entries = redis.call('HMGET', KEYS[2], unpack(hids))
+    for i = 1, #hids do
+        if entries[i] then
+            result[#result + 1] = entries[i]
+        end
+    end
+end
+return result
+"""
+
+# 用户喜好信息缓存, 供 get_favor_map_by_ids/get_user_favor 使用, 计数落库后失效
+favor_entity_cache = AioEntityCache('favor', local_max_size=4096, local_ttl=30, expire_time=60*10)
 
 
 async def initial_user_favor_info(uid):
     """
-    初始化或更新用户喜好信息
+    初始化或更新用户喜好信息, 为写操作, 只在登录、注册时调用, 读取路径使用 get_viewer_favor_info
     :return:
     """
     if not uid:
@@ -28,8 +192,8 @@ async def initial_user_favor_info(uid):
     favor_col = db.get_motordb_col_favor()
     init_set_dict = {
         'uid': uid,
-        'f_tids': [],       # 已关注 tag_id 列表
-        'f_uids': [],       # 已关注 user_id 列表
+        'f_tag_num': 0,     # 关注话题数, 关注关系见 follow_service
+        'f_user_num': 0,    # 关注用户数
         'fans_num': 0,      # 粉丝数
         'post_num': 0,      # 帖子数
         'comment_num': 0,   # 评论数
@@ -40,14 +204,48 @@ async def initial_user_favor_info(uid):
     update_dict = {'$setOnInsert': init_set_dict}
 
     favor = await mongo_async.mongo_find_one_and_update(favor_col, {'_id': ObjectId(uid)}, update_dict, upsert=True, return_document=True)
-    return favor
+    await favor_entity_cache.evict(uid)
+    return counter_aggregator.overlay('favor', favor)
 
 
 async def get_user_liked_disliked_oids(uid, oids, otype):
     """
-    获取用户赞踩关系
+    获取用户赞踩关系, 优先读取缓存, 缺失的 oid 回源数据库并回填
     :return:
     """
+    oids = list(set(oids))
+    if not (uid and oids):
+        return [], []
+
+    keys = [LIKE_STATE_KEY % (uid, otype), LIKE_STATE_NONE_KEY % (uid, otype)]
+    states = await db.func_aioredis.eval(LIKE_STATE_GET_SCRIPT, keys=keys, args=oids)
+    state_map = {oid: int(state) for oid, state in zip(oids, states) if state is not None}
+
+    # 回源缺失的 oid
+    miss_oids = [oid for oid in oids if oid not in state_map]
+    if miss_oids:
+        load_state_map = await load_user_like_state_map(uid, miss_oids, otype)
+        args = [LIKE_STATE_EXPIRE, LIKE_STATE_NONE_EXPIRE, LIKE_STATE_MAX_LEN, LIKE_STATE_NONE]
+        for oid, state in load_state_map.items():
+            args.extend([oid, state])
+        await db.func_aioredis.eval(LIKE_STATE_FILL_SCRIPT, keys=keys, args=args)
+        state_map.update(load_state_map)
+
+    like_cids, disliked_cids = [], []
+    for oid in oids:
+        if state_map[oid] == const_mix.F_ACTION_TYPE_LIKE:
+            like_cids.append(oid)
+        elif state_map[oid] == const_mix.F_ACTION_TYPE_DISLIKE:
+            disliked_cids.append(oid)
+
+    return like_cids, disliked_cids
+
+
+async def load_user_like_state_map(uid, oids, otype):
+    """
+    从数据库获取用户赞踩状态
+    :return: {oid: action}, 无赞踩为 LIKE_STATE_NONE
+    """
     query_dict = {
         'from_uid': uid,
         'oid': {
@@ -56,16 +254,13 @@ async def get_user_liked_disliked_oids(uid, oids, otype):
         'otype': otype,
     }
     like_his_col = db.get_motordb_col_like_history()
-    like_hiss = await mongo_async.mongo_find(like_his_col, query_dict)
+    like_hiss = await mongo_async.mongo_find(like_his_col, query_dict, projection={'oid': True, 'action': True})
 
-    like_cids, disliked_cids = [], []
+    state_map = {oid: LIKE_STATE_NONE for oid in oids}
     for like_his in like_hiss:
-        if like_his['action'] == const_mix.F_ACTION_TYPE_LIKE:
-            like_cids.append(like_his['oid'])
-        elif like_his['action'] == const_mix.F_ACTION_TYPE_DISLIKE:
-            disliked_cids.append(like_his['oid'])
-
-    return like_cids, disliked_cids
+        if like_his['action'] in (const_mix.F_ACTION_TYPE_LIKE, const_mix.F_ACTION_TYPE_DISLIKE):
+            state_map[like_his['oid']] = like_his['action']
+    return state_map
 
 
 async def get_user_liked_disliked_pids(uid, pids):
@@ -77,13 +272,16 @@ async def get_user_liked_disliked_pids(uid, pids):
     return like_cids, disliked_cids
 
 
-async def increase_favor_count_stat(uid, post_num_inc_num=0, comment_num_inc_num=0, fans_num_inc_num=0):
+async def increase_favor_count_stat(uid, post_num_inc_num=0, comment_num_inc_num=0, fans_num_inc_num=0,
+                                    f_user_num_inc_num=0, f_tag_num_inc_num=0):
     """
     修改tag的计数字段
     :param uid: 用户ID
     :param post_num_inc_num: 发帖新增数
     :param comment_num_inc_num: 发评论新增数
     :param fans_num_inc_num: 粉丝新增数
+    :param f_user_num_inc_num: 关注用户新增数
+    :param f_tag_num_inc_num: 关注话题新增数
     :return:
     """
 
@@ -98,19 +296,18 @@ async def increase_favor_count_stat(uid, post_num_inc_num=0, comment_num_inc_num
     if fans_num_inc_num:
         inc_dict['fans_num'] = fans_num_inc_num
 
+    if f_user_num_inc_num:
+        inc_dict['f_user_num'] = f_user_num_inc_num
+
+    if f_tag_num_inc_num:
+        inc_dict['f_tag_num'] = f_tag_num_inc_num
+
     # 更新修改时间
     set_dict = {'ut': int(time.time())}
 
-    # 保存修改数据
-    update_dict = {}
-    if inc_dict:
-        update_dict['$inc'] = inc_dict
-    if set_dict:
-        update_dict['$set'] = set_dict
-
-    if update_dict:
-        favor_col = db.get_motordb_col_favor()
-        await mongo_async.mongo_update_one(favor_col, {'_id': ObjectId(uid)}, update_dict)
+    # 保存修改数据, 合并后定时落库
+    favor_col = db.get_motordb_col_favor()
+    counter_aggregator.increase(favor_col, uid, inc_dict, set_dict)
 
     return uid
 
@@ -130,47 +327,14 @@ async def user_follow_user(current_uid, new_uid):
     :return:
     """
 
-    favor_col = db.get_motordb_col_favor()
-    update_dict = {
-        '$addToSet': {
-            'f_uids': new_uid
-        },
-        '$set': {
-            'ut': int(time.time()),
-        }
-    }
-    old_favor = await mongo_async.mongo_find_one_and_update(favor_col, {'_id': ObjectId(current_uid)}, update_dict, upsert=False, return_document=False)
-
-    # 重复添加直接返回
-    if old_favor and new_uid in old_favor['f_uids']:
+    # 新增关注边, 重复添加直接返回
+    if not await follow_service.follow(follow_service.FOLLOW_TYPE_USER, current_uid, new_uid):
         return
 
-    # 增加粉丝数目
+    # 增加关注数、粉丝数目
+    await increase_favor_count_stat(current_uid, f_user_num_inc_num=1)
     await increase_favor_count_stat(new_uid, fans_num_inc_num=1)
 
-    # 增加粉丝关注历史
-    await create_new_fans_history(current_uid, new_uid)
-
-
-async def create_new_fans_history(from_uid, to_uid):
-    """
-    创建粉丝关注历史
-    :param from_uid:  关注方 uid
-    :param to_uid:   被关注方 uid
-    :return:
-    """
-    fan_his_col = db.get_motordb_col_fan_history()
-
-    query_dict = build_fans_history_query_dict(from_uid, to_uid)
-
-    new_fan_his = {
-        'from_uid': from_uid,
-        'to_uid': to_uid,
-        'ct': int(time.time()),
-    }
-
-    await mongo_async.mongo_find_one_and_update(fan_his_col, query_dict, {'$setOnInsert': new_fan_his}, upsert=True)
-
 
 def build_fans_history_query_dict(from_uid='', to_uid=''):
     """
@@ -191,138 +355,44 @@ async def user_no_follow_user(current_uid, uid):
     :return:
     """
 
-    update_dict = {
-        '$pull': {
-            'f_uids': uid
-        },
-        '$set': {
-            'ut': int(time.time()),
-        }
-    }
-    favor_col = db.get_motordb_col_favor()
-    old_favor = await mongo_async.mongo_find_one_and_update(favor_col, {'_id': ObjectId(current_uid)}, update_dict, upsert=False, return_document=False)
-
-    # 重复取消关注直接返回
-    if old_favor and uid not in old_favor['f_uids']:
+    # 删除关注边, 重复取消关注直接返回
+    if not await follow_service.unfollow(follow_service.FOLLOW_TYPE_USER, current_uid, uid):
         return
 
-    # 减去粉丝数目
+    # 减去关注数、粉丝数目
+    await increase_favor_count_stat(current_uid, f_user_num_inc_num=-1)
     await increase_favor_count_stat(uid, fans_num_inc_num=-1)
 
-    # 删除粉丝关注历史
-    await delete_fans_history(current_uid, uid)
-
-
-async def delete_fans_history(from_uid, to_uid):
-    """
-    删除粉丝关注历史
-    :param from_uid:  关注方 uid
-    :param to_uid:   被关注方 uid
-    :return:
-    """
-    fan_his_col = db.get_motordb_col_fan_history()
-
-    query_dict = build_fans_history_query_dict(from_uid, to_uid)
-
-    await mongo_async.mongo_delete_one(fan_his_col, query_dict)
-
 
 async def user_follow_tag(current_uid, tid):
     """
-    当前用户批量关注一批话题
+    当前用户关注话题
     :return:
     """
 
-    # 增加关注列表
-    update_dict = {
-        '$addToSet': {
-            'f_tids': tid
-        },
-        '$set': {
-            'ut': int(time.time()),
-        }
-    }
-
-    favor_col = db.get_motordb_col_favor()
-    old_favor = await mongo_async.mongo_find_one_and_update(favor_col, {'_id': ObjectId(current_uid)}, update_dict, upsert=False, return_document=False)
-
-    # 重复关注直接返回
-    if old_favor and tid in old_favor['f_tids']:
+    # 新增关注边, 重复关注直接返回
+    if not await follow_service.follow(follow_service.FOLLOW_TYPE_TAG, current_uid, tid):
         return
 
-    # 更新标签关注数目
+    # 更新用户、标签关注数目
+    await increase_favor_count_stat(current_uid, f_tag_num_inc_num=1)
     await tag_service.increase_tag_count_stat(tid_or_tids=tid, favor_num_inc=1)
 
-    # 创建关注历史
-    await create_new_favor_tag_history(tid, current_uid)
-
-
-async def create_new_favor_tag_history(tid, uid):
-    """
-    创建用户关注主题历史记录
-    :param tid:  话题ID
-    :param uid:  用户ID
-    :return:
-    """
-    favor_tag_his_col = db.get_motordb_col_favor_tag_history()
-
-    query_dict = {
-        'tid': tid,
-        'uid': uid,
-    }
-
-    ct = int(time.time())
-    new_his = copy.deepcopy(query_dict)
-    new_his['ct'] = ct
-    new_his['ut'] = ct
-
-    await mongo_async.mongo_find_one_and_update(favor_tag_his_col, query_dict, {'$setOnInsert': new_his}, upsert=True)
-
 
 async def user_no_follow_tag(current_uid, tid):
     """
-    当前用户批量关注一批话题
+    当前用户取消关注话题
     :return:
     """
 
-    # 修改帖子ID列表
-    update_dict = {
-        '$pull': {
-            'f_tids': tid
-        },
-        '$set': {
-            'ut': int(time.time()),
-        },
-    }
-
-    favor_col = db.get_motordb_col_favor()
-    old_favor = await mongo_async.mongo_find_one_and_update(favor_col, {'_id': ObjectId(current_uid)}, update_dict, upsert=False, return_document=False)
-
-    # 重复取消直接返回
-    if old_favor and tid not in old_favor['f_tids']:
+    # 删除关注边, 重复取消直接返回
+    if not await follow_service.unfollow(follow_service.FOLLOW_TYPE_TAG, current_uid, tid):
         return
 
-    # 更新标签关注数目
+    # 更新用户、标签关注数目
+    await increase_favor_count_stat(current_uid, f_tag_num_inc_num=-1)
     await tag_service.increase_tag_count_stat(tid_or_tids=tid, favor_num_inc=-1)
 
-    # 删除关注主题关系
-    await delete_favor_tag_history(tid, current_uid)
-
-
-async def delete_favor_tag_history(tid, uid):
-    """
-    删除用户关注主题历史
-    :return:
-    """
-    favor_tag_his_col = db.get_motordb_col_favor_tag_history()
-
-    query_dict = {
-        'tid': tid,
-        'uid': uid,
-    }
-
-    await mongo_async.mongo_delete_one(favor_tag_his_col, query_dict)
-
 
 async def increase_user_favor_num_stat(uid, likes_post_to_me_inc_num=0, liked_post_inc_num=0,
                                        likes_cmt_to_me_inc_num=0, liked_cmt_inc_num=0):
@@ -342,18 +412,12 @@ async def increase_user_favor_num_stat(uid, likes_post_to_me_inc_num=0, liked_po
     if liked_cmt_inc_num:
         inc_dict['liked_cmt_num'] = liked_cmt_inc_num
 
-    # 保存修改数据
-    update_dict = {}
-    if inc_dict:
-        update_dict['$inc'] = inc_dict
-
-    if not update_dict:
+    if not inc_dict:
         return
 
-    # 查询请求
-    query_dict = {'_id': ObjectId(uid)}
+    # 保存修改数据, 合并后定时落库
     favor_col = db.get_motordb_col_favor()
-    await mongo_async.mongo_update_one(favor_col, query_dict, update_dict)
+    counter_aggregator.increase(favor_col, uid, inc_dict)
 
 
 async def like_post_for_handler(uid, pid, p_uid):
@@ -361,26 +425,7 @@ async def like_post_for_handler(uid, pid, p_uid):
     帖子点赞
     :return: 
     """
-    # 历史点踩记录
-    like_pids, disliked_pids = await get_user_liked_disliked_pids(uid, [pid])
-
-    # 新增赞
-    if not like_pids:
-        # 增加点赞记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_LIKE)
-        # 帖子点赞计数
-        await post_service.increase_post_count_stat(pid, likes_inc_num=1)
-        # 作者获赞计数
-        await increase_user_favor_num_stat(p_uid, likes_post_to_me_inc_num=1)
-        # 读者点赞计数
-        await increase_user_favor_num_stat(uid, liked_post_inc_num=1)
-
-    # 取消踩
-    if disliked_pids:
-        # 帖子点踩计数
-        await post_service.increase_post_count_stat(pid, dislikes_inc_num=-1)
-        # 取消点踩记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
+    return await apply_like_transition(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_LIKE)
 
 
 async def cancel_like_post_for_handler(uid, pid, p_uid):
@@ -388,19 +433,7 @@ async def cancel_like_post_for_handler(uid, pid, p_uid):
     帖子取消点赞
     :return: 
     """
-    # 历史点踩记录
-    like_pids, disliked_pids = await get_user_liked_disliked_pids(uid, [pid])
-
-    # 取消赞
-    if like_pids:
-        # 删除点赞记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
-        # 减少帖子点赞计数
-        await post_service.increase_post_count_stat(pid, likes_inc_num=-1)
-        # 减少作者获赞计数
-        await increase_user_favor_num_stat(p_uid, likes_post_to_me_inc_num=-1)
-        # 减少读者点赞计数
-        await increase_user_favor_num_stat(uid, liked_post_inc_num=-1)
+    return await apply_like_transition(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
 
 
 async def dislike_post_for_handler(uid, pid, p_uid):
@@ -408,26 +441,7 @@ async def dislike_post_for_handler(uid, pid, p_uid):
     帖子点踩
     :return: 
     """
-    # 历史点踩记录
-    like_pids, disliked_pids = await get_user_liked_disliked_pids(uid, [pid])
-
-    # 新增踩
-    if not disliked_pids:
-        # 增加点踩记录
-        await post_service.increase_post_count_stat(pid, dislikes_inc_num=1)
-        # 增加点踩记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_DISLIKE)
-
-    # 取消赞
-    if like_pids:
-        # 减少点赞计数
-        await post_service.increase_post_count_stat(pid, likes_inc_num=-1)
-        # 删除点赞记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
-        # 减少作者获赞数
-        await increase_user_favor_num_stat(p_uid, likes_post_to_me_inc_num=-1)
-        # 减少读者点赞数
-        await increase_user_favor_num_stat(uid, liked_post_inc_num=-1)
+    return await apply_like_transition(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_DISLIKE)
 
 
 async def cancel_dislike_post_for_handler(uid, pid, p_uid):
@@ -435,15 +449,7 @@ async def cancel_dislike_post_for_handler(uid, pid, p_uid):
     取消帖子点踩
     :return: 
     """
-    # 历史点踩记录
-    like_pids, disliked_pids = await get_user_liked_disliked_pids(uid, [pid])
-
-    # 取消点踩
-    if disliked_pids:
-        # 点踩计数
-        await post_service.increase_post_count_stat(pid, dislikes_inc_num=-1)
-        # 删除点踩记录
-        await update_like_dislike_history(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
+    return await apply_like_transition(uid, p_uid, pid, const_mix.CONTENT_TYPE_POST_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
 
 
 async def like_cmt_for_handler(uid, cid, c_uid):
@@ -451,25 +457,7 @@ async def like_cmt_for_handler(uid, cid, c_uid):
     评论点赞
     :return: 
     """
-    like_cids, disliked_cids = await get_user_liked_disliked_cids(uid, [cid])
-
-    # 新增点赞
-    if not like_cids:
-        # 增加点赞计数
-        await comment_service.increase_comment_count_stat(cid, likes_inc_num=1)
-        # 增加点赞历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_LIKE)
-        # 增加作者获赞计数
-        await increase_user_favor_num_stat(c_uid, likes_cmt_to_me_inc_num=1)
-        # 增加读者点赞计数
-        await increase_user_favor_num_stat(uid, liked_cmt_inc_num=1)
-
-    # 取消踩
-    if disliked_cids:
-        # 减少点踩计数
-        await comment_service.increase_comment_count_stat(cid, dislikes_inc_num=-1)
-        # 删除点踩历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
+    return await apply_like_transition(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_LIKE)
 
 
 async def cancel_like_cmt_for_handler(uid, cid, c_uid):
@@ -477,18 +465,7 @@ async def cancel_like_cmt_for_handler(uid, cid, c_uid):
     取消评论点赞
     :return: 
     """
-    like_cids, disliked_cids = await get_user_liked_disliked_cids(uid, [cid])
-
-    # 取消点赞
-    if like_cids:
-        # 减少点赞计数
-        await comment_service.increase_comment_count_stat(cid, likes_inc_num=-1)
-        # 删除点赞历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
-        # 减少作者获赞计数
-        await increase_user_favor_num_stat(c_uid, likes_cmt_to_me_inc_num=-1)
-        # 减少读者点赞计数
-        await increase_user_favor_num_stat(uid, liked_cmt_inc_num=-1)
+    return await apply_like_transition(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
 
 
 async def dislike_cmt_for_handler(uid, cid, c_uid):
@@ -496,97 +473,333 @@ async def dislike_cmt_for_handler(uid, cid, c_uid):
     评论点踩
     :return: 
     """
-    like_cids, disliked_cids = await get_user_liked_disliked_cids(uid, [cid])
-
-    # 评论点踩
-    if not disliked_cids:
-        # 增加点踩计数
-        await comment_service.increase_comment_count_stat(cid, dislikes_inc_num=1)
-        # 增加点踩历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_DISLIKE)
-
-    # 取消点赞
-    if like_cids:
-        # 减少点赞计数
-        await comment_service.increase_comment_count_stat(cid, likes_inc_num=-1)
-        # 删除点赞历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_LIKE)
-        # 减少作者获赞计数
-        await increase_user_favor_num_stat(c_uid, likes_cmt_to_me_inc_num=-1)
-        # 减少读者点赞计数
-        await increase_user_favor_num_stat(uid, liked_cmt_inc_num=-1)
+    return await apply_like_transition(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_DISLIKE)
 
 
 async def cancel_dislike_cmt_for_handler(uid, cid, c_uid):
     """
-    取消点踩
-    :param uid: 
-    :param cid: 
-    :param c_uid: 
+    取消评论点踩
     :return: 
     """
-    like_cids, disliked_cids = await get_user_liked_disliked_cids(uid, [cid])
+    return await apply_like_transition(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
+
+
+# 赞踩动作对应的状态转换: (写入的赞踩记录, 删除的赞踩记录)
+LIKE_TRANSITIONS = {
+    const_mix.F_ACTION_TYPE_LIKE: (const_mix.F_ACTION_TYPE_LIKE, const_mix.F_ACTION_TYPE_DISLIKE),
+    const_mix.F_ACTION_TYPE_CANCEL_LIKE: (None, const_mix.F_ACTION_TYPE_LIKE),
+    const_mix.F_ACTION_TYPE_DISLIKE: (const_mix.F_ACTION_TYPE_DISLIKE, const_mix.F_ACTION_TYPE_LIKE),
+    const_mix.F_ACTION_TYPE_CANCEL_DISLIKE: (None, const_mix.F_ACTION_TYPE_DISLIKE),
+}
+
+
+async def apply_like_transition(from_uid, to_uid, oid, otype, action):
+    """
+    赞踩状态转换: 一次 bulk_write 写入、删除赞踩记录, 按实际生效的写入结果并发修改计数与状态缓存
+    重复请求(如连续点击)不会重复计数
+    :param from_uid: 赞踩发出者
+    :param to_uid: 内容作者
+    :param oid: 帖子或评论ID
+    :param otype: UGC 类型
+    :param action: 赞、取消赞、踩、取消踩
+    :return: (新增的动作, 删除的动作), 未生效为 None
+    """
+    add_action, remove_action = LIKE_TRANSITIONS[action]
+
+    # 赞踩记录, 赞与踩互斥
+    requests = []
+    if add_action:
+        query_dict = build_like_history_query_dict(from_uid, to_uid, oid, otype, action=add_action)
+        new_like_his = {
+            'from_uid': from_uid,
+            'to_uid': to_uid,
+            'oid': oid,
+            'otype': otype,
+            'action': add_action,
+            'ct': int(time.time()),
+        }
+        requests.append(UpdateOne(query_dict, {'$setOnInsert': new_like_his}, upsert=True))
+    requests.append(DeleteOne(build_like_history_query_dict(from_uid, to_uid, oid, otype, action=remove_action)))
+
+    like_his_col = db.get_motordb_col_like_history()
+    ret = await mongo_async.mongo_bulk_write(like_his_col, requests, ordered=False, returnresult=True)
+    added = add_action if ret and ret['upserted_count'] else None
+    removed = remove_action if ret and ret['deleted_count'] else None
+
+    # 赞我的收件箱
+    inbox_jobs = []
+    if added == const_mix.F_ACTION_TYPE_LIKE and 0 in ret['upserted_ids']:
+        inbox_jobs.append(push_like_inbox(dict(new_like_his, _id=ret['upserted_ids'][0])))
+    if removed == const_mix.F_ACTION_TYPE_LIKE:
+        inbox_jobs.append(pull_like_inbox(from_uid, to_uid, oid, otype))
+
+    # 计数变化
+    likes_inc = int(added == const_mix.F_ACTION_TYPE_LIKE) - int(removed == const_mix.F_ACTION_TYPE_LIKE)
+    dislikes_inc = int(added == const_mix.F_ACTION_TYPE_DISLIKE) - int(removed == const_mix.F_ACTION_TYPE_DISLIKE)
+
+    # 状态缓存与计数并发更新, 写入失败或部分失败时删除状态缓存, 读取时回源
+    if ret and not ret['error_count']:
+        jobs = [update_like_state_cache(from_uid, oid, otype, add_action, remove_action)]
+    else:
+        jobs = [evict_like_state_cache(from_uid, oid, otype)]
+    jobs.extend(inbox_jobs)
+    if otype == const_mix.CONTENT_TYPE_POST_CODE:
+        if likes_inc or dislikes_inc:
+            jobs.append(post_service.increase_post_count_stat(oid, likes_inc_num=likes_inc, dislikes_inc_num=dislikes_inc))
+        if likes_inc:
+            jobs.append(increase_user_favor_num_stat(to_uid, likes_post_to_me_inc_num=likes_inc))
+            jobs.append(increase_user_favor_num_stat(from_uid, liked_post_inc_num=likes_inc))
+    else:
+        if likes_inc or dislikes_inc:
+            jobs.append(comment_service.increase_comment_count_stat(oid, likes_inc_num=likes_inc, dislikes_inc_num=dislikes_inc))
+        if likes_inc:
+            jobs.append(increase_user_favor_num_stat(to_uid, likes_cmt_to_me_inc_num=likes_inc))
+            jobs.append(increase_user_favor_num_stat(from_uid, liked_cmt_inc_num=likes_inc))
+    await asyncio.gather(*jobs)
+
+    return added, removed
+
+
+async def evict_like_state_cache(uid, oid, otype):
+    """
+    删除赞踩状态缓存
+    """
+    pipe = db.func_aioredis.pipeline()
+    pipe.hdel(LIKE_STATE_KEY % (uid, otype), oid)
+    pipe.srem(LIKE_STATE_NONE_KEY % (uid, otype), oid)
+    await pipe.execute()
+
+
+async def update_like_state_cache(uid, oid, otype, add_action, remove_action):
+    """
+    更新赞踩状态缓存
+    :param add_action: 写入的动作, 为空时只取消 remove_action
+    """
+    key = LIKE_STATE_KEY % (uid, otype)
+    if add_action:
+        pipe = db.func_aioredis.pipeline()
+        pipe.hset(key, oid, add_action)
+        pipe.expire(key, LIKE_STATE_EXPIRE)
+        pipe.srem(LIKE_STATE_NONE_KEY % (uid, otype), oid)
+        await pipe.execute()
+        return
+
+    await db.func_aioredis.eval(LIKE_STATE_CANCEL_SCRIPT, keys=[key], args=[oid, remove_action, LIKE_STATE_NONE, LIKE_STATE_EXPIRE])
+
+
+def build_like_inbox_reverse_field(from_uid, oid, otype):
+    """
+    收件箱反查字段, 同一用户对同一内容只有一条赞记录
+    """
+    return LIKE_INBOX_REVERSE_FIELD % (from_uid, otype, oid)
+
+
+def cut_like_inbox_text(text):
+    return text[:LIKE_INBOX_TEXT_LEN] if text else ''
+
+
+def build_like_inbox_entry(his, post_map, cmt_map, user_map):
+    """
+    构造收件箱条目: 赞记录、点赞者及内容摘要, 由 build_like_history_info 转为接口返回格式
+    图片只保存原始信息, 读取时签名
+    :param his: 赞记录
+    :return:
+    """
+    entry = {
+        'hid': str(his['_id']),
+        'from_uid': his['from_uid'],
+        'to_uid': his['to_uid'],
+        'oid': his['oid'],
+        'otype': his['otype'],
+        'action': his['action'],
+        'ct': his['ct'],
+        'r': build_like_inbox_reverse_field(his['from_uid'], his['oid'], his['otype']),
+    }
 
-    # 取消点踩
-    if disliked_cids:
-        # 减少点踩计数
-        await comment_service.increase_comment_count_stat(cid, dislikes_inc_num=-1)
-        # 删除点踩历史记录
-        await update_like_dislike_history(uid, c_uid, cid, const_mix.CONTENT_TYPE_COMMENT_CODE, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE)
+    # 点赞者, 账户名只保留展示用的末尾4位
+    user = user_map.get(his['from_uid'])
+    if user:
+        entry['from_user'] = {
+            'uid': str(user['_id']),
+            'name': user['name'][-4:],
+            'status': user['status'],
+            'utypes': user['utypes'],
+            'nick': user['nick'],
+            'sign': user.get('sign', ''),
+            'invite_code': user.get('invite_code', ''),
+            'raw_avatar': user['raw_avatar'],
+            'raw_bg': user['raw_bg'],
+            'young_mode': user.get('young_mode', False),
+            'ct': user['ct'],
+        }
+
+    # 评论摘要, 首图作为封面
+    pid = his['oid']
+    if his['otype'] == const_mix.CONTENT_TYPE_COMMENT_CODE and his['oid'] in cmt_map:
+        cmt = cmt_map[his['oid']]
+        entry['comment'] = {
+            'cid': str(cmt['_id']),
+            'pid': cmt['pid'],
+            'ct': cmt['ct'],
+            'ctype': cmt['ctype'],
+            'text': cut_like_inbox_text(cmt['text']),
+            'status': cmt['status'],
+            'likes': cmt['likes'],
+            'dislikes': cmt.get('dislikes', 0),
+            'raw_cover': cmt['raw_imgs'][0] if cmt.get('raw_imgs') else None,
+        }
+        pid = cmt['pid']
+
+    # 帖子摘要, 首图作为封面
+    post = post_map.get(pid) if his['otype'] == const_mix.CONTENT_TYPE_POST_CODE or entry.get('comment') else None
+    if post:
+        entry['post'] = {
+            'pid': str(post['_id']),
+            'ptype': post['ptype'],
+            'ct': post['ct'],
+            'ut': post['ut'],
+            'status': int(post['status']),
+            'title': post.get('title', ''),
+            'text': cut_like_inbox_text(post['text']),
+            'cmts': post['cmts'],
+            'likes': post['likes'],
+            'dislikes': post['dislikes'],
+            'raw_cover': post['raw_imgs'][0] if post['raw_imgs'] else None,
+        }
+    return entry
 
 
-async def update_like_dislike_history(from_uid, to_uid, obj_id, obj_type, action):
+async def build_like_inbox_entries(hiss):
     """
-    更新赞我的相关缓存和历史记录
-    :param from_uid: 赞的发出者
-    :param to_uid: 赞的接收者
-    :param obj_id: UGC id
-    :param obj_type: UGC 类型
-    :param action: 点赞动作 1 赞  2 取消赞
+    批量构造收件箱条目
+    :param hiss: 赞记录列表
     :return:
     """
+    cids = [his['oid'] for his in hiss if his['otype'] == const_mix.CONTENT_TYPE_COMMENT_CODE]
+    pids = [his['oid'] for his in hiss if his['otype'] == const_mix.CONTENT_TYPE_POST_CODE]
+    uids = [his['from_uid'] for his in hiss]
+
+    # 并发查询, 帖子映射表依赖评论映射表中的pid
+    stage_results = await base_service.gather_stages({
+        'cmt_map': (lambda r: comment_service.get_comment_info_map_by_cids(cids), []),
+        'post_map': (lambda r: post_service.get_post_map_by_pids(pids + [cmt['pid'] for cmt in r['cmt_map'].values()]), ['cmt_map']),
+        'user_map': (lambda r: user_service.get_user_map_by_uids(uids), []),
+    }, label='build_like_inbox_entries')
+    cmt_map, post_map, user_map = stage_results['cmt_map'], stage_results['post_map'], stage_results['user_map']
+    return [build_like_inbox_entry(his, post_map, cmt_map, user_map) for his in hiss]
+
 
-    # 新增赞
-    if action == const_mix.F_ACTION_TYPE_LIKE:
-        await create_new_like_history(from_uid, to_uid, obj_id, obj_type, const_mix.F_ACTION_TYPE_LIKE)
+async def push_like_inbox(his):
+    """
+    新增点赞后写入被赞者收件箱, 收件箱未构建时跳过, 读取时从数据库重建
+    :param his: 赞记录
+    """
+    order_key, entry_key = LIKE_INBOX_KEY % his['to_uid'], LIKE_INBOX_ENTRY_KEY % his['to_uid']
+    if not await db.long_aioredis.hexists(entry_key, LIKE_INBOX_BUILT_FIELD):
+        return
 
-    # 取消赞
-    elif action == const_mix.F_ACTION_TYPE_CANCEL_LIKE:
-        # 删除历史记录
-        await delete_like_history(from_uid, to_uid, obj_id, obj_type, const_mix.F_ACTION_TYPE_LIKE)
+    entry = (await build_like_inbox_entries([his]))[0]
+    await db.long_aioredis.eval(
+        LIKE_INBOX_PUSH_SCRIPT, keys=[order_key, entry_key],
+        args=[entry['hid'], entry['ct'], json_codec.dumps(entry), entry['r'], LIKE_INBOX_MAX_LEN, LIKE_INBOX_EXPIRE,
+              LIKE_INBOX_BUILT_FIELD, LIKE_INBOX_TRUNCATED_FIELD])
 
-    # 新增踩
-    elif action == const_mix.F_ACTION_TYPE_DISLIKE:
-        await create_new_like_history(from_uid, to_uid, obj_id, obj_type, const_mix.F_ACTION_TYPE_DISLIKE)
 
-    # 取消踩
-    elif action == const_mix.F_ACTION_TYPE_CANCEL_DISLIKE:
-        await delete_like_history(from_uid, to_uid, obj_id, obj_type, const_mix.F_ACTION_TYPE_DISLIKE)
+async def pull_like_inbox(from_uid, to_uid, oid, otype):
+    """
+    取消赞后删除收件箱条目
+    """
+    await db.long_aioredis.eval(
+        LIKE_INBOX_PULL_SCRIPT, keys=[LIKE_INBOX_KEY % to_uid, LIKE_INBOX_ENTRY_KEY % to_uid],
+        args=[build_like_inbox_reverse_field(from_uid, oid, otype)])
 
 
-async def create_new_like_history(from_uid, to_uid, obj_id, obj_type, action):
+async def rebuild_like_inbox(uid):
     """
-    创建点赞历史记录
-    :param from_uid:  发赞方 uid
-    :param to_uid:   被赞方 uid
-    :param obj_id: UGC id
-    :param obj_type: UGC type
-    :param action: 动作
+    从赞记录重建收件箱, 保留最近 LIKE_INBOX_MAX_LEN 条, 记录数达到上限时标记截断
+    """
+    query_dict = build_like_history_query_dict(
+        to_uid=uid, obj_type=[const_mix.CONTENT_TYPE_POST_CODE, const_mix.CONTENT_TYPE_COMMENT_CODE],
+        action=const_mix.F_ACTION_TYPE_LIKE)
+    his_col = db.get_motordb_col_like_history()
+    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, query_dict, [('ct', -1), ('_id', -1)], 0, LIKE_INBOX_MAX_LEN)
+    entries = await build_like_inbox_entries(hiss) if hiss else []
+
+    order_key, entry_key = LIKE_INBOX_KEY % uid, LIKE_INBOX_ENTRY_KEY % uid
+    pipe = db.long_aioredis.pipeline()
+    pipe.delete(order_key, entry_key)
+    pipe.hset(entry_key, LIKE_INBOX_BUILT_FIELD, 1)
+    if len(hiss) >= LIKE_INBOX_MAX_LEN:
+        pipe.hset(entry_key, LIKE_INBOX_TRUNCATED_FIELD, 1)
+    for entry in entries:
+        pipe.zadd(order_key, entry['ct'], entry['hid'])
+        pipe.hset(entry_key, entry['hid'], json_codec.dumps(entry))
+        pipe.hset(entry_key, entry['r'], entry['hid'])
+    pipe.expire(order_key, LIKE_INBOX_EXPIRE)
+    pipe.expire(entry_key, LIKE_INBOX_EXPIRE)
+    await pipe.execute()
+
+
+async def read_like_inbox(uid, seek_hid, seek_ct, num):
+    """
+    seek 读取收件箱, 未构建时先重建
+    :return: (是否已截断, 条目列表)
+    """
+    keys = [LIKE_INBOX_KEY % uid, LIKE_INBOX_ENTRY_KEY % uid]
+    args = [seek_hid, seek_ct, num, LIKE_INBOX_BUILT_FIELD, LIKE_INBOX_TRUNCATED_FIELD]
+    ret = await db.long_aioredis.eval(LIKE_INBOX_READ_SCRIPT, keys=keys, args=args)
+    if ret is None:
+        await rebuild_like_inbox(uid)
+        ret = await db.long_aioredis.eval(LIKE_INBOX_READ_SCRIPT, keys=keys, args=args)
+    if not ret:
+        return False, []
+    return bool(ret[0]), [json_codec.loads(item) for item in ret[1:]]
+
+
+async def get_like_inbox_info_list_for_handler(uid, cursor_info, query_dict, sorts):
+    """
+    获取赞我的记录, 优先读取收件箱, 收件箱之外的更早记录及旧版offset分页回源数据库
+    收件箱与数据库分页使用相同的 seek cursor, 返回格式一致
+    :param query_dict: 回源查询条件
+    :param sorts: 回源排序条件, 按 ct 倒序
     :return:
     """
-    like_his_col = db.get_motordb_col_like_history()
+    offset = cursor_info.get('offset', 0)
+    offset = offset if offset >= 0 else 0
+    limit = cursor_info.get('limit', const_mix.HISTORY_PAGE_PER_NUM)
+    limit = min(const_mix.HISTORY_PAGE_PER_NUM_MAX, limit)
 
-    query_dict = build_like_history_query_dict(from_uid, to_uid, obj_id, obj_type, action=action)
+    # 上一页末尾的 (ct, hid), 旧版offset分页回源数据库
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_values = base_service.get_seek_values_from_cursor_info(cursor_info, sorts)
+    if seek_values is None:
+        if offset:
+            return await get_like_history_info_list_for_handler(uid, cursor_info, query_dict, sorts)
+        seek_values = [0, '']
+    elif not isinstance(seek_values[0], int) or not isinstance(seek_values[1], ObjectId):
+        return await get_like_history_info_list_for_handler(uid, cursor_info, query_dict, sorts)
+
+    # 收件箱与被赞者信息并发读取
+    (truncated, entries), user_map = await asyncio.gather(
+        read_like_inbox(uid, str(seek_values[1]), seek_values[0], limit + 1),
+        user_service.get_user_map_by_uids([uid]),
+    )
+    has_more = bool(len(entries) > limit)
+    entries = entries[:limit]
+
+    # 收件箱已读完且已截断, 从上一页末尾回源数据库
+    if not entries:
+        if truncated:
+            return await get_like_history_info_list_for_handler(uid, cursor_info, query_dict, sorts)
+        return False, {}, []
 
-    new_like_his = {
-        'from_uid': from_uid,
-        'to_uid': to_uid,
-        'oid': obj_id,
-        'otype': obj_type,
-        'action': action,
-        'ct': int(time.time()),
-    }
-    await mongo_async.mongo_find_one_and_update(like_his_col, query_dict, {'$setOnInsert': new_like_his}, upsert=True)
+    results = [build_like_history_info(entry, user_map) for entry in entries]
+
+    # 下一次分页信息, 收件箱已截断时, 读完后的更早记录回源数据库
+    last = entries[-1]
+    next_cursor_info = base_service.build_next_seek_cursor_info(
+        sorts, offset, limit, {'ct': last['ct'], '_id': ObjectId(last['hid'])})
+    return has_more or truncated, next_cursor_info, results
 
 
 def build_like_history_query_dict(from_uid='', to_uid='', obj_id='', obj_type='', ct_lt=0, not_from_uid='', action=None):
@@ -620,16 +833,6 @@ def build_like_history_query_dict(from_uid='', to_uid='', obj_id='', obj_type=''
     return query_dict
 
 
-async def delete_like_history(from_uid, to_uid, obj_id, obj_type, action):
-    """
-    删除点赞历史
-    :return:
-    """
-    like_his_col = db.get_motordb_col_like_history()
-    query_dict = build_like_history_query_dict(from_uid, to_uid, obj_id, obj_type, action=action)
-    await mongo_async.mongo_delete_one(like_his_col, query_dict)
-
-
 async def query_post_current_like_uids(pid, need_num=10, viewer_uid=''):
     """
     查询当前点赞帖子的用户ID列表
@@ -638,15 +841,17 @@ async def query_post_current_like_uids(pid, need_num=10, viewer_uid=''):
     if not pid:
         return []
 
-    # 其他用户列表
-    query_dict = build_like_history_query_dict(obj_id=pid, obj_type=const_mix.CONTENT_TYPE_POST_CODE, not_from_uid=viewer_uid, action=const_mix.F_ACTION_TYPE_LIKE)
+    # 其他用户列表、查看用户自己的点赞记录, 并发查询
     his_col = db.get_motordb_col_like_history()
-    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, query_dict, [('contribute_score', -1), ('ct', -1)], 0, need_num)
+    query_dict = build_like_history_query_dict(obj_id=pid, obj_type=const_mix.CONTENT_TYPE_POST_CODE, not_from_uid=viewer_uid, action=const_mix.F_ACTION_TYPE_LIKE)
+    viewer_query_dict = build_like_history_query_dict(from_uid=viewer_uid, obj_id=pid, obj_type=const_mix.CONTENT_TYPE_POST_CODE, action=const_mix.F_ACTION_TYPE_LIKE)
+    hiss, viewer_like_his = await asyncio.gather(
+        mongo_async.mongo_find_sort_skip_limit(his_col, query_dict, [('contribute_score', -1), ('ct', -1)], 0, need_num),
+        mongo_async.mongo_find_one(his_col, viewer_query_dict),
+    )
     result = [his['from_uid'] for his in hiss]
 
     # 查看用户已关注优先展示
-    query_dict = build_like_history_query_dict(from_uid=viewer_uid, obj_id=pid, obj_type=const_mix.CONTENT_TYPE_POST_CODE, action=const_mix.F_ACTION_TYPE_LIKE)
-    viewer_like_his = await mongo_async.mongo_find_one(his_col, query_dict)
     if viewer_like_his:
         result.insert(0, viewer_uid)
 
@@ -655,17 +860,26 @@ async def query_post_current_like_uids(pid, need_num=10, viewer_uid=''):
 
 async def get_favor_map_by_ids(uids):
     """
-    获取关注信息映射表
+    获取关注信息映射表, 优先读取缓存, 并叠加尚未落库的计数
+    注意: 返回的喜好信息可能为缓存共享数据, 不要直接修改
     :param uids:
     :return:
     """
+    if not uids:
+        return {}
+
+    favor_map = await favor_entity_cache.get_many(uids, load_favor_map_by_ids)
+    return {uid: counter_aggregator.overlay('favor', favor) for uid, favor in favor_map.items()}
+
+
+async def load_favor_map_by_ids(uids):
+    """
+    从数据库批量获取关注信息映射表
+    :return:
+    """
     favor_col = db.get_motordb_col_favor()
     favors = await mongo_async.mongo_find(favor_col, {'_id': {'$in': base_service.ensure_mongo_obj_ids(uids)}})
-
-    result = {}
-    for favor in favors:
-        result[favor['uid']] = favor
-    return result
+    return {str(favor['_id']): favor for favor in favors or []}
 
 
 async def get_user_favor(uid):
@@ -673,9 +887,32 @@ async def get_user_favor(uid):
     获取用户喜好信息表
     :return:
     """
-    favor_col = db.get_motordb_col_favor()
-    favor = await mongo_async.mongo_find_one(favor_col, {'_id': ObjectId(uid)})
-    return favor or {}
+    if not uid:
+        return {}
+    favor_map = await get_favor_map_by_ids([uid])
+    return favor_map.get(uid) or {}
+
+
+async def get_viewer_favor_info(uid):
+    """
+    读取路径获取查看者喜好信息(只读, 优先缓存), 不存在时才初始化
+    注意: 返回的喜好信息可能为缓存共享数据, 不要直接修改
+    :return:
+    """
+    favor = await get_user_favor(uid)
+    if not favor and uid:
+        favor = await initial_user_favor_info(uid)
+    return favor
+
+
+async def on_favor_counter_flushed(docs):
+    """
+    喜好计数落库后失效缓存, 未落库的计数读取时叠加
+    """
+    await favor_entity_cache.evict(*docs.keys())
+
+
+counter_aggregator.add_flush_listener('favor', on_favor_counter_flushed)
 
 
 async def update_user_last_read_notice_ct(uid, last_read_notice_ct):
@@ -687,11 +924,31 @@ async def update_user_last_read_notice_ct(uid, last_read_notice_ct):
     """
     favor_col = db.get_motordb_col_favor()
     await mongo_async.mongo_update_one(favor_col, {'_id': ObjectId(uid)}, {'$set': {'last_read_notice_ct': last_read_notice_ct}})
+    await favor_entity_cache.evict(uid)
+    await db.long_aioredis.setex(LAST_READ_NOTICE_CT_KEY % uid, LAST_READ_NOTICE_CT_EXPIRE, last_read_notice_ct)
+
+
+async def get_user_last_read_notice_ct(uid, cached_value=None):
+    """
+    获取最后阅读通知时间, 优先使用 redis 镜像, 不存在时从 favor 读取并回写
+    :param uid:
+    :param cached_value: 已经从 redis 镜像中取到的值
+    :return:
+    """
+    if cached_value is None:
+        cached_value = await db.long_aioredis.get(LAST_READ_NOTICE_CT_KEY % uid)
+    if cached_value is not None:
+        return int(cached_value)
+
+    favor = await get_user_favor(uid)
+    last_read_notice_ct = favor.get('last_read_notice_ct', 0)
+    await db.long_aioredis.setex(LAST_READ_NOTICE_CT_KEY % uid, LAST_READ_NOTICE_CT_EXPIRE, last_read_notice_ct)
+    return last_read_notice_ct
 
 
 async def get_like_history_info_list_for_handler(uid, cursor_info, query_dict, sorts):
     """
-    获取点赞踩历史信息
+    获取点赞踩历史信息, 与收件箱条目使用相同的构造方式
     :return: 
     """
     # 确保分页合法
@@ -700,72 +957,78 @@ async def get_like_history_info_list_for_handler(uid, cursor_info, query_dict, s
     limit = cursor_info.get('limit', const_mix.HISTORY_PAGE_PER_NUM)
     limit = min(const_mix.HISTORY_PAGE_PER_NUM_MAX, limit)
 
-    # 获取数据
+    # 获取数据, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
     his_col = db.get_motordb_col_like_history()
-    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, query_dict, sorts, offset, limit + 1)
+    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, seek_query_dict, sorts, skip, limit + 1)
     has_more = bool(len(hiss) > limit)
     hiss = hiss[:limit]
     if not hiss:
         return False, {}, []
 
-    # 查询评论映射表
-    cids = [his['oid'] for his in hiss if his['otype'] == const_mix.CONTENT_TYPE_COMMENT_CODE]
-    cmt_map = await comment_service.get_comment_info_map_by_cids(cids)
-
-    # 查询帖子映射表
-    pids = [his['oid'] for his in hiss if his['otype'] == const_mix.CONTENT_TYPE_POST_CODE]
-    pids.extend([cmt['pid'] for _, cmt in cmt_map.items()])
-    post_map = await post_service.get_post_map_by_pids(pids)
-
-    # 用户映射表
-    uids = [uid]
-    uids.extend([his['from_uid'] for his in hiss])
-    uids.extend([his['to_uid'] for his in hiss])
-    user_map = await user_service.get_user_map_by_uids(uids)
-
     # 构造返回列表
-    results = []
-    for his in hiss:
-        results.append(
-            build_like_history_info(his, post_map=post_map, cmt_map=cmt_map, user_map=user_map)
-        )
+    entries, user_map = await asyncio.gather(build_like_inbox_entries(hiss), user_service.get_user_map_by_uids([uid]))
+    results = [build_like_history_info(entry, user_map) for entry in entries]
 
     # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, hiss[-1])
     return has_more, next_cursor_info, results
 
 
-def build_like_history_info(his, post_map=None, cmt_map=None, user_map=None):
+def build_like_history_info(entry, user_map):
     """
-    构造赞踩历史信息
+    构造赞踩历史信息, 字段与旧版一致, 帖子、评论为点赞时的摘要
+    :param entry: 收件箱条目
+    :param user_map: 被赞者用户映射表
     :return:
     """
-    result = {
-        'hid': str(his['_id']),
-        'from_uid': his['from_uid'],
-        'to_uid': his['to_uid'],
-        'oid': his['oid'],
-        'otype': his['otype'],
-        'action': his['action'],
-        'ct': his['ct'],
-    }
+    result = {key: entry[key] for key in ('hid', 'from_uid', 'to_uid', 'oid', 'otype', 'action', 'ct')}
     # 用户信息
-    if his['from_uid'] in user_map:
-        result['from_user_info'] = user_service.build_user_base_info(user_map[his['from_uid']])
-    if his['to_uid'] in user_map:
-        result['to_user_info'] = user_service.build_user_base_info(user_map[his['to_uid']])
-    # 帖子快照
-    if result['otype'] == const_mix.CONTENT_TYPE_POST_CODE and result['oid'] in post_map:
-        result['post'] = post_service.build_post_info(post_map[result['oid']], {}, {})
-    # 评论快照+帖子
-    if result['otype'] == const_mix.CONTENT_TYPE_COMMENT_CODE and result['oid'] in cmt_map:
-        cmt = cmt_map[result['oid']]
-        result['comment'] = comment_service.build_comment_base_info(cmt, {}, [], [])
-        if cmt['pid'] in post_map:
-            result['post'] = post_service.build_post_info(post_map[cmt['pid']], {}, {})
+    if entry.get('from_user'):
+        from_user = entry['from_user']
+        result['from_user_info'] = user_service.build_user_base_info(dict(from_user, _id=from_user['uid']))
+    if entry['to_uid'] in user_map:
+        result['to_user_info'] = user_service.build_user_base_info(user_map[entry['to_uid']])
+    # 帖子摘要
+    if entry.get('post'):
+        post = entry['post']
+        result['post'] = {
+            'pid': post['pid'],
+            'ptype': post['ptype'],
+            'ct': post['ct'],
+            'rt': post['ct'],
+            'title': post['title'],
+            'text': post['text'],
+            'imgs': base_service.build_img_infos([post['raw_cover']] if post['raw_cover'] else []),
+            'articles': [],
+            'ut': post['ut'],
+            'status': post['status'],
+            'cmts': post['cmts'],
+            'likes': post['likes'],
+            'liked': False,
+            'dislikes': post['dislikes'],
+            'disliked': False,
+            'tags': [],
+            'user': {},
+        }
+    # 评论摘要
+    if entry.get('comment'):
+        cmt = entry['comment']
+        result['comment'] = {
+            'cid': cmt['cid'],
+            'pid': cmt['pid'],
+            'ct': cmt['ct'],
+            'ctype': cmt['ctype'],
+            'text': cmt['text'],
+            'status': cmt['status'],
+            'likes': cmt['likes'],
+            'liked': False,
+            'dislikes': cmt['dislikes'],
+            'disliked': False,
+            'participate_num': cmt['likes'] + cmt['dislikes'],
+            'imgs': base_service.build_img_infos([cmt['raw_cover']] if cmt['raw_cover'] else []),
+        }
 
     return result
 
@@ -781,9 +1044,11 @@ async def get_fans_history_info_list_for_handler(uid, cursor_info, query_dict, s
     limit = cursor_info.get('limit', const_mix.HISTORY_PAGE_PER_NUM)
     limit = min(const_mix.HISTORY_PAGE_PER_NUM_MAX, limit)
 
-    # 获取数据
+    # 获取数据, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
     his_col = db.get_motordb_col_fan_history()
-    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, query_dict, sorts, offset, limit + 1)
+    hiss = await mongo_async.mongo_find_sort_skip_limit(his_col, seek_query_dict, sorts, skip, limit + 1)
     has_more = bool(len(hiss) > limit)
     hiss = hiss[:limit]
     if not hiss:
@@ -803,10 +1068,7 @@ async def get_fans_history_info_list_for_handler(uid, cursor_info, query_dict, s
         )
 
     # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, hiss[-1])
     return has_more, next_cursor_info, results
 
 
@@ -0,0 +1,193 @@
+# -*- coding:utf-8 -*-
+"""
+follow service 方法: 关注关系存储
+关注边保存在 fan_history(用户 -> 用户)、favor_tag_history(用户 -> 标签),
+每个用户的关注集合镜像到 redis set, 用于 O(1) 判断关注关系, 集合缺失时从关注边重建
+"""
+import time
+
+from cores.database import db, mongo_async
+
+# 关注集合(set), 按 (关注类型, uid) 区分
+FOLLOW_SET_KEY = 'follow_%s_%s'
+FOLLOW_SET_EXPIRE = 60 * 60 * 24 * 7
+
+# 关注类型
+FOLLOW_TYPE_USER = 'uids'
+FOLLOW_TYPE_TAG = 'tids'
+
+# 关注关系写入版本, 每次关注、取消关注递增, 重建集合时用于判断回源期间是否有写入
+FOLLOW_VERSION_KEY = 'follow_ver_%s_%s'
+
+# 集合已构建标识, 关注为空时集合仍然存在
+FOLLOW_SET_BUILT_MEMBER = '_built'
+
+# 批量判断关注关系, 集合不存在时返回 nil, 需重建后重试
+# KEYS[1]: 关注集合; ARGV: 待判断的 id 列表
+FOLLOW_CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local result = {}
+for i, member in ipairs(ARGV) do
+    result[i] = redis.call('SISMEMBER', KEYS[1], member)
+end
+return result
+"""
+
+# 递增写入版本, 集合存在时增删成员, 不存在时等待下次读取重建
+# KEYS[1]: 关注集合, KEYS[2]: 写入版本; ARGV[1]: SADD 或 SREM, ARGV[2]: 成员, ARGV[3]: 过期时间
+FOLLOW_UPDATE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call(ARGV[1], KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+# 重建集合: 回源期间写入版本变化或集合已被其他请求重建时放弃
+# KEYS[1]: 关注集合, KEYS[2]: 写入版本; ARGV[1]: 回源前的版本, ARGV[2]: 过期时间, ARGV[3...]: 成员
+FOLLOW_REBUILD_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] or redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def get_follow_edge_info(follow_type, uid, oid=''):
+    """
+    获取关注边集合与查询条件
+    :return: (motor 集合, 查询条件, 被关注方字段名)
+    """
+    if follow_type == FOLLOW_TYPE_USER:
+        query_dict = {'from_uid': uid}
+        if oid:
+            query_dict['to_uid'] = oid
+        return db.get_motordb_col_fan_history(), query_dict, 'to_uid'
+
+    query_dict = {'uid': uid}
+    if oid:
+        query_dict['tid'] = oid
+    return db.get_motordb_col_favor_tag_history(), query_dict, 'tid'
+
+
+async def rebuild_follow_set(follow_type, uid):
+    """
+    从关注边重建关注集合, 回源期间有关注、取消关注写入时不回写, 等待下次读取重建
+    :return: 关注的 id 列表
+    """
+    version_key = FOLLOW_VERSION_KEY % (follow_type, uid)
+    version = await db.func_aioredis.get(version_key)
+
+    col, query_dict, oid_key = get_follow_edge_info(follow_type, uid)
+    edges = await mongo_async.mongo_find(col, query_dict, projection={oid_key: True})
+    oids = [edge[oid_key] for edge in edges]
+
+    key = FOLLOW_SET_KEY % (follow_type, uid)
+    await db.func_aioredis.eval(
+        FOLLOW_REBUILD_SCRIPT, keys=[key, version_key], args=[version or '', FOLLOW_SET_EXPIRE, FOLLOW_SET_BUILT_MEMBER] + oids)
+    return oids
+
+
+async def get_following_oids(follow_type, uid, oids):
+    """
+    批量判断关注关系
+    :param oids: 待判断的 uid 或 tid 列表
+    :return: 已关注的 id 集合
+    """
+    oids = list(set(oid for oid in oids if oid))
+    if not (uid and oids):
+        return set()
+
+    key = FOLLOW_SET_KEY % (follow_type, uid)
+    flags = await db.func_aioredis.eval(FOLLOW_CHECK_SCRIPT, keys=[key], args=oids)
+    if flags is None:
+        follow_oids = set(await rebuild_follow_set(follow_type, uid))
+        return set(oid for oid in oids if oid in follow_oids)
+    return set(oid for oid, flag in zip(oids, flags) if flag)
+
+
+async def is_following_user(uid, to_uid):
+    """
+    是否已关注用户
+    """
+    return to_uid in await get_following_oids(FOLLOW_TYPE_USER, uid, [to_uid])
+
+
+async def are_following_users(uid, to_uids):
+    """
+    批量判断是否已关注用户
+    :return: 已关注的 uid 集合
+    """
+    return await get_following_oids(FOLLOW_TYPE_USER, uid, to_uids)
+
+
+async def are_following_tags(uid, tids):
+    """
+    批量判断是否已关注标签
+    :return: 已关注的 tid 集合
+    """
+    return await get_following_oids(FOLLOW_TYPE_TAG, uid, tids)
+
+
+async def with_follow_state(favor, uids=None, tids=None):
+    """
+    给喜好信息附加对指定用户、标签的关注状态(f_uids/f_tids 为已关注 id 集合), 供 build_*_by_favor 使用
+    返回浅拷贝, 不修改原喜好信息
+    :param favor: 查看者喜好信息
+    :param uids: 页面上出现的用户ID列表
+    :param tids: 页面上出现的标签ID列表
+    :return:
+    """
+    if not favor:
+        return favor
+
+    result = dict(favor)
+    result['f_uids'] = await are_following_users(favor['uid'], uids or [])
+    result['f_tids'] = await are_following_tags(favor['uid'], tids or [])
+    return result
+
+
+async def update_follow_set(follow_type, uid, oid, followed):
+    key = FOLLOW_SET_KEY % (follow_type, uid)
+    version_key = FOLLOW_VERSION_KEY % (follow_type, uid)
+    await db.func_aioredis.eval(
+        FOLLOW_UPDATE_SCRIPT, keys=[key, version_key], args=['SADD' if followed else 'SREM', oid, FOLLOW_SET_EXPIRE])
+
+
+async def follow(follow_type, uid, oid):
+    """
+    新增关注边
+    :return: 是否新增, 已关注时返回 False
+    """
+    col, query_dict, _ = get_follow_edge_info(follow_type, uid, oid)
+    ct = int(time.time())
+    new_edge = dict(query_dict, ct=ct, ut=ct)
+
+    ret = await mongo_async.mongo_update_one(col, query_dict, {'$setOnInsert': new_edge}, up=True, returnid=True)
+    if not (ret and ret['upserted_id']):
+        return False
+
+    await update_follow_set(follow_type, uid, oid, True)
+    return True
+
+
+async def unfollow(follow_type, uid, oid):
+    """
+    删除关注边
+    :return: 是否删除, 未关注时返回 False
+    """
+    col, query_dict, _ = get_follow_edge_info(follow_type, uid, oid)
+    ret = await mongo_async.mongo_delete_one(col, query_dict)
+    if not (ret and ret.deleted_count):
+        return False
+
+    await update_follow_set(follow_type, uid, oid, False)
+    return True
@@ -11,6 +11,53 @@ from cores.database import db, mongo_async
 from cores.tag import tag_service
 from cores.base import base_service
 from cores.user import user_service
+from cores.follow import follow_service
+from cores.utils import json_codec
+from cores.utils.counter_aggregator import counter_aggregator
+from cores.utils.entity_cache import LocalLRUCache
+
+
+# 推荐候选帖子索引(zset: pid -> rt), 只保留最近 POST_REC_CANDIDATE_MAX_NUM 条
+POST_REC_CANDIDATE_KEY = 'post_rec_candidates'
+POST_REC_CANDIDATE_MAX_NUM = 1000
+
+# 用户已浏览的推荐帖子(zset: pid -> 浏览时间), 只保留最近 POST_REC_SEEN_MAX_NUM 条
+# 旧版 set 结构的 post_rec_seen_%s 不再使用, 等待自然过期
+POST_REC_SEEN_KEY = 'post_rec_seen_v2_%s'
+POST_REC_SEEN_MAX_NUM = 1000
+POST_REC_SEEN_EXPIRE = 60 * 60 * 24 * 30
+
+# 帖子展示快照(与浏览者无关的字段), key 为 (pid, 内容更新时间)
+post_snapshot_cache = LocalLRUCache(max_size=4096, ttl=60 * 10)
+
+# 索引已构建标识, 候选索引中 score 为 -1, 已浏览集合中 score 为 +inf(不会被截断)
+POST_REC_BUILT_MEMBER = '_built'
+
+# 按 rt 倒序分页扫描候选索引, 返回前 ARGV[1] 个未浏览的 pid
+# KEYS[1]: 候选索引, KEYS[2]: 已浏览集合(zset); ARGV[2]: 每页数目, ARGV[3]: 最大扫描数目
+POST_REC_SELECT_SCRIPT = """
+local result = {}
+local num = tonumber(ARGV[1])
+local page = tonumber(ARGV[2])
+local max_scan = tonumber(ARGV[3])
+local offset = 0
+while #result < num and offset < max_scan do
+    local pids = redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', 0, 'LIMIT', offset, page)
+    for _, pid in ipairs(pids) do
+        if not redis.call('ZSCORE', KEYS[2], pid) then
+            result[#result + 1] = pid
+            if #result >= num then
+                break
+            end
+        end
+    end
+    if #pids < page then
+        break
+    end
+    offset = offset + page
+end
+return result
+"""
 
 
 def build_post_query_dict(pid=None, ptype=None, status=None, uid=None, tid=None, ct_gte=0, ct_lt=0):
@@ -106,10 +153,11 @@ def build_post_query_sort(query_sort_type=None):
     return sorts
 
 
-async def get_post_info_list_for_handler(uid, cursor_info, query_dict=None, sorts=None, favor_info=None):
+async def get_post_info_list_for_handler(uid, cursor_info, query_dict=None, sorts=None, favor_info=None, read_replica=True):
 
     """
     获取帖子列表信息
+    :param read_replica: 是否从库读取, 需要读到刚写入数据时(如查看自己的帖子)传 False
     :return:
     """
     # 确保分页合法
@@ -118,29 +166,35 @@ async def get_post_info_list_for_handler(uid, cursor_info, query_dict=None, sort
     limit = cursor_info.get('limit', const_post.POST_PAGE_PER_NUM)
     limit = min(const_post.POST_PAGE_PER_NUM_MAX, limit)
 
-    # 获取数据
-    post_col = db.get_motordb_col_post()
-    posts = await mongo_async.mongo_find_sort_skip_limit(post_col, query_dict, sorts, offset, limit + 1)
+    # 获取数据, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
+    post_col = db.get_motordb_col_post_r() if read_replica else db.get_motordb_col_post()
+    posts = await mongo_async.mongo_find_sort_skip_limit(post_col, seek_query_dict, sorts, skip, limit + 1)
     has_more = bool(len(posts) > limit)
     posts = posts[:limit]
     if not posts:
         return False, {}, []
 
-    # 查询作者ID映射表
+    # 作者ID、标签ID、帖子ID列表
+    from cores.favor import favor_service
     uids = [post['uid'] for post in posts]
     uids.append(uid)
-    user_map = await user_service.get_user_map_by_uids(uids)
-
-    # 查询标签ID映射表
     tids = []
     for post in posts:
         tids.extend(post.get('tids', []))
-    tag_map = await tag_service.get_tag_map_by_tids(tids)
-
-    # 构造赞踩列表
-    from cores.favor import favor_service
     pids = [str(post['_id']) for post in posts]
-    like_pids, disliked_pids = await favor_service.get_user_liked_disliked_pids(uid, pids)
+
+    # 并发查询作者、标签映射表和赞踩列表
+    stage_results = await base_service.gather_stages({
+        'user_map': (lambda r: user_service.get_user_map_by_uids(uids), []),
+        'tag_map': (lambda r: tag_service.get_tag_map_by_tids(tids), []),
+        'like_info': (lambda r: favor_service.get_user_liked_disliked_pids(uid, pids), []),
+        'viewer_favor': (lambda r: follow_service.with_follow_state(favor_info, uids=uids, tids=tids), []),
+    }, label='get_post_info_list_for_handler')
+    user_map, tag_map = stage_results['user_map'], stage_results['tag_map']
+    like_pids, disliked_pids = stage_results['like_info']
+    favor_info = stage_results['viewer_favor']
 
     # 构造返回列表
     results = []
@@ -150,39 +204,61 @@ async def get_post_info_list_for_handler(uid, cursor_info, query_dict=None, sort
         )
 
     # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, posts[-1])
 
     return has_more, next_cursor_info, results
 
 
-def build_post_info(post, tag_map, user_map, viewer_favor_info=None, like_pids=None, disliked_pids=None):
+def build_post_snapshot(post):
     """
-    构造推荐帖子信息
+    构造帖子展示快照, 只包含与浏览者无关的内容字段, 按内容更新时间 cut 缓存
+    imgs/articles 为预编码的 json 片段(json_codec.RawJSON)
+    注意: 快照为共享数据, 调用方不能修改
     :return:
     """
     pid = str(post['_id'])
-    result = {
+    key = (pid, post.get('cut', post['ct']))
+    snapshot = post_snapshot_cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = {
         'pid': pid,
         'ptype': post['ptype'],
         'ct': post['ct'],
-        'ut': post['ut'],
         'rt': post['ct'],
+        'title': post.get('title', ''),
+        'text': post['text'],
+        # 图片与图文为快照中最大的部分, 预编码后列表响应直接拼接
+        'imgs': json_codec.encode_raw(base_service.build_img_infos(post['raw_imgs'])),
+        'articles': json_codec.encode_raw(build_post_article_items(post['raw_articles'])),
+    }
+    post_snapshot_cache.set(key, snapshot)
+    return snapshot
+
+
+def build_post_info(post, tag_map, user_map, viewer_favor_info=None, like_pids=None, disliked_pids=None):
+    """
+    构造推荐帖子信息
+    :return:
+    """
+    # 叠加尚未落库的计数
+    post = counter_aggregator.overlay('post', post)
+    result = dict(build_post_snapshot(post))
+    pid = result['pid']
+
+    # 状态、计数及浏览者相关字段
+    result.update({
+        'ut': post['ut'],
         'status': int(post['status']),
         'cmts': post['cmts'],
         'likes': post['likes'],
         'liked': pid in (like_pids or []),
         'dislikes': post['dislikes'],
         'disliked': pid in (disliked_pids or []),
-        'title': post.get('title', ''),
-        'text': post['text'],
-        'imgs': base_service.build_img_infos(post['raw_imgs']),
         'tags': [],
-        'articles': build_post_article_items(post['raw_articles']),
         'user': user_service.build_user_info_by_favor(user_map.get(post['uid']), viewer_favor_info=viewer_favor_info),
-    }
+    })
 
     # 标签
     for tid in post['tids']:
@@ -199,11 +275,18 @@ def build_post_article_items(article_items):
     """
     if not article_items:
         return []
+    image_types = [const_post.POST_ARTICLE_TYPE_IMAGE, const_post.POST_ARTICLE_TYPE_GIF, const_post.POST_ARTICLE_TYPE_GIF_VIDEO]
+
+    # 图片元素一次批量签名
+    sign_items = [(article_item.get('url', ''), style) for article_item in article_items
+                  if article_item['type'] in image_types for style in base_service.IMAGE_SIGN_STYLES]
+    signed_map = base_service.sign_oss_image_urls(sign_items)
+
     results = []
     for article_item in article_items:
         item = article_item
-        if article_item['type'] in [const_post.POST_ARTICLE_TYPE_IMAGE, const_post.POST_ARTICLE_TYPE_GIF, const_post.POST_ARTICLE_TYPE_GIF_VIDEO]:
-            item = base_service.build_img_infos_item(article_item)
+        if article_item['type'] in image_types:
+            item = base_service.build_img_infos_item(article_item, signed_map=signed_map)
         results.append(item)
     return results
 
@@ -223,28 +306,31 @@ async def get_post_detail_for_handler(pid, viewer_uid, check_deleted=True):
     if check_deleted and post['status'] in [const_post.POST_STATUS_INVISIBLE, const_post.POST_STATUS_SELF_DELETE]:
         return build_post_info(post, {}, {})
 
-    # 最近10个用户数据，优先包含自己。
+    # 并发查询, 仅用户映射表依赖最近点赞用户
     from cores.favor import favor_service
-    like_uids = await favor_service.query_post_current_like_uids(pid, 10, viewer_uid)
-
-    # 查询用户ID映射表
-    uids = [post['uid'], viewer_uid]
-    uids.extend(like_uids)
-    user_map = await user_service.get_user_map_by_uids(uids)
-
-    # 用户喜好映射表
-    favor_map = await favor_service.get_favor_map_by_ids([post['uid'], viewer_uid])
-
-    # 查询标签ID映射表
-    tids = post.get('tids', [])
-    tag_map = await tag_service.get_tag_map_by_tids(tids)
-
-    # 构造赞踩列表
-    like_pids, disliked_pids = await favor_service.get_user_liked_disliked_pids(viewer_uid, [pid])
+    stage_results = await base_service.gather_stages({
+        # 最近10个用户数据，优先包含自己。
+        'like_uids': (lambda r: favor_service.query_post_current_like_uids(pid, 10, viewer_uid), []),
+        # 查询用户ID映射表
+        'user_map': (lambda r: user_service.get_user_map_by_uids([post['uid'], viewer_uid] + r['like_uids']), ['like_uids']),
+        # 用户喜好映射表
+        'favor_map': (lambda r: favor_service.get_favor_map_by_ids([post['uid'], viewer_uid]), []),
+        # 查询标签ID映射表
+        'tag_map': (lambda r: tag_service.get_tag_map_by_tids(post.get('tids', [])), []),
+        # 构造赞踩列表
+        'like_info': (lambda r: favor_service.get_user_liked_disliked_pids(viewer_uid, [pid]), []),
+        # 查看者对作者、标签的关注状态, 作者对查看者的关注状态
+        'viewer_favor': (lambda r: follow_service.with_follow_state(
+            r['favor_map'].get(viewer_uid, {}), uids=[post['uid']], tids=post.get('tids', [])), ['favor_map']),
+        'post_user_favor': (lambda r: follow_service.with_follow_state(
+            r['favor_map'].get(post['uid'], {}), uids=[viewer_uid]), ['favor_map']),
+    }, label='get_post_detail_for_handler')
+    like_uids, user_map = stage_results['like_uids'], stage_results['user_map']
+    tag_map = stage_results['tag_map']
+    like_pids, disliked_pids = stage_results['like_info']
 
     # 返回结果数据
-    viewer_favor = favor_map.get(viewer_uid, {})
-    post_user_favor = favor_map.get(post['uid'], {})
+    viewer_favor, post_user_favor = stage_results['viewer_favor'], stage_results['post_user_favor']
     result = build_post_info(post, tag_map, user_map, viewer_favor_info=viewer_favor, like_pids=like_pids, disliked_pids=disliked_pids)
     # 作者信息
     result['user'] = user_service.build_user_info_by_favor(user_map.get(post['uid']), viewer_favor_info=viewer_favor, user_favor_info=post_user_favor)
@@ -285,6 +371,7 @@ async def create_new_post(uid, text, post_type, cmts=0, likes=0, status='', ct=N
         'status': status,
         'ut': ct,
         'ct': ct,
+        'cut': ct,                      # 内容更新时间, 修改标题、正文、图片时需同步更新
 
         'cmts': cmts,                   # 评论数
         'likes': likes,                 # 点赞数
@@ -333,6 +420,10 @@ async def delete_user_post_for_handler(p_uid, pid):
     if not before_post or before_post['status'] == const_post.POST_STATUS_SELF_DELETE:
         return
 
+    # 移出推荐候选索引
+    if before_post['status'] == const_post.POST_STATUS_REC:
+        await remove_post_from_rec_candidates(pid)
+
     # 更改用户发出的帖子数目-1
     from cores.favor import favor_service
     await favor_service.increase_favor_count_stat(p_uid, post_num_inc_num=-1)
@@ -370,53 +461,109 @@ async def increase_post_count_stat(pid, cmt_inc_num=0, likes_inc_num=0,
     # 更新修改时间
     set_dict = {'ut': int(time.time())}
 
-    # 保存修改数据
-    update_dict = {}
-    if inc_dict:
-        update_dict['$inc'] = inc_dict
-    if set_dict:
-        update_dict['$set'] = set_dict
+    # 更新计数, 合并后定时落库
+    counter_aggregator.increase(post_col, pid, inc_dict, set_dict)
 
-    if not update_dict:
-        return
 
-    # 更新计数
-    query_dict = {'_id': pid}
-    if isinstance(pid, str):
-        query_dict['_id'] = ObjectId(pid)
-    await mongo_async.mongo_update_one(post_col, query_dict, update_dict, up=False)
+async def rebuild_post_rec_candidates():
+    """
+    从数据库重建推荐候选帖子索引
+    """
+    recommend_query_dict = {
+        'status': const_post.POST_STATUS_REC,
+    }
+    recommend_sorts = [('rt', -1), ('_id', -1)]
+    col_post = db.get_motordb_col_post()
+    projection = {'_id': True, 'ct': True, 'rt': True}
+    recommend_post_list = await mongo_async.mongo_find_sort_skip_limit(
+        col_post, recommend_query_dict, recommend_sorts, 0, POST_REC_CANDIDATE_MAX_NUM, projection)
 
+    pairs = [-1, POST_REC_BUILT_MEMBER]
+    for post in recommend_post_list or []:
+        pairs.extend([post.get('rt') or post['ct'], str(post['_id'])])
+    await db.long_aioredis.zadd(POST_REC_CANDIDATE_KEY, *pairs)
 
-async def get_recommend_post_info_list_for_handler_v1(uid, favor_info=None):
+
+async def add_post_to_rec_candidates(pid, rt):
     """
-    推荐流数据
-    :return:
+    帖子加入推荐候选索引, 索引不存在时等待读取时重建
+    """
+    pipe = db.long_aioredis.pipeline()
+    pipe.zadd(POST_REC_CANDIDATE_KEY, rt, pid)
+    # 保留构建标识(rank 0)和最近的候选帖子
+    pipe.zremrangebyrank(POST_REC_CANDIDATE_KEY, 1, -(POST_REC_CANDIDATE_MAX_NUM + 1))
+    await pipe.execute()
+
+
+async def remove_post_from_rec_candidates(pid):
+    """
+    帖子移出推荐候选索引
+    """
+    await db.long_aioredis.zrem(POST_REC_CANDIDATE_KEY, pid)
+
+
+async def rebuild_post_rec_seen(uid):
+    """
+    从数据库重建用户已浏览的推荐帖子集合
     """
-    # 获取最近用户浏览的推荐pids
     his_query_dict = {
         "uid": uid,
     }
     his_sorts = [('ct', -1)]
     col_post_recommend_history = db.get_motordb_col_post_recommend_history()
-    history_list = await mongo_async.mongo_find_sort_skip_limit(col_post_recommend_history, his_query_dict, his_sorts, 0, 1000)
-    history_pids_set = set([his['pid'] for his in history_list])
+    history_list = await mongo_async.mongo_find_sort_skip_limit(
+        col_post_recommend_history, his_query_dict, his_sorts, 0, POST_REC_SEEN_MAX_NUM, projection={'pid': True, 'ct': True})
 
-    # 获取最近上推荐的pids
-    recommend_query_dict = {
-        'status': const_post.POST_STATUS_REC,
-    }
-    recommend_sorts = [('rt', -1)]
-    col_post = db.get_motordb_col_post()
-    projection = {'_id': True}
-    recommend_post_list = await mongo_async.mongo_find_sort_skip_limit(col_post, recommend_query_dict, recommend_sorts, 0, 1000, projection)
-    recommend_pids_list = [str(post['_id']) for post in recommend_post_list]
+    key = POST_REC_SEEN_KEY % uid
+    pairs = [float('inf'), POST_REC_BUILT_MEMBER]
+    for his in history_list or []:
+        pairs.extend([his.get('ct', 0), his['pid']])
+    pipe = db.long_aioredis.pipeline()
+    pipe.zadd(key, *pairs)
+    pipe.expire(key, POST_REC_SEEN_EXPIRE)
+    await pipe.execute()
 
-    # 过滤已浏览pid
-    recommend_pids_list = list(filter(lambda pid: pid not in history_pids_set, recommend_pids_list))
 
-    # 获取帖子信息
+async def select_unseen_rec_pids(uid, num):
+    """
+    从推荐候选索引中按推荐时间倒序选取用户未浏览的帖子
+    :param uid:
+    :param num: 选取数目
+    :return: pid 列表
+    """
+    seen_key = POST_REC_SEEN_KEY % uid
+    for i in range(2):
+        pipe = db.long_aioredis.pipeline()
+        pipe.zscore(POST_REC_CANDIDATE_KEY, POST_REC_BUILT_MEMBER)
+        pipe.zscore(seen_key, POST_REC_BUILT_MEMBER)
+        pipe.eval(POST_REC_SELECT_SCRIPT, keys=[POST_REC_CANDIDATE_KEY, seen_key],
+                  args=[num, 100, POST_REC_CANDIDATE_MAX_NUM])
+        candidates_built, seen_built, pids = await pipe.execute()
+
+        # 索引不存在时重建后重新选取
+        if (candidates_built is not None and seen_built is not None) or i > 0:
+            break
+        if candidates_built is None:
+            await rebuild_post_rec_candidates()
+        if seen_built is None:
+            await rebuild_post_rec_seen(uid)
+
+    return pids or []
+
+
+async def get_recommend_post_info_list_for_handler_v1(uid, favor_info=None):
+    """
+    推荐流数据
+    :return:
+    """
+    # 选取最近上推荐且未浏览的pids
     recommend_num = 5
-    query_dict = build_post_query_dict(pid=recommend_pids_list[:recommend_num])
+    recommend_pids_list = await select_unseen_rec_pids(uid, recommend_num)
+    if not recommend_pids_list:
+        return []
+
+    # 获取帖子信息
+    query_dict = build_post_query_dict(pid=recommend_pids_list)
     cursor_info = {'offset': 0, 'limit': recommend_num}
     _, _, posts = await get_post_info_list_for_handler(uid, cursor_info, query_dict=query_dict, sorts=None, favor_info=favor_info)
     return posts
@@ -452,6 +599,17 @@ async def record_recommend_post_history(uid, pids):
 
     await post_rec_his_col.bulk_write(updates, ordered=False)
 
+    # 记录已浏览集合, 只保留最近 POST_REC_SEEN_MAX_NUM 条(另有构建标识)
+    key = POST_REC_SEEN_KEY % uid
+    pairs = []
+    for pid in pids:
+        pairs.extend([ct, pid])
+    pipe = db.long_aioredis.pipeline()
+    pipe.zadd(key, *pairs)
+    pipe.zremrangebyrank(key, 0, -(POST_REC_SEEN_MAX_NUM + 2))
+    pipe.expire(key, POST_REC_SEEN_EXPIRE)
+    await pipe.execute()
+
 
 async def get_history_recommend_post_info_list_for_handler(uid, favor_info=None):
     """
@@ -500,8 +658,17 @@ async def update_post_status_for_handler(pid, new_status):
     if not (pid and new_status is not None):
         return False
 
-    # 更新帖子标签
+    # 更新帖子状态, 上推荐时记录推荐时间
+    set_dict = {'status': new_status}
+    if new_status == const_post.POST_STATUS_REC:
+        set_dict['rt'] = int(time.time())
     post_col = db.get_motordb_col_post()
-    await mongo_async.mongo_update_one(post_col, {'_id': ObjectId(pid)}, {'$set': {'status': new_status}})
+    await mongo_async.mongo_update_one(post_col, {'_id': ObjectId(pid)}, {'$set': set_dict})
+
+    # 更新推荐候选索引
+    if new_status == const_post.POST_STATUS_REC:
+        await add_post_to_rec_candidates(pid, set_dict['rt'])
+    else:
+        await remove_post_from_rec_candidates(pid)
 
 
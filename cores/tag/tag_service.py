@@ -4,10 +4,108 @@ tag service 方法
 """
 import time
 from bson import ObjectId
+from tornado.ioloop import PeriodicCallback
 
 from cores.const import const_tag, const_base
 from cores.database import mongo_async, db
 from cores.base import base_service
+from cores.follow import follow_service
+from cores.utils import logger
+from cores.utils.counter_aggregator import counter_aggregator
+
+
+class TagDictionary(object):
+    """
+    进程内标签字典
+    启动时全量加载, 之后按 ut 水位增量刷新, 查询时不产生 I/O。
+    注意: post_num/favor_num 等计数字段为稍旧的快照, 本进程的计数在落库后同步到字典,
+    尚未落库的增量在 build_tag_base_info 中叠加; 其他进程的修改要等下一次增量刷新才可见。
+    """
+    # 增量刷新间隔(秒)
+    refresh_interval = 10
+
+    def __init__(self):
+        self.tags = {}
+        self.watermark = 0
+        self._periodic_callback = None
+
+    def clear(self):
+        self.tags = {}
+        self.watermark = 0
+
+    def _save_tags(self, tags):
+        for tag in tags or []:
+            self.tags[str(tag['_id'])] = tag
+            if tag.get('ut', 0) > self.watermark:
+                self.watermark = tag['ut']
+
+    async def load_all(self):
+        """
+        全量加载
+        """
+        tag_col = db.get_motordb_col_tag()
+        tags = await mongo_async.mongo_find(tag_col, {})
+        if tags is False:
+            return
+        self.tags = {}
+        self.watermark = 0
+        self._save_tags(tags)
+        logger.info('[TagDictionary] load %d tags' % len(self.tags))
+
+    async def refresh(self):
+        """
+        增量刷新: 同一秒内可能有多次修改, 因此使用 $gte 水位
+        """
+        tag_col = db.get_motordb_col_tag()
+        tags = await mongo_async.mongo_find(tag_col, {'ut': {'$gte': self.watermark}})
+        self._save_tags(tags)
+
+    def start_refresh(self):
+        """
+        启动定时增量刷新
+        """
+        if self._periodic_callback:
+            return
+        self._periodic_callback = PeriodicCallback(self.refresh, self.refresh_interval * 1000)
+        self._periodic_callback.start()
+
+    async def get_tag_map_by_tids(self, tids):
+        """
+        批量获取标签, 字典中不存在的标签回源查询
+        """
+        result = {}
+        miss_tids = []
+        for tid in set(tids):
+            tag = self.tags.get(tid)
+            if tag:
+                result[tid] = tag
+            else:
+                miss_tids.append(tid)
+
+        if miss_tids:
+            tag_col = db.get_motordb_col_tag()
+            tags = await mongo_async.mongo_find(tag_col, {'_id': {'$in': base_service.ensure_mongo_obj_ids(miss_tids)}})
+            self._save_tags(tags)
+            for tag in tags or []:
+                result[str(tag['_id'])] = tag
+        return result
+
+    def on_counter_flushed(self, docs):
+        """
+        本进程计数落库后同步到字典
+        """
+        for tid, item in docs.items():
+            tag = self.tags.get(tid)
+            if not tag:
+                continue
+            for key, value in item['$inc'].items():
+                tag[key] = tag.get(key, 0) + value
+            tag.update(item['$set'])
+
+
+# 进程内标签字典
+tag_dict = TagDictionary()
+counter_aggregator.add_flush_listener('tag', tag_dict.on_counter_flushed)
 
 
 def build_tag_query_dict(tid=None, name=None, status=None, ttype=None):
@@ -48,18 +146,20 @@ async def query_tags_detail_for_handler(tid, viewer_favor_info=None):
     tag = await mongo_async.mongo_find_one(tag_col, {'_id': ObjectId(tid)})
     if not tag:
         return {}
+    viewer_favor_info = await follow_service.with_follow_state(viewer_favor_info, tids=[tid])
     return build_tag_info_by_favor(tag, viewer_favor=viewer_favor_info)
 
 
-async def query_tags_for_handler(offset=0, limit=10, query_dict=None, sorts=None, viewer_favor_info=None):
+async def query_tags_for_handler(offset=0, limit=10, query_dict=None, sorts=None, viewer_favor_info=None, read_replica=True):
     """
     查询标签列表
+    :param read_replica: 是否从库读取
     :return:
     """
     query_dict = query_dict or {}
     sorts = sorts or [('post_num', -1)]
 
-    tag_col = db.get_motordb_col_tag()
+    tag_col = db.get_motordb_col_tag_r() if read_replica else db.get_motordb_col_tag()
     tags = await mongo_async.mongo_find_sort_skip_limit(tag_col, query_dict, sorts, offset, limit+1)
     if not tags:
         return False, {}, []
@@ -68,6 +168,7 @@ async def query_tags_for_handler(offset=0, limit=10, query_dict=None, sorts=None
     tags = tags[:limit]
     next_cursor_info = {'offset': offset+limit, 'limit': limit}
 
+    viewer_favor_info = await follow_service.with_follow_state(viewer_favor_info, tids=[str(tag['_id']) for tag in tags])
     result = []
     for tag in tags:
         res = build_tag_info_by_favor(tag, viewer_favor=viewer_favor_info)
@@ -78,6 +179,7 @@ async def query_tags_for_handler(offset=0, limit=10, query_dict=None, sorts=None
 def build_tag_info_by_favor(tag, viewer_favor=None):
     """
     构造标签信息, 包含是否有查看者已关注标识。
+    :param viewer_favor: 查看者喜好信息, 需经 follow_service.with_follow_state 附加对该标签的关注状态
     :return:
     """
     result = {}
@@ -87,7 +189,7 @@ def build_tag_info_by_favor(tag, viewer_favor=None):
         # 查看者是否已关注该标题
         result['favored'] = False
         if viewer_favor:
-            result['favored'] = result['tid'] in viewer_favor.get('f_tids', [])
+            result['favored'] = result['tid'] in viewer_favor.get('f_tids', ())
 
     return result
 
@@ -99,6 +201,8 @@ def build_tag_base_info(tag):
     """
     result = {}
     if tag:
+        # 叠加尚未落库的计数
+        tag = counter_aggregator.overlay('tag', tag)
         result = {
             'tid': str(tag['_id']),
             'ttypes': tag['ttypes'],
@@ -143,6 +247,10 @@ async def create_new_tag(name, raw_cover, desc='', ttypes=None, post_num=0, crt_
     tid = await mongo_async.mongo_insert_one(tag_col, new_tag, returnid=True)
     if not tid:
         return ''
+
+    # 写入标签字典
+    tag_dict.tags[str(tid)] = new_tag
+
     tid = str(tid)
     return tid
 
@@ -156,11 +264,7 @@ async def get_tag_map_by_tids(tids):
     if not tids:
         return result
 
-    tag_col = db.get_motordb_col_tag()
-    tags = await mongo_async.mongo_find(tag_col, {'_id': {'$in': base_service.ensure_mongo_obj_ids(tids)}})
-    for tag in tags:
-        result[str(tag['_id'])] = tag
-    return result
+    return await tag_dict.get_tag_map_by_tids(tids)
 
 
 async def increase_tag_count_stat(tid_or_tids=None, post_num_inc_num=0, favor_num_inc=0, view_num=0):
@@ -178,9 +282,6 @@ async def increase_tag_count_stat(tid_or_tids=None, post_num_inc_num=0, favor_nu
     if not tid_or_tids:
         return
 
-    # 查询条件
-    query_dict = build_tag_query_dict(tid_or_tids)
-
     # 新增计数
     inc_dict = {}
     if post_num_inc_num:
@@ -193,14 +294,9 @@ async def increase_tag_count_stat(tid_or_tids=None, post_num_inc_num=0, favor_nu
     # 更新修改时间
     set_dict = {'ut': int(time.time())}
 
-    # 保存修改数据
-    update_dict = {}
-    if inc_dict:
-        update_dict['$inc'] = inc_dict
-    if set_dict:
-        update_dict['$set'] = set_dict
-
-    # 更新tag统计
+    # 更新tag统计, 合并后定时落库
     tag_col = db.get_motordb_col_tag()
-    await mongo_async.mongo_update(tag_col, query_dict, update_dict)
+    tids = [tid_or_tids] if isinstance(tid_or_tids, str) else tid_or_tids
+    for tid in tids:
+        counter_aggregator.increase(tag_col, tid, inc_dict, set_dict)
 
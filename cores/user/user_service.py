@@ -11,6 +11,12 @@ from cores.const import const_user, const_base
 from cores.database import db, mongo_async
 from cores.base import base_service
 from cores.base.base_service import AioRedisSession
+from cores.utils.entity_cache import AioEntityCache
+from cores.follow import follow_service
+
+
+# 用户信息缓存, 供 get_user_map_by_uids 使用
+user_entity_cache = AioEntityCache('user', local_max_size=4096, local_ttl=30, expire_time=60*10)
 
 
 def build_user_base_info(user, need_passwd=False, need_raw_name=False):
@@ -218,6 +224,7 @@ async def update_user_by_uid(uid, name='', passwd='', nick=None, raw_avatar=None
     user = {}
     if update_dict:
         user = await mongo_async.mongo_find_one_and_update(user_col, {'_id': ObjectId(uid)}, update_dict, upsert=True)
+        await user_entity_cache.evict(uid)
 
     return user
 
@@ -235,31 +242,52 @@ def get_user_login_from_type(is_pc=False):
 
 async def reset_user_passwd(name, new_passwd):
     """
-    创建新用户
+    重置用户密码
     """
     user_col = db.get_motordb_col_user()
-    await mongo_async.mongo_update_one(user_col, {'name': name}, {'$set': {'passwd': new_passwd}})
+    user = await mongo_async.mongo_find_one_and_update(user_col, {'name': name}, {'$set': {'passwd': new_passwd}})
+    if user:
+        await user_entity_cache.evict(str(user['_id']))
 
 
 async def get_user_map_by_uids(uids):
     """
-    批量获取用户信息映射表
+    批量获取用户信息映射表, 优先读取缓存, 未命中的用户一次批量回源。
+    注意: 返回的用户信息为缓存共享数据且不包含密码, 不要直接修改。
     :return:
     """
     if not uids:
         return {}
 
+    return await user_entity_cache.get_many(uids, load_user_map_by_uids)
+
+
+async def load_user_map_by_uids(uids):
+    """
+    从数据库批量获取用户信息映射表
+    :return:
+    """
     result = {}
     user_col = db.get_motordb_col_user()
-    user_list = await mongo_async.mongo_find(user_col, {'_id': {'$in': base_service.ensure_mongo_obj_ids(uids)}})
-    for user in user_list:
+    user_list = await mongo_async.mongo_find(
+        user_col, {'_id': {'$in': base_service.ensure_mongo_obj_ids(uids)}}, projection={'passwd': False})
+    for user in user_list or []:
         result[str(user['_id'])] = user
     return result
 
 
+def get_user_map_cache_stats():
+    """
+    用户信息缓存命中统计
+    """
+    return user_entity_cache.get_stats()
+
+
 def build_user_info_by_favor(user, need_passwd=False, viewer_favor_info=None, user_favor_info=None):
     """
     构建用户信息, 包含关注信息标识
+    :param viewer_favor_info: 查看者喜好信息, 需经 follow_service.with_follow_state 附加对该用户的关注状态
+    :param user_favor_info: 该用户喜好信息, 判断 fans_to_viewer 时需附加对查看者的关注状态
     :return:
     """
     if not user:
@@ -271,12 +299,12 @@ def build_user_info_by_favor(user, need_passwd=False, viewer_favor_info=None, us
     # 查看者是否已经关注该用户
     result['favored'] = False
     if viewer_favor_info:
-        result['favored'] = result['uid'] in viewer_favor_info.get('f_uids', [])
+        result['favored'] = result['uid'] in viewer_favor_info.get('f_uids', ())
 
     # 该用户是否关注了查看者
     result['fans_to_viewer'] = False
     if user_favor_info and viewer_favor_info:
-        result['fans_to_viewer'] = viewer_favor_info['uid'] in user_favor_info.get('f_uids', [])
+        result['fans_to_viewer'] = viewer_favor_info['uid'] in user_favor_info.get('f_uids', ())
 
     # 被查看者的其他计数
     if user_favor_info:
@@ -323,14 +351,19 @@ async def get_user_info_list_for_handler(cursor_info, query_dict=None, sorts=Non
     limit = cursor_info.get('limit', const_user.USER_SEARCH_PAGE_PER_NUM)
     limit = min(const_user.USER_SEARCH_PAGE_PER_NUM, limit)
 
-    # 获取数据
+    # 获取数据, 优先使用seek分页
+    sorts = base_service.build_seek_sorts(sorts)
+    seek_query_dict, skip = base_service.build_seek_query_dict(query_dict, sorts, cursor_info)
     user_col = db.get_motordb_col_user()
-    users = await mongo_async.mongo_find_sort_skip_limit(user_col, query_dict, sorts, offset, limit + 1)
+    users = await mongo_async.mongo_find_sort_skip_limit(user_col, seek_query_dict, sorts, skip, limit + 1)
     has_more = bool(len(users) > limit)
     users = users[:limit]
     if not users:
         return False, {}, []
 
+    # 查看者关注状态
+    viewer_favor_info = await follow_service.with_follow_state(viewer_favor_info, uids=[str(user['_id']) for user in users])
+
     # 构造返回列表
     results = []
     for user in users:
@@ -339,10 +372,7 @@ async def get_user_info_list_for_handler(cursor_info, query_dict=None, sorts=Non
         )
 
     # 下一次分页信息
-    next_cursor_info = {
-        'offset': offset + limit,
-        'limit': limit,
-    }
+    next_cursor_info = base_service.build_next_seek_cursor_info(sorts, offset, limit, users[-1])
 
     return has_more, next_cursor_info, results
 
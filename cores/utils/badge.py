@@ -119,3 +119,24 @@ class AioBasicBadgeManager(object):
         key = self._build_cache_key(uid)
         return await self.my_redis.sismember(key, service_id)
 
+
+async def aio_get_multi_badge_num(uid, badge_managers, extra_keys=None, my_redis=None):
+    """
+    一次 pipeline 获取多个 badge 数目, 并可顺带 GET 其他 key
+    :param uid: 用户ID
+    :param badge_managers: AioBasicBadgeManager 列表, 需使用同一个 redis
+    :param extra_keys: 需要额外 GET 的 key 列表
+    :param my_redis: 指定 redis, 默认使用第一个 badge manager 的 redis
+    :return: (badge数目列表, 额外key的值列表)
+    """
+    extra_keys = extra_keys or []
+    my_redis = my_redis or badge_managers[0].my_redis
+
+    pipe = my_redis.pipeline()
+    for badge_manager in badge_managers:
+        pipe.scard(badge_manager._build_cache_key(uid))
+    for key in extra_keys:
+        pipe.get(key)
+    values = await pipe.execute()
+
+    return values[:len(badge_managers)], values[len(badge_managers):]
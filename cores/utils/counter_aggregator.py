@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+"""
+计数写合并: 进程内缓存 $inc 增量, 定时按集合一次 bulk_write 落库
+"""
+import asyncio
+from inspect import isawaitable
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from cores.database import mongo_async
+from cores.utils import logger
+
+
+class CounterAggregator(object):
+    """
+    计数写合并管理
+    同一文档的多次计数修改在内存中合并, 每 flush_interval 秒(或积压文档数达到 max_pending_docs 时)
+    按集合一次 bulk_write 落库。读取时通过 overlay 叠加尚未落库的增量。
+    落库异常时增量重新入队, 最多重试 max_flush_retries 次。
+    注意: 进程异常退出时, 未落库的增量会丢失; 正常退出时需调用 flush_all。
+    """
+    # 落库间隔(秒)
+    flush_interval = 1
+    # 积压文档数上限, 达到后立即落库
+    max_pending_docs = 500
+    # 落库异常(如主节点切换、连接断开)时增量重新入队, 最多重试次数
+    max_flush_retries = 3
+
+    def __init__(self):
+        self.collections = {}
+        # 待落库增量 {col_name: {doc_id: {'$inc': {}, '$set': {}}}}
+        self.pending = {}
+        # 落库中的增量, 落库完成前读取时仍需叠加
+        self.inflight = {}
+        # 落库完成回调 {col_name: [callback(docs)]}
+        self.flush_listeners = {}
+        self._pending_docs = 0
+        self._flushing = False
+        self._periodic_callback = None
+
+    def start(self):
+        """
+        启动定时落库
+        """
+        if self._periodic_callback:
+            return
+        self._periodic_callback = PeriodicCallback(self.flush, self.flush_interval * 1000)
+        self._periodic_callback.start()
+
+    def stop(self):
+        """
+        停止定时落库, 须在服务 loop 中调用
+        """
+        if self._periodic_callback:
+            self._periodic_callback.stop()
+            self._periodic_callback = None
+
+    def clear(self):
+        self.pending = {}
+        self.inflight = {}
+        self._pending_docs = 0
+
+    def add_flush_listener(self, col_name, callback):
+        """
+        注册落库完成回调
+        :param col_name: 集合名
+        :param callback: callback(docs), docs 为 {doc_id: {'$inc': {}, '$set': {}}}, 可以是协程方法
+        """
+        self.flush_listeners.setdefault(col_name, []).append(callback)
+
+    def increase(self, col, doc_id, inc_dict, set_dict=None):
+        """
+        缓存计数增量
+        :param col: motor 集合
+        :param doc_id: 文档 _id
+        :param inc_dict: $inc 增量
+        :param set_dict: 同时需要 $set 的字段, 如 ut, 后写覆盖先写
+        """
+        if not inc_dict and not set_dict:
+            return
+        if not ObjectId.is_valid(doc_id):
+            # 非法 id 无法落库, 丢弃, 避免整批落库失败
+            logger.error('[CounterAggregator] %s drop updates of invalid id %r' % (col.name, doc_id))
+            return
+
+        doc_id = str(doc_id)
+        self.collections[col.name] = col
+        docs = self.pending.setdefault(col.name, {})
+        item = docs.get(doc_id)
+        if item is None:
+            item = docs[doc_id] = {'$inc': {}, '$set': {}}
+            self._pending_docs += 1
+
+        for key, value in (inc_dict or {}).items():
+            item['$inc'][key] = item['$inc'].get(key, 0) + value
+        if set_dict:
+            item['$set'].update(set_dict)
+
+        # 积压过多时立即落库
+        if self._pending_docs >= self.max_pending_docs:
+            IOLoop.current().add_callback(self.flush)
+
+    def get_pending_inc(self, col_name, doc_id):
+        """
+        获取文档尚未落库的计数增量
+        """
+        result = {}
+        doc_id = str(doc_id)
+        for buffer in (self.inflight, self.pending):
+            item = buffer.get(col_name, {}).get(doc_id)
+            if not item:
+                continue
+            for key, value in item['$inc'].items():
+                result[key] = result.get(key, 0) + value
+        return result
+
+    def overlay(self, col_name, doc):
+        """
+        给文档叠加尚未落库的计数增量
+        存在增量时返回浅拷贝, 不修改原文档(可能是共享的缓存数据)
+        """
+        if not doc or (not self.pending and not self.inflight):
+            return doc
+
+        inc_dict = self.get_pending_inc(col_name, doc['_id'])
+        if not inc_dict:
+            return doc
+
+        doc = dict(doc)
+        for key, value in inc_dict.items():
+            doc[key] = doc.get(key, 0) + value
+        return doc
+
+    async def flush(self):
+        """
+        落库当前全部增量
+        """
+        if self._flushing or not self.pending:
+            return
+
+        self._flushing = True
+        self.inflight, self.pending = self.pending, {}
+        self._pending_docs = 0
+        try:
+            for col_name, docs in self.inflight.items():
+                requests = []
+                for doc_id, item in docs.items():
+                    update_dict = {}
+                    inc_dict = {key: value for key, value in item['$inc'].items() if value}
+                    if inc_dict:
+                        update_dict['$inc'] = inc_dict
+                    if item['$set']:
+                        update_dict['$set'] = item['$set']
+                    if update_dict:
+                        requests.append(UpdateOne({'_id': ObjectId(doc_id)}, update_dict))
+                if not requests:
+                    continue
+
+                try:
+                    ret = await mongo_async.mongo_bulk_write(self.collections[col_name], requests, ordered=False)
+                except Exception as e:
+                    # 请求未完成, 增量重新入队等待下次落库
+                    logger.error('[CounterAggregator] %s flush failed, %s' % (col_name, str(e)))
+                    self._requeue(col_name, docs)
+                    # 已在待落库增量中, 读取时不能重复叠加
+                    self.inflight[col_name] = {}
+                    continue
+                if not ret:
+                    # BulkWriteError: 其余操作已生效, 失败的操作为确定性错误, 重试会重复计数
+                    # 仍需执行回调, 清除缓存的操作是幂等的
+                    logger.error('[CounterAggregator] %s bulk write error in %d updates' % (col_name, len(requests)))
+
+                for callback in self.flush_listeners.get(col_name, []):
+                    try:
+                        ret = callback(docs)
+                        if isawaitable(ret):
+                            await ret
+                    except Exception as e:
+                        logger.error('[CounterAggregator] %s flush listener failed, %s' % (col_name, str(e)))
+        finally:
+            self.inflight = {}
+            self._flushing = False
+
+    def _requeue(self, col_name, docs):
+        """
+        落库失败的增量合并回待落库增量, 超过重试次数的丢弃
+        """
+        pending_docs = self.pending.setdefault(col_name, {})
+        for doc_id, item in docs.items():
+            retries = item.get('retries', 0) + 1
+            if retries > self.max_flush_retries:
+                logger.error('[CounterAggregator] %s drop updates of %s after %d retries, %r' % (col_name, doc_id, self.max_flush_retries, item))
+                continue
+
+            pending_item = pending_docs.get(doc_id)
+            if pending_item is None:
+                pending_docs[doc_id] = dict(item, retries=retries)
+                self._pending_docs += 1
+                continue
+
+            # 新的增量叠加, $set 以新写入为准
+            for key, value in item['$inc'].items():
+                pending_item['$inc'][key] = pending_item['$inc'].get(key, 0) + value
+            pending_item['$set'] = dict(item['$set'], **pending_item['$set'])
+            pending_item['retries'] = max(retries, pending_item.get('retries', 0))
+
+    async def flush_all(self):
+        """
+        等待进行中的落库完成, 并落库剩余全部增量, 用于服务退出
+        """
+        while self._flushing or self.pending:
+            if self._flushing:
+                await asyncio.sleep(0.01)
+                continue
+            await self.flush()
+
+
+# 全局计数写合并
+counter_aggregator = CounterAggregator()
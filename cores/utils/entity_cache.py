@@ -0,0 +1,236 @@
+# -*- coding:utf-8 -*-
+"""
+实体缓存: 进程内 LRU + redis 两级缓存
+"""
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+from cores.database import db
+from cores.utils import logger
+
+
+# 缓存未命中标识
+_MISSING = object()
+
+# 所有已注册的实体缓存, 用于统计展示
+ALL_ENTITY_CACHES = []
+
+# 回写 redis: 版本未变(回源期间没有 evict)时才写入, 防止旧数据覆盖失效
+# KEYS: 缓存key1, 版本key1, 缓存key2, 版本key2, ...; ARGV: 过期时间, 回源前的版本..., 缓存值...
+CACHE_SET_IF_VERSION_SCRIPT = """
+local n = #KEYS / 2
+local result = {}
+for i = 1, n do
+    local version = redis.call('GET', KEYS[2 * i]) or ''
+    if version == ARGV[1 + i] then
+        redis.call('SETEX', KEYS[2 * i - 1], ARGV[1], ARGV[1 + n + i])
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+
+class LocalLRUCache(object):
+    """
+    进程内 LRU 缓存, 每个 key 独立过期
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+
+        # 已过期
+        expire_at, value = item
+        if expire_at < time.time():
+            self._data.pop(key, None)
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.time() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class AioEntityCache(object):
+    """
+    两级实体缓存: 进程内 LRU + redis(REDIS_DB_FUNC_CACHE)
+    未命中的 key 通过 loader 一次批量回源。
+    evict 时递增 key 的版本, 回源期间发生过 evict 的数据不回写, 防止旧数据覆盖失效。
+    注意: 多进程部署时, 其他进程的进程内缓存最多保留 local_ttl 秒的旧数据。
+    """
+    expire_time = 60 * 10
+
+    def __init__(self, name, local_max_size=2048, local_ttl=30, expire_time=None, my_redis=None):
+        self.name = name
+        self.local_cache = LocalLRUCache(local_max_size, local_ttl)
+        self._my_redis = my_redis
+        if expire_time:
+            self.expire_time = expire_time
+
+        # 进程内 evict 序号, 判断回源期间是否发生过 evict
+        self._evict_seq = 0
+        self._evicted = LocalLRUCache(local_max_size, ttl=60)
+
+        # 命中统计
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.loads = 0
+
+        ALL_ENTITY_CACHES.append(self)
+
+    @property
+    def my_redis(self):
+        if self._my_redis:
+            return self._my_redis
+        return db.func_aioredis
+
+    def _build_cache_key(self, key):
+        return 'entity_cache_%s_%s' % (self.name, key)
+
+    def _build_version_key(self, key):
+        return 'entity_cache_ver_%s_%s' % (self.name, key)
+
+    async def get_many(self, keys, loader):
+        """
+        批量获取实体
+        :param keys: key 列表
+        :param loader: 回源方法 async loader(miss_keys) -> {key: obj}
+        :return: {key: obj}, 不存在的 key 不出现在结果中
+        """
+        result = {}
+        keys = [str(key) for key in set(keys) if key]
+        if not keys:
+            return result
+
+        # 进程内缓存
+        redis_keys = []
+        for key in keys:
+            value = self.local_cache.get(key, _MISSING)
+            if value is _MISSING:
+                redis_keys.append(key)
+                continue
+            self.local_hits += 1
+            if value is not None:
+                result[key] = value
+
+        # redis 缓存, 同时读取版本供回写时比较
+        miss_keys = redis_keys
+        versions = {}
+        if redis_keys and self.my_redis:
+            miss_keys = []
+            try:
+                raw_values = await self.my_redis.mget(
+                    *[self._build_cache_key(key) for key in redis_keys], *[self._build_version_key(key) for key in redis_keys])
+            except Exception as e:
+                logger.error('[AioEntityCache] %s mget failed, %s' % (self.name, str(e)))
+                raw_values = [None] * len(redis_keys) * 2
+            for key, raw_value, version in zip(redis_keys, raw_values, raw_values[len(redis_keys):]):
+                if raw_value is None:
+                    miss_keys.append(key)
+                    versions[key] = version or ''
+                    continue
+                self.redis_hits += 1
+                value = json_util.loads(raw_value)
+                self.local_cache.set(key, value)
+                result[key] = value
+
+        if not miss_keys:
+            return result
+
+        # 批量回源
+        self.misses += len(miss_keys)
+        self.loads += 1
+        start_seq = self._evict_seq
+        loaded = await loader(miss_keys) or {}
+        result.update(loaded)
+
+        # 回源期间本进程发生过 evict 的数据不缓存
+        cache_keys = [key for key in miss_keys if self._evicted.get(key, 0) <= start_seq]
+
+        # 回写 redis, 其他进程在回源期间 evict 过的数据不回写
+        redis_keys = [key for key in cache_keys if key in loaded and key in versions]
+        if redis_keys:
+            try:
+                flags = await self.my_redis.eval(
+                    CACHE_SET_IF_VERSION_SCRIPT,
+                    keys=[k for key in redis_keys for k in (self._build_cache_key(key), self._build_version_key(key))],
+                    args=[self.expire_time] + [versions[key] for key in redis_keys] + [json_util.dumps(loaded[key]) for key in redis_keys])
+                stale_keys = set(key for key, flag in zip(redis_keys, flags) if not flag)
+                cache_keys = [key for key in cache_keys if key not in stale_keys]
+            except Exception as e:
+                logger.error('[AioEntityCache] %s setex failed, %s' % (self.name, str(e)))
+
+        for key in cache_keys:
+            # 不存在的数据只在进程内短暂记录, 防止反复回源
+            self.local_cache.set(key, loaded.get(key))
+
+        return result
+
+    async def evict(self, *keys):
+        """
+        删除指定缓存
+        """
+        keys = [str(key) for key in keys if key]
+        if not keys:
+            return
+        self._evict_seq += 1
+        for key in keys:
+            self._evicted.set(key, self._evict_seq)
+        self.local_cache.delete(*keys)
+        if self.my_redis:
+            # 先递增版本再删除, 回源中的旧数据不会回写
+            pipe = self.my_redis.pipeline()
+            for key in keys:
+                pipe.incr(self._build_version_key(key))
+                pipe.expire(self._build_version_key(key), self.expire_time)
+            pipe.delete(*[self._build_cache_key(key) for key in keys])
+            await pipe.execute()
+
+    def get_stats(self):
+        """
+        获取命中统计, saved_reads 即节省的回源次数
+        """
+        hits = self.local_hits + self.redis_hits
+        total = hits + self.misses
+        return {
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'saved_reads': hits,
+            'hit_ratio': round(hits / total, 4) if total else 0,
+            'local_size': len(self.local_cache),
+        }
+
+
+def get_all_entity_cache_stats():
+    """
+    获取所有实体缓存的命中统计
+    """
+    return {cache.name: cache.get_stats() for cache in ALL_ENTITY_CACHES}
@@ -0,0 +1,46 @@
+# -*- coding:utf-8 -*-
+"""
+json 编解码: 所有 handler 统一的序列化入口, 支持嵌入预编码片段
+"""
+import ujson
+
+
+class RawJSON(object):
+    """
+    预编码的 json 片段, 序列化时原样输出, 不再重复编码
+    依赖 ujson 对 __json__ 方法的支持
+    注意: 片段为共享数据, 不能修改
+    """
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+    def __json__(self):
+        return self.encoded
+
+    def __repr__(self):
+        return 'RawJSON(%s)' % self.encoded
+
+
+def dumps(obj):
+    """
+    序列化, 中文不转义
+    :param obj: 可包含 RawJSON 片段
+    :return: str
+    """
+    return ujson.dumps(obj, ensure_ascii=False)
+
+
+def loads(content):
+    """
+    反序列化
+    """
+    return ujson.loads(content)
+
+
+def encode_raw(obj):
+    """
+    预编码为 RawJSON 片段, 用于缓存不变的展示数据
+    """
+    return RawJSON(dumps(obj))
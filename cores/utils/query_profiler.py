@@ -0,0 +1,162 @@
+# -*- coding:utf-8 -*-
+"""
+mongo 查询统计: 按 (handler label, 集合, 操作) 统计耗时分布与返回文档数, 记录慢查询
+"""
+import time
+import contextvars
+from functools import wraps
+
+from config import config
+from cores.utils import logger, request_timing
+
+
+# 当前请求的 handler label, 由 check_permission 设置
+current_label = contextvars.ContextVar('current_label', default='')
+
+
+def build_query_shape(query):
+    """
+    构造查询形状: 保留字段与操作符, 值替换为 '?'
+    """
+    if isinstance(query, dict):
+        return {key: build_query_shape(value) for key, value in query.items()}
+    if isinstance(query, (list, tuple)):
+        # 同构列表(如 $in 的值)只保留一个元素
+        shapes = [build_query_shape(item) for item in query]
+        if shapes and all(shape == shapes[0] for shape in shapes):
+            return [shapes[0]]
+        return shapes
+    return '?'
+
+
+class QueryProfiler(object):
+    """
+    查询耗时统计
+    """
+    # 耗时分布桶上限(毫秒)
+    buckets_ms = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+    def __init__(self, enabled=True, slow_ms=100):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        # {(label, col_name, op): {}}
+        self.stats = {}
+
+    def record(self, col_name, op, elapsed_ms, docs=0, query=None):
+        """
+        记录一次查询
+        """
+        label = current_label.get()
+        key = (label, col_name, op)
+        item = self.stats.get(key)
+        if item is None:
+            item = self.stats[key] = {
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'docs': 0,
+                'slow': 0,
+                'buckets': [0] * (len(self.buckets_ms) + 1),
+            }
+
+        item['count'] += 1
+        item['total_ms'] += elapsed_ms
+        item['max_ms'] = max(item['max_ms'], elapsed_ms)
+        item['docs'] += docs
+        for i, bucket_ms in enumerate(self.buckets_ms):
+            if elapsed_ms <= bucket_ms:
+                item['buckets'][i] += 1
+                break
+        else:
+            item['buckets'][-1] += 1
+
+        # 慢查询
+        if elapsed_ms >= self.slow_ms:
+            item['slow'] += 1
+            logger.warn('[QueryProfiler] slow query %dms, label %s, %s.%s, docs %d, shape %s' % (
+                elapsed_ms, label, col_name, op, docs, build_query_shape(query)))
+
+    def clear(self):
+        self.stats = {}
+
+    def get_stats(self):
+        """
+        获取统计, 按总耗时倒序
+        """
+        results = []
+        for (label, col_name, op), item in self.stats.items():
+            results.append({
+                'label': label,
+                'col': col_name,
+                'op': op,
+                'count': item['count'],
+                'avg_ms': round(item['total_ms'] / item['count'], 2),
+                'max_ms': round(item['max_ms'], 2),
+                'total_ms': round(item['total_ms'], 2),
+                'docs': item['docs'],
+                'slow': item['slow'],
+            })
+        results.sort(key=lambda x: x['total_ms'], reverse=True)
+        return results
+
+    def export_metrics(self):
+        """
+        导出 prometheus 文本格式指标
+        """
+        lines = [
+            '# TYPE mongo_query_duration_ms histogram',
+        ]
+        for (label, col_name, op), item in self.stats.items():
+            tags = 'label="%s",col="%s",op="%s"' % (label, col_name, op)
+            cumulative = 0
+            for bucket_ms, num in zip(self.buckets_ms, item['buckets']):
+                cumulative += num
+                lines.append('mongo_query_duration_ms_bucket{%s,le="%s"} %d' % (tags, bucket_ms, cumulative))
+            lines.append('mongo_query_duration_ms_bucket{%s,le="+Inf"} %d' % (tags, item['count']))
+            lines.append('mongo_query_duration_ms_sum{%s} %.3f' % (tags, item['total_ms']))
+            lines.append('mongo_query_duration_ms_count{%s} %d' % (tags, item['count']))
+
+        lines.append('# TYPE mongo_query_docs_total counter')
+        for (label, col_name, op), item in self.stats.items():
+            tags = 'label="%s",col="%s",op="%s"' % (label, col_name, op)
+            lines.append('mongo_query_docs_total{%s} %d' % (tags, item['docs']))
+
+        lines.append('# TYPE mongo_slow_query_total counter')
+        for (label, col_name, op), item in self.stats.items():
+            tags = 'label="%s",col="%s",op="%s"' % (label, col_name, op)
+            lines.append('mongo_slow_query_total{%s} %d' % (tags, item['slow']))
+        return '\n'.join(lines) + '\n'
+
+
+# 全局查询统计
+query_profiler = QueryProfiler(enabled=config.DB_PROFILE_ENABLED, slow_ms=config.DB_SLOW_QUERY_MS)
+
+
+def profile_query(op):
+    """
+    mongo_async 方法统计装饰器, 被装饰方法的前两个参数为 (col, query)
+    :param op: 操作名
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(col, *args, **kwargs):
+            start = time.time()
+            ret = await func(col, *args, **kwargs)
+            elapsed_ms = (time.time() - start) * 1000
+
+            # 计入当前请求耗时
+            request_timing.add_mongo_time(elapsed_ms)
+            if not query_profiler.enabled:
+                return ret
+
+            # 返回文档数
+            if isinstance(ret, list):
+                docs = len(ret)
+            elif isinstance(ret, dict):
+                docs = 1
+            else:
+                docs = 0
+            query_profiler.record(col.name, op, elapsed_ms, docs, args[0] if args else None)
+            return ret
+        return wrapper
+    return decorator
@@ -1,32 +1,120 @@
 # -*- coding:utf-8 -*-
 """
-redis 锁集合
+redis 锁与限频集合
 """
+import time
+import uuid
+
 from cores.database import db
+from cores.utils.entity_cache import LocalLRUCache
 
 
-# 用户级别锁key
+# 用户级别锁key, 可按 uid、ip、设备号加锁
 USER_LOCK_RD_KEY = 'user_rd_lock_%s_%s'
 
+# 限频key
+RATE_LIMIT_RD_KEY = 'rate_limit_%s_%s'
+
+# 滑动窗口限频: 窗口内请求数未达上限时记录本次请求
+# KEYS[1]: 请求记录(zset); ARGV: 当前毫秒时间, 窗口毫秒数, 上限, 本次请求标识
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 1
+"""
+
+# 令牌桶限频: 按时间补充令牌, 足够时扣减
+# KEYS[1]: 令牌桶(hash); ARGV: 每秒补充数, 容量, 当前毫秒时间, 本次消耗数
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return allowed
+"""
 
-def user_redis_set_unblock_lock(uid, lock_name, lock_time=10):
+
+class LocalRejectFilter(object):
     """
-    获得用户级别的redis锁
-    :return:
+    进程内预过滤: 同一 key 连续被 redis 拒绝 reject_threshold 次后,
+    在 block_seconds 秒内直接本地拒绝, 挡住明显的刷接口请求
     """
-    rd_key = USER_LOCK_RD_KEY % (uid, lock_name)
-    lock_count = db.snap_rd_cli.incrby(rd_key)
+    # 连续拒绝次数阈值
+    reject_threshold = 3
+    # 本地拒绝时长上限(秒)
+    block_seconds = 1
+
+    def __init__(self, max_size=10000):
+        # {rd_key: 连续拒绝次数}
+        self.rejects = LocalLRUCache(max_size=max_size, ttl=60)
+        # {rd_key: True}
+        self.blocked = LocalLRUCache(max_size=max_size, ttl=self.block_seconds)
 
-    # 首次认为上锁成功
-    if lock_count == 1:
-        db.snap_rd_cli.expire(rd_key, lock_time)
-        return True
+    def is_blocked(self, rd_key):
+        return self.blocked.get(rd_key) is not None
 
-    # 否则认为上锁失败
-    return False
+    def on_reject(self, rd_key, ttl):
+        """
+        redis 拒绝后计数
+        :param ttl: 锁或限频窗口时长(秒)
+        """
+        count = (self.rejects.get(rd_key) or 0) + 1
+        self.rejects.set(rd_key, count, ttl=ttl)
+        if count >= self.reject_threshold:
+            self.blocked.set(rd_key, True, ttl=min(ttl, self.block_seconds))
 
+    def on_accept(self, rd_key):
+        self.rejects.delete(rd_key)
+        self.blocked.delete(rd_key)
 
-def user_redis_unlock(uid, lock_name):
+    def clear(self):
+        self.rejects.clear()
+        self.blocked.clear()
+
+
+# 全局预过滤
+local_filter = LocalRejectFilter()
+
+
+async def user_redis_lock(key_id, lock_name, lock_time=10):
+    """
+    获得用户级别的redis锁(SET NX EX, 原子上锁并设置过期), 不阻塞等待
+    :param key_id: uid、ip 或设备号
+    :param lock_name: 锁名, 一般为 handler label
+    :param lock_time: 锁过期时间(秒)
+    :return: 是否上锁成功
+    """
+    rd_key = USER_LOCK_RD_KEY % (key_id, lock_name)
+    if local_filter.is_blocked(rd_key):
+        return False
+
+    locked = await db.snap_aioredis.set(rd_key, 1, expire=lock_time, exist=db.snap_aioredis.SET_IF_NOT_EXIST)
+    if not locked:
+        local_filter.on_reject(rd_key, lock_time)
+        return False
+
+    local_filter.on_accept(rd_key)
+    return True
+
+
+async def user_redis_unlock(uid, lock_name):
     """
     解除用户级别的redis锁
     :param uid:
@@ -34,6 +122,65 @@ def user_redis_unlock(uid, lock_name):
     :return:
     """
     rd_key = USER_LOCK_RD_KEY % (uid, lock_name)
-    db.snap_rd_cli.delete(rd_key)
+    local_filter.on_accept(rd_key)
+    await db.snap_aioredis.delete(rd_key)
+
+
+async def sliding_window_allow(key_id, limit_name, limit, window):
+    """
+    滑动窗口限频: window 秒内最多 limit 次
+    :param key_id: uid、ip 或设备号
+    :param limit_name: 限频名称
+    :return: 是否允许
+    """
+    if window <= 0:
+        raise ValueError('sliding window must be positive, got %r' % window)
 
+    rd_key = RATE_LIMIT_RD_KEY % (key_id, limit_name)
+    if local_filter.is_blocked(rd_key):
+        return False
 
+    now_ms = int(time.time() * 1000)
+    allowed = await db.snap_aioredis.eval(
+        SLIDING_WINDOW_SCRIPT, keys=[rd_key], args=[now_ms, window * 1000, limit, '%d_%s' % (now_ms, uuid.uuid4().hex)])
+    if not allowed:
+        local_filter.on_reject(rd_key, window)
+        return False
+
+    local_filter.on_accept(rd_key)
+    return True
+
+
+async def token_bucket_allow(key_id, limit_name, rate, capacity, cost=1):
+    """
+    令牌桶限频: 每秒补充 rate 个令牌, 最多积累 capacity 个, 允许短时突发
+    :param key_id: uid、ip 或设备号
+    :param limit_name: 限频名称
+    :param rate: 每秒补充令牌数, 须大于 0
+    :return: 是否允许
+    """
+    if rate <= 0 or capacity <= 0:
+        raise ValueError('token bucket rate and capacity must be positive, got %r, %r' % (rate, capacity))
+
+    rd_key = RATE_LIMIT_RD_KEY % (key_id, limit_name)
+    if local_filter.is_blocked(rd_key):
+        return False
+
+    now_ms = int(time.time() * 1000)
+    allowed = await db.snap_aioredis.eval(TOKEN_BUCKET_SCRIPT, keys=[rd_key], args=[rate, capacity, now_ms, cost])
+    if not allowed:
+        # 补满一个令牌所需时间内本地拒绝
+        local_filter.on_reject(rd_key, max(int(cost / rate), 1))
+        return False
+
+    local_filter.on_accept(rd_key)
+    return True
+
+
+async def rate_limit_reset(key_id, limit_name):
+    """
+    清除限频记录
+    """
+    rd_key = RATE_LIMIT_RD_KEY % (key_id, limit_name)
+    local_filter.on_accept(rd_key)
+    await db.snap_aioredis.delete(rd_key)
@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+"""
+请求耗时分解: 单次请求内 mongo、redis、json 编码耗时及查询次数, 按 handler 统计滚动分位数
+"""
+import time
+import asyncio
+import contextvars
+from collections import deque
+
+import aioredis
+from aioredis.abc import AbcConnection, AbcPool
+
+
+# 当前请求的耗时记录, 由 check_permission 设置
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+
+class RequestTiming(object):
+    """
+    单次请求耗时记录
+    注意: 并发查询的耗时会重叠计算, 各部分之和可能大于总耗时
+    """
+    __slots__ = ('mongo_ms', 'mongo_count', 'redis_ms', 'redis_count', 'json_ms')
+
+    def __init__(self):
+        self.mongo_ms = 0.0
+        self.mongo_count = 0
+        self.redis_ms = 0.0
+        self.redis_count = 0
+        self.json_ms = 0.0
+
+    def build_log_fields(self, total_ms):
+        """
+        构造访问日志的结构化字段
+        """
+        handler_ms = max(total_ms - self.mongo_ms - self.redis_ms - self.json_ms, 0)
+        return 'mongo=%.1fms/%d redis=%.1fms/%d json=%.1fms handler=%.1fms' % (
+            self.mongo_ms, self.mongo_count, self.redis_ms, self.redis_count, self.json_ms, handler_ms)
+
+
+def start_request_timing():
+    """
+    开始记录当前请求耗时
+    :return: (耗时记录, 请求结束时用于 current_timing.reset 的 token)
+    """
+    timing = RequestTiming()
+    token = current_timing.set(timing)
+    return timing, token
+
+
+def add_mongo_time(elapsed_ms):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.mongo_ms += elapsed_ms
+        timing.mongo_count += 1
+
+
+class TimedRedis(aioredis.Redis):
+    """
+    记录命令耗时的 aioredis 客户端, 通过 create_redis_pool(commands_factory=TimedRedis) 使用
+    pipeline 整体记为一次请求
+    """
+
+    def execute(self, command, *args, **kwargs):
+        fut = super(TimedRedis, self).execute(command, *args, **kwargs)
+        # pipeline 缓冲中的命令在 pipeline 执行时统一记录
+        timing = current_timing.get()
+        if timing is not None and asyncio.isfuture(fut) and isinstance(self._pool_or_conn, (AbcPool, AbcConnection)):
+            start = time.time()
+
+            def on_done(_):
+                timing.redis_ms += (time.time() - start) * 1000
+                timing.redis_count += 1
+            fut.add_done_callback(on_done)
+        return fut
+
+    def pipeline(self):
+        pipe = super(TimedRedis, self).pipeline()
+        execute = pipe.execute
+
+        async def timed_execute(*, return_exceptions=False):
+            timing = current_timing.get()
+            start = time.time()
+            try:
+                return await execute(return_exceptions=return_exceptions)
+            finally:
+                if timing is not None:
+                    timing.redis_ms += (time.time() - start) * 1000
+                    timing.redis_count += 1
+
+        pipe.execute = timed_execute
+        return pipe
+
+
+class LatencyTracker(object):
+    """
+    按 handler 统计最近 window_size 次请求耗时的分位数
+    """
+
+    def __init__(self, window_size=1000):
+        self.window_size = window_size
+        # {label: deque([ms])}
+        self.latencies = {}
+
+    def record(self, label, elapsed_ms):
+        window = self.latencies.get(label)
+        if window is None:
+            window = self.latencies[label] = deque(maxlen=self.window_size)
+        window.append(elapsed_ms)
+
+    def clear(self):
+        self.latencies = {}
+
+    def get_percentiles(self):
+        """
+        获取各 handler 的 p50/p95/p99
+        """
+        result = {}
+        for label, window in self.latencies.items():
+            values = sorted(window)
+            if not values:
+                continue
+            result[label] = {
+                'count': len(values),
+                'p50': round(values[int(len(values) * 0.50)], 1),
+                'p95': round(values[min(int(len(values) * 0.95), len(values) - 1)], 1),
+                'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)], 1),
+            }
+        return result
+
+
+class LogSampler(object):
+    """
+    按 handler 确定性采样: 每 rate 次请求输出 1 次
+    """
+
+    def __init__(self, rates):
+        self.rates = rates
+        self.counters = {}
+
+    def should_log(self, label):
+        rate = self.rates.get(label, 1)
+        if rate <= 1:
+            return True
+        count = self.counters.get(label, 0)
+        self.counters[label] = count + 1
+        return count % rate == 0
+
+
+# 全局请求耗时分位数统计
+latency_tracker = LatencyTracker()
@@ -2,28 +2,46 @@
 """
 主入口
 """
+import os
+import sys
 import time
+import signal
 import asyncio
+import threading
+import subprocess
 
-import ujson
 from tornado import ioloop, web
 from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
 from tornado.options import define, parse_command_line, options
 
 from config import config
 from cores.base import base_service
-from cores.utils import logger
-from cores.database import db
+from cores.utils import logger, json_codec
+from cores.database import db, db_index
+from cores.utils.counter_aggregator import counter_aggregator
+from cores.utils.request_timing import latency_tracker, LogSampler
 
 # 初始化logger
 logger.init_logger(config.PROJECT_NAME)
 
+# 访问日志采样
+log_sampler = LogSampler(config.LOG_SAMPLE_RATES)
+
 
 class MyApplication(web.Application):
     def __init__(self, handlers=None, default_host="", transforms=None, **settings):
         web.Application.__init__(self, handlers, default_host, transforms, **settings)
+        # 处理中的请求数, 用于退出前等待请求处理完毕
+        self.inflight_requests = 0
+
+    def start_request(self, server_conn, request_conn):
+        self.inflight_requests += 1
+        return super(MyApplication, self).start_request(server_conn, request_conn)
 
     def log_request(self, handler):
+        self.inflight_requests = max(self.inflight_requests - 1, 0)
+
         # 指定method输出
         if handler.request.method not in ['GET', 'POST']:
             return
@@ -35,27 +53,32 @@ class MyApplication(web.Application):
         # logger级别
         log_method = logger.info
 
-        # 针对超高频轮询接口，采取随机抛弃打印策略
-        high_freq_uris = {
-            '/api/center/get_my_badges'
-        }
-        if handler.request.uri in high_freq_uris and int(time.time()) % 10 > 1:
+        label = getattr(handler, '_label', handler.__class__.__name__)
+        request_time = int(1000 * handler.request.request_time())
+        latency_tracker.record(label, request_time)
+
+        # 超高频轮询接口按 handler 确定性采样, 慢请求与错误请求始终输出
+        too_long = request_time >= 1000
+        if not too_long and handler.get_status() < 400 and not log_sampler.should_log(label):
             return
 
         # 保存参数信息
         try:
-            params_str = ujson.dumps(handler.params)
+            params_str = json_codec.dumps(handler.params)
         except:
             params_str = handler.request.body.decode("utf8")
 
+        # 耗时分解
+        timing = getattr(handler, 'timing', None)
+        timing_str = (' ' + timing.build_log_fields(request_time)) if timing else ''
+
         # 超时打印
-        request_time = int(1000 * handler.request.request_time())
-        if request_time >= 1000:
-            log_method("%d|%dms(too-long)\t%s █ para: %s\n" % (handler.get_status(), request_time, handler._request_summary(), params_str))
+        if too_long:
+            log_method("%d|%dms(too-long)%s\t%s █ para: %s\n" % (handler.get_status(), request_time, timing_str, handler._request_summary(), params_str))
             return
 
         # 正常输出
-        log_method("%d|%dms\t%s █ para: %s\n" % (handler.get_status(), request_time, handler._request_summary(), params_str))
+        log_method("%d|%dms%s\t%s █ para: %s\n" % (handler.get_status(), request_time, timing_str, handler._request_summary(), params_str))
 
 
 class StaticFileHandler(web.StaticFileHandler):
@@ -69,12 +92,92 @@ class StaticFileHandler(web.StaticFileHandler):
 
 # 定义环境变量
 define('port', default=9801, type=int)
+define('workers', default=1, type=int, help='worker进程数, 大于1时以master模式启动, 各worker共享端口(SO_REUSEPORT)')
+define('reuse_port', default=False, type=bool, help='使用SO_REUSEPORT监听端口, master模式下由master指定')
+define('drain_seconds', default=10, type=int, help='退出时等待处理中请求的最长时间')
+
+# 滚动重启时, 新worker启动后等待多久再停止旧worker
+WORKER_START_SECONDS = 3
+
+
+def run_master():
+    """
+    master进程: 启动并守护 workers 个worker子进程
+    SIGTERM/SIGINT: 通知所有worker平滑退出后退出
+    SIGHUP: 逐个滚动重启worker(新worker加载最新代码), 重启过程中始终有worker在服务
+    """
+    worker_args = [arg for arg in sys.argv[1:] if not arg.startswith(('--workers', '--reuse_port'))]
+    worker_cmd = [sys.executable, os.path.abspath(__file__)] + worker_args + ['--workers=1', '--reuse_port=true']
+    workers = {}
+    state = {'stopping': False, 'reloading': False}
+
+    def spawn_worker():
+        worker = subprocess.Popen(worker_cmd)
+        workers[worker.pid] = worker
+        logger.info('master start worker %d' % worker.pid)
+        return worker
+
+    def stop_worker(worker):
+        worker.terminate()
+        try:
+            worker.wait(options.drain_seconds + 5)
+        except subprocess.TimeoutExpired:
+            logger.error('master kill worker %d' % worker.pid)
+            worker.kill()
+            worker.wait()
+        workers.pop(worker.pid, None)
+
+    def sig_handler(sig, frame):
+        logger.info('master caught signal: %s' % sig)
+        if sig == signal.SIGHUP:
+            state['reloading'] = True
+        else:
+            state['stopping'] = True
+
+    signal.signal(signal.SIGTERM, sig_handler)
+    signal.signal(signal.SIGINT, sig_handler)
+    signal.signal(signal.SIGHUP, sig_handler)
+
+    for _ in range(options.workers):
+        spawn_worker()
+
+    while not state['stopping']:
+        time.sleep(0.5)
+
+        # 滚动重启
+        if state['reloading']:
+            state['reloading'] = False
+            for old_worker in list(workers.values()):
+                if state['stopping']:
+                    break
+                spawn_worker()
+                time.sleep(WORKER_START_SECONDS)
+                stop_worker(old_worker)
+
+        # 异常退出的worker重新拉起
+        for pid, worker in list(workers.items()):
+            if not state['stopping'] and worker.poll() is not None:
+                logger.error('master worker %d exit with %s, restart' % (pid, worker.returncode))
+                workers.pop(pid, None)
+                spawn_worker()
+
+    # 平滑退出: 先全部通知, 再逐个等待
+    for worker in list(workers.values()):
+        worker.terminate()
+    for worker in list(workers.values()):
+        stop_worker(worker)
+    logger.info('master exit')
 
 
 def main():
     # 解析启动命令
     parse_command_line()
 
+    # master模式, 数据库连接等均在worker进程中初始化
+    if options.workers > 1:
+        run_master()
+        return
+
     # 导入urls
     from server_app.url.url_app import app_urls
     from server_audit.url.url_audit import audit_urls
@@ -90,6 +193,17 @@ def main():
         db.init_aioredis()
     ))
 
+    # 后台创建缺失的数据库索引
+    asyncio.ensure_future(db_index.ensure_indexes())
+
+    # 加载标签字典
+    from cores.tag import tag_service
+    asyncio.get_event_loop().run_until_complete(tag_service.tag_dict.load_all())
+    tag_service.tag_dict.start_refresh()
+
+    # 启动计数定时落库
+    counter_aggregator.start()
+
     # 启动tornado主服务
     app = MyApplication(
         all_urls,
@@ -98,10 +212,28 @@ def main():
         static_path='server_web/static',
         static_handler_class=StaticFileHandler,
     )
-    logger.info('%s server listen on %d' % (config.PROJECT_NAME, options.port))
+    logger.info('%s server listen on %d, pid %d' % (config.PROJECT_NAME, options.port, os.getpid()))
     server = HTTPServer(app, xheaders=True)
-    server.bind(options.port, backlog=512)
-    server.start()
+    sockets = bind_sockets(options.port, backlog=512, reuse_port=options.reuse_port)
+    server.add_sockets(sockets)
+
+    # 平滑退出: 停止接收新连接, 等待处理中的请求完成, 落库剩余计数
+    async def shutdown():
+        server.stop()
+        deadline = time.time() + options.drain_seconds
+        while app.inflight_requests > 0 and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        await counter_aggregator.flush_all()
+        ioloop.IOLoop.current().stop()
+
+    def sig_handler(sig, frame):
+        logger.info('Caught signal: %s' % sig)
+        ioloop.IOLoop.current().add_callback_from_signal(shutdown)
+
+    # 只有主线程可以注册信号处理, 单元测试在子线程中启动服务
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, sig_handler)
+        signal.signal(signal.SIGINT, sig_handler)
 
     ioloop.IOLoop.current().start()
     logger.info('Exit')
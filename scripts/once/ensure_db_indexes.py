@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+"""
+创建缺失的数据库索引(唯一索引先删除重复数据), 并检查各查询构造方法生成的查询是否命中声明的索引
+使用方法: python -m scripts.once.ensure_db_indexes
+"""
+from tornado.ioloop import IOLoop
+
+from cores.const import const_post, const_mix, const_cmt
+from cores.database import db_index
+from cores.post import post_service
+from cores.comment import comment_service
+from cores.favor import favor_service
+from cores.center import center_service
+from cores.tag import tag_service
+
+
+def build_sample_queries():
+    """
+    各列表查询的典型形状 [(col_name, query_dict, sorts)]
+    """
+    uid = '000000000000000000000000'
+    return [
+        ('post', post_service.build_post_query_dict(status=const_post.ALL_VISIBLE_STATUS),
+         post_service.build_post_query_sort(const_post.POST_QUERY_SORT_T_NEW)),
+        ('post', post_service.build_post_query_dict(status=const_post.ALL_VISIBLE_STATUS),
+         post_service.build_post_query_sort(const_post.POST_QUERY_SORT_T_HOT)),
+        ('post', post_service.build_post_query_dict(uid=uid, status=const_post.ALL_VISIBLE_STATUS),
+         post_service.build_post_query_sort(const_post.POST_QUERY_SORT_T_NEW)),
+        ('post', post_service.build_post_query_dict(tid=uid, status=const_post.ALL_VISIBLE_STATUS),
+         post_service.build_post_query_sort(const_post.POST_QUERY_SORT_T_NEW)),
+        ('post', {'status': const_post.POST_STATUS_REC}, [('rt', -1), ('_id', -1)]),
+        ('post_recommend_history', {'uid': uid}, [('ct', -1)]),
+        ('comment', comment_service.build_comment_query_dict(pid=uid, status=1),
+         comment_service.build_comment_query_sort(const_cmt.COMMENT_QUERY_SORT_T_HOT)),
+        ('comment', comment_service.build_comment_query_dict(pid=uid, status=1),
+         comment_service.build_comment_query_sort(const_cmt.COMMENT_QUERY_SORT_T_NEW)),
+        ('like_history', favor_service.build_like_history_query_dict(
+            to_uid=uid, obj_type=[const_mix.CONTENT_TYPE_POST_CODE, const_mix.CONTENT_TYPE_COMMENT_CODE],
+            action=const_mix.F_ACTION_TYPE_LIKE), [('ct', -1)]),
+        ('like_history', favor_service.build_like_history_query_dict(
+            obj_id=uid, obj_type=const_mix.CONTENT_TYPE_POST_CODE, not_from_uid=uid, action=const_mix.F_ACTION_TYPE_LIKE),
+         [('contribute_score', -1), ('ct', -1)]),
+        ('like_history', {'from_uid': uid, 'oid': {'$in': [uid]}, 'otype': const_mix.CONTENT_TYPE_POST_CODE}, None),
+        ('fan_history', favor_service.build_fans_history_query_dict(to_uid=uid), [('ct', -1)]),
+        ('fan_history', favor_service.build_fans_history_query_dict(from_uid=uid), [('ct', -1)]),
+        ('notices', center_service.build_notice_query_dict(uids=['', uid], notice_types=const_mix.ALL_NOTICE_TYPES,
+                                                           status=const_mix.NOTICE_STATUS_VISIBLE), [('ct', -1)]),
+        ('tag', tag_service.build_tag_query_dict(status=1), [('post_num', -1)]),
+    ]
+
+
+async def ensure_db_indexes():
+    """
+    创建缺失索引并报告未命中索引的查询, 创建唯一索引前先删除重复数据
+    """
+    for col_name, (col_getter, _) in db_index.COLLECTION_INDEXES.items():
+        for keys, options in await db_index.get_missing_indexes(col_name):
+            if not options.get('unique'):
+                continue
+            deleted_count = await db_index.remove_duplicate_docs(col_getter(), keys)
+            if deleted_count:
+                print('removed %s duplicate docs from %s on %s' % (deleted_count, col_name, keys))
+
+    created = await db_index.ensure_indexes()
+    for col_name, names in created.items():
+        print('created %s: %s' % (col_name, names))
+
+    for col_name, query_dict, sorts in build_sample_queries():
+        if not db_index.is_query_indexed(col_name, query_dict, sorts):
+            print('unindexed query on %s, fields %s, sorts %s' % (
+                col_name, sorted(db_index.collect_query_fields(query_dict)), sorts))
+
+
+if __name__ == '__main__':
+    IOLoop.current().run_sync(ensure_db_indexes)
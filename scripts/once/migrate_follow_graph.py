@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+"""
+迁移关注关系: favor 文档中的 f_uids/f_tids 数组迁移为关注边(fan_history、favor_tag_history),
+按关注边重算 f_user_num/f_tag_num 并删除数组字段
+使用方法: python -m scripts.once.migrate_follow_graph
+注意: 迁移完成后需清除 redis 中的关注集合缓存(follow_*), 或等待其过期
+"""
+import time
+
+from pymongo import UpdateOne
+
+from cores.database import db
+from cores.utils import logger
+
+
+def migrate_follow_graph(batch_size=500):
+    """
+    迁移关注关系
+    :return: 迁移的用户数
+    """
+    favor_col = db.get_col_favor()
+    fan_his_col = db.get_col_fan_history()
+    favor_tag_his_col = db.get_col_favor_tag_history()
+
+    count = 0
+    query_dict = {'$or': [{'f_uids': {'$exists': True}}, {'f_tids': {'$exists': True}}]}
+    for favor in favor_col.find(query_dict, projection={'uid': True, 'f_uids': True, 'f_tids': True}, batch_size=batch_size):
+        uid = favor['uid']
+        ct = int(time.time())
+
+        # 补全关注边, 已存在的不修改
+        fan_requests = []
+        for to_uid in favor.get('f_uids', []):
+            edge = {'from_uid': uid, 'to_uid': to_uid}
+            fan_requests.append(UpdateOne(edge, {'$setOnInsert': dict(edge, ct=ct, ut=ct)}, upsert=True))
+        if fan_requests:
+            fan_his_col.bulk_write(fan_requests, ordered=False)
+
+        tag_requests = []
+        for tid in favor.get('f_tids', []):
+            edge = {'tid': tid, 'uid': uid}
+            tag_requests.append(UpdateOne(edge, {'$setOnInsert': dict(edge, ct=ct, ut=ct)}, upsert=True))
+        if tag_requests:
+            favor_tag_his_col.bulk_write(tag_requests, ordered=False)
+
+        # 按关注边重算计数, 删除数组字段
+        f_user_num = fan_his_col.count_documents({'from_uid': uid})
+        f_tag_num = favor_tag_his_col.count_documents({'uid': uid})
+        favor_col.update_one({'_id': favor['_id']}, {
+            '$set': {'f_user_num': f_user_num, 'f_tag_num': f_tag_num},
+            '$unset': {'f_uids': '', 'f_tids': ''},
+        })
+
+        count += 1
+        if count % batch_size == 0:
+            logger.info('[migrate_follow_graph] migrated %d users' % count)
+
+    logger.info('[migrate_follow_graph] done, migrated %d users' % count)
+    return count
+
+
+if __name__ == '__main__':
+    migrate_follow_graph()
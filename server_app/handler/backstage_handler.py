@@ -2,12 +2,14 @@
 """
 后台服务相关 handler
 """
-import ujson
 
-from cores.const import const_err, const_mix
+from cores.const import const_err
 from server_app.handler.base_handler import BaseHandler
 from cores.user import user_service
 from cores.backstage import backstage_service
+from cores.utils import entity_cache
+from cores.database import pool_stats
+from cores.utils import query_profiler, request_timing, json_codec
 from config import config
 
 
@@ -20,17 +22,9 @@ class GetAppConfHandler(BaseHandler):
     @BaseHandler.check_permission(need_login=False)
     async def post(self):
 
-        # 获取配置文件
-        result = const_mix.get_app_conf()
-
-        # OSS相关信息
-        result['oss_conf'] = backstage_service.get_oss_conf()
-
-        # 当前域名
-        result['host'] = config.PROJECT_HOST
-
-        ret = {'ret': const_err.CODE_SUCCESS, 'data': result, 'msg': ''}
-        self.jsonify(ret)
+        # 配置在进程内只编码一次, 客户端携带 If-None-Match 且未变化时返回 304
+        content, etag = backstage_service.get_app_conf_response()
+        self.jsonify_encoded(content, etag=etag)
 
 
 class HeartBeatHandler(BaseHandler):
@@ -52,7 +46,7 @@ class HeartBeatHandler(BaseHandler):
     @BaseHandler.check_permission(need_login=False)
     def head(self):
         ret = {'ret': const_err.CODE_SUCCESS, 'data': {}, 'msg': 'hello world'}
-        content = ujson.dumps(ret)
+        content = json_codec.dumps(ret)
         self.set_header('Content-Type', 'application/json; charset=utf-8')
         self.set_header('Content-Length', len(content))
         self.finish()
@@ -75,3 +69,54 @@ class UpdateSettingsHandler(BaseHandler):
         ret = {'ret': const_err.CODE_SUCCESS, 'data': {}, 'msg': ''}
         self.jsonify(ret)
 
+
+def check_stats_token(handler):
+    """
+    线上环境统计接口需要校验口令
+    """
+    if not config.IS_ONLINE_SERVER:
+        return True
+    token = handler.request.headers.get('X-Stats-Token', '')
+    return bool(config.SERVER_STATS_TOKEN and token == config.SERVER_STATS_TOKEN)
+
+
+class ServerStatsHandler(BaseHandler):
+    """
+    获取服务运行统计 (缓存命中、连接池、查询耗时等)
+    """
+    _label = 'ServerStatsHandler'
+
+    @BaseHandler.check_permission(need_login=False)
+    async def get(self):
+
+        # 线上环境需要校验口令
+        if not check_stats_token(self):
+            return self.jsonify_err(const_err.CODE_PERMISSION_FAILED)
+
+        result = {
+            'entity_cache': entity_cache.get_all_entity_cache_stats(),
+            'pool': pool_stats.get_pool_stats(),
+            'query': query_profiler.query_profiler.get_stats(),
+            'latency': request_timing.latency_tracker.get_percentiles(),
+        }
+
+        ret = {'ret': const_err.CODE_SUCCESS, 'data': result, 'msg': ''}
+        self.jsonify(ret)
+
+
+class MetricsHandler(BaseHandler):
+    """
+    导出 prometheus 文本格式指标
+    """
+    _label = 'MetricsHandler'
+
+    @BaseHandler.check_permission(need_login=False)
+    async def get(self):
+
+        # 线上环境需要校验口令
+        if not check_stats_token(self):
+            return self.jsonify_err(const_err.CODE_PERMISSION_FAILED)
+
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(query_profiler.query_profiler.export_metrics())
+        self.finish()
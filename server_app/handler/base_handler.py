@@ -2,8 +2,8 @@
 """
 基础功能 handler
 """
+import time
 import logging
-import random
 import traceback
 import ujson
 
@@ -21,6 +21,7 @@ from cores.const import const_err
 from cores.base import base_service
 from cores.user import user_service
 from cores.base.base_service import AioRedisSession
+from cores.utils import query_profiler, request_timing, json_codec
 
 
 class BaseHandler(web.RequestHandler):
@@ -37,6 +38,9 @@ class BaseHandler(web.RequestHandler):
         self.user_agent = None
         self.params = {}
         self.response = {}
+        # 请求耗时分解, 由 check_permission 设置
+        self.timing = None
+        self._context_tokens = []
 
     def head(self, *args, **kwargs):
         self.get(*args, **kwargs)
@@ -70,7 +74,27 @@ class BaseHandler(web.RequestHandler):
             pass
 
     def on_finish(self):
-        pass
+        self.reset_request_context()
+
+    def start_request_context(self):
+        """
+        查询统计归属到当前 handler, 开始记录请求耗时分解, 须在 handler 协程内调用
+        """
+        label_token = query_profiler.current_label.set(self._label)
+        self.timing, timing_token = request_timing.start_request_timing()
+        self._context_tokens = [(query_profiler.current_label, label_token), (request_timing.current_timing, timing_token)]
+
+    def reset_request_context(self):
+        """
+        请求结束后恢复上下文, 防止泄漏到同一连接的后续回调
+        """
+        for var, token in reversed(self._context_tokens):
+            try:
+                var.reset(token)
+            except ValueError:
+                # 在其他上下文(如独立 Task)中设置, 已随其结束
+                pass
+        self._context_tokens = []
 
     def jsonify(self, response):
         if self.session and self.session.get('sid'):
@@ -79,7 +103,31 @@ class BaseHandler(web.RequestHandler):
         self.set_header('Date', datetime.now())
         self.set_header('Access-Control-Allow-Origin', '*')
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        self.write(response)
+        start = time.time()
+        self.write(json_codec.dumps(response))
+        if self.timing:
+            self.timing.json_ms += (time.time() - start) * 1000
+        self.finish()
+
+    def jsonify_encoded(self, content, etag=None):
+        """
+        输出已编码的 json 响应
+        :param content: 已编码的响应内容 bytes
+        :param etag: 强 ETag, 与请求 If-None-Match 一致时返回 304
+        """
+        if self.session and self.session.get('sid'):
+            self.set_cookie('session', self.session['sid'])
+        self.set_header('Cache-Control', 'private')
+        self.set_header('Date', datetime.now())
+        self.set_header('Access-Control-Allow-Origin', '*')
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        if etag:
+            self.set_header('Etag', etag)
+            if self.check_etag_header():
+                self.set_status(304)
+                self.finish()
+                return
+        self.write(content)
         self.finish()
 
     def jsonify_err(self, ret, msg=''):
@@ -155,6 +203,9 @@ class BaseHandler(web.RequestHandler):
         def decorator(func):
             @wraps(func)
             async def wrapper(self):
+                # 查询统计归属到当前 handler, 开始记录请求耗时分解
+                self.start_request_context()
+
                 sid = self.params.get('session', '')
 
                 # 尝试从URL里面获取session信息
@@ -171,7 +222,8 @@ class BaseHandler(web.RequestHandler):
                 if session_info:
                     self.uid = session_info['uid']
                     self.session = session_info
-                    IOLoop.current().add_callback(self.extend_session_if_needed, self.uid, sid)
+                    if AioRedisSession.need_extend_check(sid):
+                        IOLoop.current().add_callback(self.extend_session_if_needed, self.uid, sid)
 
                 # 要求登录
                 if need_login and not session_info:
@@ -199,10 +251,8 @@ class BaseHandler(web.RequestHandler):
 
     async def extend_session_if_needed(self, uid, sid):
         """
-        10% 概率自动延长 session
+        自动延长 session, 调用方通过 AioRedisSession.need_extend_check 限制频率
         """
-        if random.random() > 0.9:
-            return
         ttl = await AioRedisSession.get_session_ttl(sid)
         if ttl <= max(int(config.USER_SESSION_EXT) - 86400, 0):
             user_info = await user_service.get_user_info(uid=uid)
@@ -42,14 +42,14 @@ class GetUserHomePageHandler(BaseHandler):
 
         # 获取目标用户的关注信息
         viewed_user = await user_service.get_raw_user(uid=viewed_uid)
-        viewed_favor = await favor_service.initial_user_favor_info(viewed_uid)
+        viewed_favor = await favor_service.get_viewer_favor_info(viewed_uid)
         if not (viewed_user and viewed_favor):
             self.jsonify_err(const_err.CODE_NAME_NO_EXIST_ERROR)
             return
 
         # 获取当前自己的关注信息
-        viewer_favor = await favor_service.initial_user_favor_info(self.uid)
-        result = center_service.build_user_home_page_for_handler(viewed_favor, viewed_user, viewer_favor)
+        viewer_favor = await favor_service.get_viewer_favor_info(self.uid)
+        result = await center_service.build_user_home_page_for_handler(viewed_favor, viewed_user, viewer_favor)
         self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': result, 'msg': ''})
 
 
@@ -64,7 +64,7 @@ class GetMyHomePageHandler(BaseHandler):
 
         # 获取自己的关注信息
         my_user = await user_service.get_raw_user(uid=self.uid)
-        my_favor = await favor_service.initial_user_favor_info(self.uid)
+        my_favor = await favor_service.get_viewer_favor_info(self.uid)
         if not (my_user and my_favor):
             self.jsonify_err(const_err.CODE_NAME_NO_EXIST_ERROR)
             return
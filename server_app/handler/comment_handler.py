@@ -137,7 +137,7 @@ class CommentCreateHandler(BaseHandler):
             return
 
         # 调用频率限制
-        if not redis_lock.user_redis_set_unblock_lock(self.uid, CommentCreateHandler._label, const_cmt.COMMENT_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(self.uid, CommentCreateHandler._label, const_cmt.COMMENT_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_COMMENT_CREATE_QUICKLY_ERROR)
             return
 
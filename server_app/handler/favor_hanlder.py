@@ -33,13 +33,13 @@ class FollowUserHandler(BaseHandler):
         new_uid = self.params['uid']
 
         # 初始化
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
         if not favor:
             self.jsonify_err(const_err.CODE_FAILED)
             return
 
         # 达到关注用户上限则失败
-        if len(favor['f_uids']) >= const_mix.MAX_F_UIDS_LEN:
+        if favor.get('f_user_num', 0) >= const_mix.MAX_F_UIDS_LEN:
             self.jsonify_err(const_err.CODE_FAVOR_UIDS_MAX)
             return
 
@@ -69,7 +69,7 @@ class CancelFollowUserHandler(BaseHandler):
         del_uid = self.params['uid']
 
         # 初始化
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
         if not favor:
             self.jsonify_err(const_err.CODE_FAILED)
             return
@@ -100,13 +100,13 @@ class FollowTagHandler(BaseHandler):
         new_tid = self.params['tid']
 
         # 初始化
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
         if not favor:
             self.jsonify_err(const_err.CODE_FAILED)
             return
 
         # 达到关注话题上限则失败
-        if len(favor['f_tids']) >= favor.get('max_f_tids_num', const_mix.MAX_F_TIDS_LEN):
+        if favor.get('f_tag_num', 0) >= favor.get('max_f_tids_num', const_mix.MAX_F_TIDS_LEN):
             self.jsonify_err(const_err.CODE_FAVOR_TIDS_MAX)
             return
 
@@ -406,8 +406,8 @@ class GetLikeHistoryToMeHandler(BaseHandler):
             action=const_mix.F_ACTION_TYPE_LIKE)
         sorts = [('ct', -1)]
 
-        # 获取帖子列表
-        has_more, next_cursor_info, histories = await favor_service.get_like_history_info_list_for_handler(
+        # 优先读取赞我的收件箱
+        has_more, next_cursor_info, histories = await favor_service.get_like_inbox_info_list_for_handler(
             self.uid, cursor_info, query_dict=query_dict, sorts=sorts)
 
         self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': {'has_more': has_more, 'cursor': ujson.dumps(next_cursor_info), 'list': histories}, 'msg': ''})
@@ -435,3 +435,25 @@ class GetFansHistoryToMeHandler(BaseHandler):
 
         self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': {'has_more': has_more, 'cursor': ujson.dumps(next_cursor_info), 'list': histories}, 'msg': ''})
 
+
+class GetMyFollowHistoryHandler(BaseHandler):
+    """
+    获取我关注的用户记录
+    """
+    _label = 'GetMyFollowHistoryHandler'
+
+    @BaseHandler.check_permission(need_normal_user=True)
+    async def post(self):
+
+        # 分页信息
+        cursor_info = base_service.get_cursor_info_from_req_param(self.params)
+
+        # 查询请求
+        query_dict = favor_service.build_fans_history_query_dict(from_uid=self.uid)
+        sorts = [('ct', -1)]
+
+        # 获取关注列表
+        has_more, next_cursor_info, histories = await favor_service.get_fans_history_info_list_for_handler(
+            self.uid, cursor_info, query_dict=query_dict, sorts=sorts)
+
+        self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': {'has_more': has_more, 'cursor': ujson.dumps(next_cursor_info), 'list': histories}, 'msg': ''})
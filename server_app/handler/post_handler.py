@@ -36,7 +36,7 @@ class PostRecommendQueryListHandler(BaseHandler):
             return self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': {'list': []}, 'msg': ''})
 
         # 初始化关注
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 获取帖子列表
         posts = await post_service.get_recommend_post_info_list_for_handler_v1(self.uid, favor_info=favor)
@@ -71,7 +71,7 @@ class PostHistoryRecommendQueryListHandler(BaseHandler):
             return self.jsonify({'ret': const_err.CODE_SUCCESS, 'data': {'list': []}, 'msg': ''})
 
         # 初始化关注
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 获取帖子列表
         posts = await post_service.get_history_recommend_post_info_list_for_handler(self.uid, favor_info=favor)
@@ -105,15 +105,15 @@ class PostUserQueryListHandler(BaseHandler):
         cursor_info = base_service.get_cursor_info_from_req_param(self.params)
 
         # 初始化关注
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 查询请求
         query_dict = post_service.build_post_query_dict(uid=p_uid, status=const_post.ALL_VISIBLE_STATUS)
         sorts = post_service.build_post_query_sort(query_sort_type)
 
-        # 获取帖子列表
+        # 获取帖子列表, 查看自己的帖子时读主库, 保证能看到刚发的帖子
         has_more, next_cursor_info, posts = await post_service.get_post_info_list_for_handler(
-            self.uid, cursor_info, query_dict=query_dict, sorts=sorts, favor_info=favor)
+            self.uid, cursor_info, query_dict=query_dict, sorts=sorts, favor_info=favor, read_replica=bool(p_uid != self.uid))
 
         ret = {'ret': const_err.CODE_SUCCESS, 'data': {'list': posts, 'has_more': has_more, 'cursor': ujson.dumps(next_cursor_info)}, 'msg': ''}
         self.jsonify(ret)
@@ -145,7 +145,7 @@ class PostTagQueryListHandler(BaseHandler):
         cursor_info = base_service.get_cursor_info_from_req_param(self.params)
 
         # 初始化关注
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 获取帖子列表
         query_dict = post_service.build_post_query_dict(tid=tid, ptype=post_types, status=const_post.ALL_VISIBLE_STATUS)
@@ -219,7 +219,7 @@ class PostCreateHandler(BaseHandler):
         raw_articles = self.params.get('raw_articles', [])
 
         # 调用频率限制
-        if not redis_lock.user_redis_set_unblock_lock(self.uid, PostCreateHandler._label, const_post.POST_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(self.uid, PostCreateHandler._label, const_post.POST_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_POST_CREATE_QUICKLY_ERROR)
             return
 
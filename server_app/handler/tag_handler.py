@@ -77,7 +77,7 @@ class TagDetailHandler(BaseHandler):
         tid = self.params['tid']
 
         # 用户喜好表
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 创建标签
         tag_info = await tag_service.query_tags_detail_for_handler(tid, viewer_favor_info=favor)
@@ -100,7 +100,7 @@ class TagQueryListHandler(BaseHandler):
         cursor_info = base_service.get_cursor_info_from_req_param(self.params)
 
         # 用户喜好表
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 搜索主题标签
         offset = cursor_info.get('offset', 0)
@@ -36,7 +36,11 @@ class GuestRegisterHandler(BaseHandler):
 
         # 登录入口频率限制: IP限制设备
         ip = self.request.remote_ip
-        if not redis_lock.user_redis_set_unblock_lock(ip, GuestRegisterHandler._label, 1):
+        if not await redis_lock.user_redis_lock(ip, GuestRegisterHandler._label, 1):
+            self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
+            return
+        if not await redis_lock.sliding_window_allow(
+                ip, GuestRegisterHandler._label, const_user.GUEST_REGISTER_IP_LIMIT, const_user.GUEST_REGISTER_IP_WINDOW_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
@@ -103,7 +107,7 @@ class RegisterHandler(BaseHandler):
             return
 
         # 调用频率限制
-        if not redis_lock.user_redis_set_unblock_lock(did, RegisterHandler._label, const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(did, RegisterHandler._label, const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_REG_CREATE_QUICKLY_ERROR)
             return
 
@@ -189,8 +193,16 @@ class SendVerificationCodeHandler(BaseHandler):
             self.jsonify_err(const_err.CODE_NAME_FMT_ERROR)
             return
 
+        # 设备频率限制
+        did = self.params.get('h_did', '').strip()
+        if did and not await redis_lock.token_bucket_allow(
+                did, SendVerificationCodeHandler._label,
+                const_user.VERIFICATION_CODE_DEVICE_RATE, const_user.VERIFICATION_CODE_DEVICE_CAPACITY):
+            self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
+            return
+
         # 调用频率限制
-        if not redis_lock.user_redis_set_unblock_lock(name, SendVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(name, SendVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
@@ -240,12 +252,12 @@ class CheckVerificationCodeHandler(BaseHandler):
             return
 
         # 调用频率限制 - 手机号
-        if not redis_lock.user_redis_set_unblock_lock(name, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(name, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
         # 调用频率限制 - 硬件号
-        if not redis_lock.user_redis_set_unblock_lock(h_did, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(h_did, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
@@ -338,12 +350,12 @@ class ValidCodeLoginHandler(BaseHandler):
             return
 
         # 调用频率限制 - 手机号
-        if not redis_lock.user_redis_set_unblock_lock(name, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(name, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
         # 调用频率限制 - 硬件号
-        if not redis_lock.user_redis_set_unblock_lock(h_did, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
+        if not await redis_lock.user_redis_lock(h_did, CheckVerificationCodeHandler._label, lock_time=const_user.REGISTER_FREQUENCY_LIMIT_SEC):
             self.jsonify_err(const_err.CODE_ACT_QUICKLY_ERROR)
             return
 
@@ -16,6 +16,8 @@ app_urls = [
     # --------- 健康检查相关
     (r'/heartbeat', HeartBeatHandler),
     (r'/%s/heartbeat' % const_mix.URL_NAME_APP, HeartBeatHandler),
+    (r'/%s/backstage/server_stats' % const_mix.URL_NAME_APP, ServerStatsHandler),
+    (r'/metrics', MetricsHandler),
 
     # --------- 用户登录相关
     (r'/%s/account/guest_register' % const_mix.URL_NAME_APP, GuestRegisterHandler),
@@ -43,6 +45,7 @@ app_urls = [
     (r'/%s/favor/cancel_dislike_comment' % const_mix.URL_NAME_APP, CancelDislikeCommentHandler),
     (r'/%s/favor/get_likes_history_to_me' % const_mix.URL_NAME_APP, GetLikeHistoryToMeHandler),
     (r'/%s/favor/get_fans_history_to_me' % const_mix.URL_NAME_APP, GetFansHistoryToMeHandler),
+    (r'/%s/favor/get_my_follow_history' % const_mix.URL_NAME_APP, GetMyFollowHistoryHandler),
 
     # ---------- 用户中心相关
     (r'/%s/center/get_user_homepage' % const_mix.URL_NAME_APP, GetUserHomePageHandler),
@@ -2,17 +2,30 @@
 """
 基础 handler、功能单一 handler
 """
+import time
 import logging
 import ujson
 from datetime import datetime
 import traceback
 from functools import wraps
+from inspect import isawaitable
 
 from tornado import web
 
 from config import config
 from cores.const import const_err, const_user
 from server_audit.service.audit_base_service import AdminRedisSession
+from cores.utils import query_profiler, request_timing, json_codec
+
+
+async def run_handler_func(func, handler):
+    """
+    执行 handler 方法, 兼容异步/同步方法
+    """
+    ret = func(handler)
+    if isawaitable(ret):
+        return await ret
+    return ret
 
 
 class AuditBaseHandler(web.RequestHandler):
@@ -27,6 +40,9 @@ class AuditBaseHandler(web.RequestHandler):
         self.user_agent = None
         self.params = {}
         self.response = {}
+        # 请求耗时分解, 由 check_permission 设置
+        self.timing = None
+        self._context_tokens = []
 
     def head(self, *args, **kwargs):
         self.get(*args, **kwargs)
@@ -57,7 +73,27 @@ class AuditBaseHandler(web.RequestHandler):
                     self.params = {}
 
     def on_finish(self):
-        pass
+        self.reset_request_context()
+
+    def start_request_context(self):
+        """
+        查询统计归属到当前 handler, 开始记录请求耗时分解, 须在 handler 协程内调用
+        """
+        label_token = query_profiler.current_label.set(self._label)
+        self.timing, timing_token = request_timing.start_request_timing()
+        self._context_tokens = [(query_profiler.current_label, label_token), (request_timing.current_timing, timing_token)]
+
+    def reset_request_context(self):
+        """
+        请求结束后恢复上下文, 防止泄漏到同一连接的后续回调
+        """
+        for var, token in reversed(self._context_tokens):
+            try:
+                var.reset(token)
+            except ValueError:
+                # 在其他上下文(如独立 Task)中设置, 已随其结束
+                pass
+        self._context_tokens = []
 
     def jsonify(self, response):
         if self.session and self.session.get('sid'):
@@ -67,9 +103,11 @@ class AuditBaseHandler(web.RequestHandler):
         self.set_header('Access-Control-Allow-Origin', '*')
         if getattr(config, 'RSP_LOG', False):
             self.response = response
-        response = ujson.dumps(response, ensure_ascii=False)
         self.set_header('Content-Type', 'application/json; charset=utf-8')
-        self.write(response)
+        start = time.time()
+        self.write(json_codec.dumps(response))
+        if self.timing:
+            self.timing.json_ms += (time.time() - start) * 1000
         self.finish()
 
     def html_response(self, template_name, cache, **kwargs):
@@ -122,13 +160,16 @@ class AuditBaseHandler(web.RequestHandler):
         """
         def decorator(func):
             @wraps(func)
-            def wrapper(self):
+            async def wrapper(self):
+                # 查询统计归属到当前 handler, 开始记录请求耗时分解
+                self.start_request_context()
+
                 sid = self.params.get('session', '')
 
                 # 爬虫机器人
                 if sid == const_user.SPIDER_ROB_ADMIN_SID:
                     self.admin_uid = sid
-                    return func(self)
+                    return await run_handler_func(func, self)
 
                 # 判断登录状态
                 session_info = AdminRedisSession.open_session(sid) if sid else {}
@@ -147,7 +188,7 @@ class AuditBaseHandler(web.RequestHandler):
                 AdminRedisSession.expire_session(sid, config.AUDIT_SESSION_EXT)
                 self.admin_uid = session_info['admin_uid']
                 self.session = session_info
-                return func(self)
+                return await run_handler_func(func, self)
             return wrapper
 
         return decorator
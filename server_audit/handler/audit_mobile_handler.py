@@ -32,15 +32,15 @@ class AdminMobPostQueryListsHandler(BaseHandler):
         cursor_info = base_service.get_cursor_info_from_req_param(self.params)
 
         # 初始化关注
-        favor = await favor_service.initial_user_favor_info(self.uid)
+        favor = await favor_service.get_viewer_favor_info(self.uid)
 
         # 查询请求
         query_dict = post_service.build_post_query_dict(status=const_post.ALL_VISIBLE_STATUS)
         sorts = post_service.build_post_query_sort(const_post.POST_QUERY_SORT_T_NEW)
 
-        # 获取帖子列表
+        # 获取帖子列表, 审核读主库
         has_more, next_cursor_info, posts = await post_service.get_post_info_list_for_handler(
-            self.uid, cursor_info, query_dict=query_dict, sorts=sorts, favor_info=favor)
+            self.uid, cursor_info, query_dict=query_dict, sorts=sorts, favor_info=favor, read_replica=False)
 
         ret = {'ret': const_err.CODE_SUCCESS, 'data': {'list': posts, 'has_more': has_more, 'cursor': ujson.dumps(next_cursor_info)}, 'msg': ''}
         self.jsonify(ret)
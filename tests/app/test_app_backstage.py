@@ -33,6 +33,15 @@ class TestBackstageFuncs(BaseTestCase):
 
         self.assertEqual(res['data']['ios_in_review'], False)
         self.assertEqual(res['data']['android_in_review'], False)
+        etag = rsp.headers['Etag']
+        self.assertTrue(etag)
+
+        # 配置未变化返回 304
+        rsp = requests.post("http://%s/%s/backstage/get_app_conf" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session,
+        }), headers={'If-None-Match': etag})
+        self.assertEqual(rsp.status_code, 304)
+        self.assertEqual(rsp.content, b'')
 
     @tornado.testing.gen_test
     async def test_backstage_heartbeat_handlers(self):
@@ -53,6 +62,35 @@ class TestBackstageFuncs(BaseTestCase):
         res = ujson.loads(rsp.content)
         self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
 
+    @tornado.testing.gen_test
+    async def test_backstage_metrics_handlers(self):
+        """
+        测试查询统计 metrics handlers
+        :return:
+        """
+        # 创建测试用户
+        uid, name, session, nick = TestFuncUtils.create_new_login_user_for_test()
+
+        # 产生查询
+        rsp = requests.post("http://%s/%s/post/user_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session,
+            'p_uid': uid,
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+
+        # 查询统计归属到 handler
+        rsp = requests.get("http://%s/%s/backstage/server_stats" % (config.TEST_HOST, const_mix.URL_NAME_APP))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertTrue('PostUserQueryListHandler' in [item['label'] for item in res['data']['query']])
+        self.assertTrue('PostUserQueryListHandler' in res['data']['latency'])
+
+        # prometheus 文本格式
+        rsp = requests.get("http://%s/metrics" % config.TEST_HOST)
+        self.assertEqual(rsp.status_code, 200)
+        self.assertTrue('mongo_query_duration_ms_bucket{label="PostUserQueryListHandler"' in rsp.text)
+
 
 if __name__ == '__main__':
     TestCaseEnvUtil.prepare_server_for_test_cases()
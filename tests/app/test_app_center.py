@@ -11,6 +11,7 @@ import ujson
 from config import config
 from cores.const import const_mix, const_err
 from cores.center import center_service
+from cores.database import db
 from tests.base_service import TestCaseEnvUtil, BaseTestCase, TestFuncUtils
 
 
@@ -55,7 +56,24 @@ class TestBackstageFuncs(BaseTestCase):
         self.assertEqual(res['data']['new_notices_to_me'], 0)
 
         # 创建系统通知
-        nid = await center_service.create_new_notice(const_mix.NOTICE_TYPE_SYS, const_mix.NOTICE_STATUS_VISIBLE, "测试标题A")
+        nid = self.run_server_coroutine(center_service.create_new_notice(const_mix.NOTICE_TYPE_SYS, const_mix.NOTICE_STATUS_VISIBLE, "测试标题A"))
+
+        # 查看小红点信息 - 1条未读通知
+        rsp = requests.post("http://%s/%s/center/get_my_badges" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session1,
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertEqual(res['data']['new_notices_to_me'], 1)
+
+        # 通知不可见后不再计数
+        self.run_server_coroutine(center_service.update_notice_by_nid(nid, status=const_mix.NOTICE_STATUS_INVISIBLE))
+        self.assertEqual(self.run_server_coroutine(center_service.get_new_notice_num_to_me(uid1, 100)), 0)
+        self.run_server_coroutine(center_service.update_notice_by_nid(nid, status=const_mix.NOTICE_STATUS_VISIBLE))
+
+        # 索引丢失时重建
+        db.get_redis(config.REDIS_DB_LONG).delete(center_service.build_notice_index_key(const_mix.NOTICE_TYPE_SYS, ''))
+        self.assertEqual(self.run_server_coroutine(center_service.get_new_notice_num_to_me(uid1, 100)), 1)
 
         # 查看系统通知列表
         rsp = requests.post("http://%s/%s/center/get_my_notices" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
@@ -8,10 +8,16 @@ import requests
 import tornado
 import ujson
 
+from bson import ObjectId
+
 from config import config
 from cores.const import const_mix, const_err, const_post, const_base
 from cores.tag import tag_service
 from cores.comment import comment_service
+from cores.database import db
+from cores.favor import favor_service
+from cores.follow import follow_service
+from cores.utils.counter_aggregator import counter_aggregator
 from cores.post import post_service
 from tests.base_service import TestCaseEnvUtil, BaseTestCase, TestFuncUtils
 
@@ -37,6 +43,14 @@ class TestFavorFuncs(BaseTestCase):
             res = ujson.loads(rsp.content)
             self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
 
+        # 用户2 关注列表
+        rsp = requests.post("http://%s/%s/favor/get_my_follow_history" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session2,
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertEqual([his['to_uid'] for his in res['data']['list']], [uid1])
+
         # 用户2 主页 - 1个关注
         rsp = requests.post("http://%s/%s/center/get_user_homepage" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
             'session': session1,
@@ -477,13 +491,211 @@ class TestFavorFuncs(BaseTestCase):
         self.assertEqual(res['data']['list'][0]['dislikes'], 0)
         self.assertEqual(res['data']['list'][0]['disliked'], False)
 
+    @tornado.testing.gen_test
+    async def test_like_state_cache_funcs(self):
+        """
+        测试赞踩状态缓存
+        :return:
+        """
+        uid, pid, pid2 = 'uid_a', str(ObjectId()), str(ObjectId())
+        otype = const_mix.CONTENT_TYPE_POST_CODE
+
+        # 首次读取回源并回填缓存
+        self.run_server_coroutine(favor_service.apply_like_transition(uid, 'uid_b', pid, otype, const_mix.F_ACTION_TYPE_LIKE))
+        self.run_server_coroutine(db.func_aioredis.delete(favor_service.LIKE_STATE_KEY % (uid, otype)))
+        like_pids, disliked_pids = self.run_server_coroutine(favor_service.get_user_liked_disliked_pids(uid, [pid, pid2]))
+        self.assertEqual(like_pids, [pid])
+        self.assertEqual(disliked_pids, [])
+        states = self.run_server_coroutine(db.func_aioredis.hgetall(favor_service.LIKE_STATE_KEY % (uid, otype)))
+        self.assertEqual(states, {pid: str(const_mix.F_ACTION_TYPE_LIKE)})
+        none_oids = self.run_server_coroutine(db.func_aioredis.smembers(favor_service.LIKE_STATE_NONE_KEY % (uid, otype)))
+        self.assertEqual(none_oids, [pid2])
+        self.assertTrue(self.run_server_coroutine(db.func_aioredis.ttl(favor_service.LIKE_STATE_NONE_KEY % (uid, otype))) > 0)
+
+        # 赞转踩, 缓存同步更新
+        self.run_server_coroutine(favor_service.apply_like_transition(uid, 'uid_b', pid, otype, const_mix.F_ACTION_TYPE_DISLIKE))
+        like_pids, disliked_pids = self.run_server_coroutine(favor_service.get_user_liked_disliked_pids(uid, [pid]))
+        self.assertEqual(like_pids, [])
+        self.assertEqual(disliked_pids, [pid])
+
+        # 取消踩
+        self.run_server_coroutine(favor_service.apply_like_transition(uid, 'uid_b', pid, otype, const_mix.F_ACTION_TYPE_CANCEL_DISLIKE))
+        like_pids, disliked_pids = self.run_server_coroutine(favor_service.get_user_liked_disliked_pids(uid, [pid]))
+        self.assertEqual((like_pids, disliked_pids), ([], []))
+
+    @tornado.testing.gen_test
+    async def test_favor_cache_funcs(self):
+        """
+        测试喜好信息缓存
+        :return:
+        """
+        uid = str(ObjectId())
+
+        # 不存在时初始化
+        self.assertEqual(self.run_server_coroutine(favor_service.get_user_favor(uid)), {})
+        favor = self.run_server_coroutine(favor_service.get_viewer_favor_info(uid))
+        self.assertEqual((favor['uid'], favor['fans_num']), (uid, 0))
+
+        # 读取走缓存, 未落库计数叠加
+        self.run_server_coroutine(favor_service.get_user_favor(uid))
+        self.assertTrue(favor_service.favor_entity_cache.local_cache.get(uid) is not None)
+        self.run_server_coroutine(favor_service.increase_favor_count_stat(uid, fans_num_inc_num=2))
+        self.assertEqual(self.run_server_coroutine(favor_service.get_user_favor(uid))['fans_num'], 2)
+
+        # 落库后缓存失效, 读到最新数据
+        self.run_server_coroutine(counter_aggregator.flush())
+        self.assertEqual(favor_service.favor_entity_cache.local_cache.get(uid), None)
+        self.assertEqual(self.run_server_coroutine(favor_service.get_favor_map_by_ids([uid]))[uid]['fans_num'], 2)
+
+        # 回源期间发生 evict 时不回写旧数据
+        cache = favor_service.favor_entity_cache
+        self.run_server_coroutine(cache.evict(uid))
+
+        async def evicting_loader(keys):
+            await cache.evict(*keys)
+            return {uid: {'_id': ObjectId(uid), 'uid': uid, 'fans_num': -1}}
+
+        self.assertEqual(self.run_server_coroutine(cache.get_many([uid], evicting_loader))[uid]['fans_num'], -1)
+        self.assertEqual(cache.local_cache.get(uid), None)
+        self.assertEqual(self.run_server_coroutine(db.func_aioredis.exists(cache._build_cache_key(uid))), 0)
+
+    @tornado.testing.gen_test
+    async def test_follow_graph_funcs(self):
+        """
+        测试关注关系存储
+        :return:
+        """
+        uid, uid2, uid3 = 'uid_a', 'uid_b', 'uid_c'
+        key = follow_service.FOLLOW_SET_KEY % (follow_service.FOLLOW_TYPE_USER, uid)
+
+        # 重复关注只新增一次
+        self.assertTrue(self.run_server_coroutine(follow_service.follow(follow_service.FOLLOW_TYPE_USER, uid, uid2)))
+        self.assertFalse(self.run_server_coroutine(follow_service.follow(follow_service.FOLLOW_TYPE_USER, uid, uid2)))
+
+        # 集合缺失时从关注边重建
+        self.assertEqual(self.run_server_coroutine(db.func_aioredis.exists(key)), 0)
+        self.assertEqual(self.run_server_coroutine(follow_service.are_following_users(uid, [uid2, uid3])), {uid2})
+        self.assertEqual(self.run_server_coroutine(db.func_aioredis.exists(key)), 1)
+
+        # 集合存在时同步增删
+        self.run_server_coroutine(follow_service.follow(follow_service.FOLLOW_TYPE_USER, uid, uid3))
+        self.assertTrue(self.run_server_coroutine(follow_service.is_following_user(uid, uid3)))
+        self.assertTrue(self.run_server_coroutine(follow_service.unfollow(follow_service.FOLLOW_TYPE_USER, uid, uid2)))
+        self.assertFalse(self.run_server_coroutine(follow_service.unfollow(follow_service.FOLLOW_TYPE_USER, uid, uid2)))
+        self.assertEqual(self.run_server_coroutine(follow_service.are_following_users(uid, [uid2, uid3])), {uid3})
+
+        # 回源期间有写入时放弃重建
+        self.run_server_coroutine(db.func_aioredis.delete(key))
+        version_key = follow_service.FOLLOW_VERSION_KEY % (follow_service.FOLLOW_TYPE_USER, uid)
+        version = self.run_server_coroutine(db.func_aioredis.get(version_key))
+        self.run_server_coroutine(follow_service.follow(follow_service.FOLLOW_TYPE_USER, uid, uid2))
+        ret = self.run_server_coroutine(db.func_aioredis.eval(
+            follow_service.FOLLOW_REBUILD_SCRIPT, keys=[key, version_key], args=[version, follow_service.FOLLOW_SET_EXPIRE, uid3]))
+        self.assertEqual(ret, 0)
+        self.assertEqual(self.run_server_coroutine(follow_service.are_following_users(uid, [uid2, uid3])), {uid2, uid3})
+
+        # 附加关注状态不修改原喜好信息
+        favor = {'uid': uid}
+        viewer_favor = self.run_server_coroutine(follow_service.with_follow_state(favor, uids=[uid2, uid3]))
+        self.assertEqual(viewer_favor['f_uids'], {uid2, uid3})
+        self.assertTrue('f_uids' not in favor)
+
+    @tornado.testing.gen_test
+    async def test_like_transition_funcs(self):
+        """
+        测试赞踩状态转换
+        :return:
+        """
+        uid, p_uid, pid = 'uid_a', 'uid_b', str(ObjectId())
+        otype = const_mix.CONTENT_TYPE_POST_CODE
+
+        # 重复点赞只生效一次
+        added, removed = self.run_server_coroutine(favor_service.like_post_for_handler(uid, pid, p_uid))
+        self.assertEqual((added, removed), (const_mix.F_ACTION_TYPE_LIKE, None))
+        self.assertEqual(self.run_server_coroutine(favor_service.like_post_for_handler(uid, pid, p_uid)), (None, None))
+
+        # 赞转踩
+        added, removed = self.run_server_coroutine(favor_service.dislike_post_for_handler(uid, pid, p_uid))
+        self.assertEqual((added, removed), (const_mix.F_ACTION_TYPE_DISLIKE, const_mix.F_ACTION_TYPE_LIKE))
+        like_pids, disliked_pids = self.run_server_coroutine(favor_service.get_user_liked_disliked_pids(uid, [pid]))
+        self.assertEqual((like_pids, disliked_pids), ([], [pid]))
+
+        # 重复取消踩只生效一次
+        added, removed = self.run_server_coroutine(favor_service.cancel_dislike_post_for_handler(uid, pid, p_uid))
+        self.assertEqual((added, removed), (None, const_mix.F_ACTION_TYPE_DISLIKE))
+        self.assertEqual(self.run_server_coroutine(favor_service.cancel_dislike_post_for_handler(uid, pid, p_uid)), (None, None))
+        self.assertEqual(db.get_col_like_history().count_documents({'oid': pid}), 0)
+
     @tornado.testing.gen_test
     async def test_like_history_handlers(self):
         """
         测试赞踩历史记录接口
         :return: 
         """
-        # TODO
+        uid1, name1, session1, nick1 = TestFuncUtils.create_new_login_user_for_test()
+        uid2, name2, session2, nick2 = TestFuncUtils.create_new_login_user_for_test()
+        uid3, name3, session3, nick3 = TestFuncUtils.create_new_login_user_for_test()
+        pid, _ = self.run_server_coroutine(post_service.create_new_post(
+            uid1, "测试帖子A", const_post.POST_TYPE_NORMAL, raw_imgs=[{"url": "aaa/bbb.jpg", "w": 100, "h": 200, "type": const_base.IMAGE_TYPE_NORMAL}]))
+        inbox_key = favor_service.LIKE_INBOX_ENTRY_KEY % uid1
+
+        # 收件箱未构建时不写入, 首次读取从赞踩记录重建
+        self.run_server_coroutine(favor_service.like_post_for_handler(uid2, pid, uid1))
+        self.assertEqual(self.run_server_coroutine(db.long_aioredis.exists(inbox_key)), 0)
+        rsp = requests.post("http://%s/%s/favor/get_likes_history_to_me" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session1,
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertEqual(len(res['data']['list']), 1)
+        self.assertEqual(res['data']['list'][0]['from_uid'], uid2)
+        self.assertEqual(res['data']['list'][0]['from_user_info']['nick'], nick2)
+        self.assertEqual(res['data']['list'][0]['post']['pid'], pid)
+        self.assertEqual(res['data']['list'][0]['post']['imgs'][0]['url'], 'aaa/bbb.jpg')
+        self.assertEqual(res['data']['list'][0]['to_user_info']['uid'], uid1)
+        self.assertEqual(self.run_server_coroutine(db.long_aioredis.exists(inbox_key)), 1)
+
+        # 收件箱已构建时点赞同步写入, seek 分页
+        self.run_server_coroutine(favor_service.like_post_for_handler(uid3, pid, uid1))
+        rsp = requests.post("http://%s/%s/favor/get_likes_history_to_me" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session1,
+            'cursor': ujson.dumps({'limit': 1}),
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['data']['has_more'], True)
+        self.assertEqual([his['from_uid'] for his in res['data']['list']], [uid3])
+        rsp = requests.post("http://%s/%s/favor/get_likes_history_to_me" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session1,
+            'cursor': res['data']['cursor'],
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['data']['has_more'], False)
+        self.assertEqual([his['from_uid'] for his in res['data']['list']], [uid2])
+
+        # 取消赞后删除条目
+        query_dict = favor_service.build_like_history_query_dict(to_uid=uid1, action=const_mix.F_ACTION_TYPE_LIKE)
+        self.run_server_coroutine(favor_service.cancel_like_post_for_handler(uid3, pid, uid1))
+        has_more, _, histories = self.run_server_coroutine(favor_service.get_like_inbox_info_list_for_handler(uid1, {}, query_dict, [('ct', -1)]))
+        self.assertEqual(has_more, False)
+        self.assertEqual([his['from_uid'] for his in histories], [uid2])
+
+        # 回源数据库时与收件箱条目构造方式相同, 返回格式一致
+        _, _, db_histories = self.run_server_coroutine(
+            favor_service.get_like_history_info_list_for_handler(uid1, {}, query_dict, [('ct', -1)]))
+        self.assertEqual([his['hid'] for his in db_histories], [his['hid'] for his in histories])
+        self.assertEqual(sorted(db_histories[0].keys()), sorted(histories[0].keys()))
+        self.assertEqual(sorted(db_histories[0]['post'].keys()), sorted(histories[0]['post'].keys()))
+        self.assertEqual(histories[0]['post']['text'], '测试帖子A')
+
+        # 收件箱已截断时, 读完后回源数据库继续分页
+        self.run_server_coroutine(db.long_aioredis.hset(inbox_key, favor_service.LIKE_INBOX_TRUNCATED_FIELD, 1))
+        has_more, next_cursor_info, histories = self.run_server_coroutine(
+            favor_service.get_like_inbox_info_list_for_handler(uid1, {}, query_dict, [('ct', -1)]))
+        self.assertEqual(has_more, True)
+        self.assertTrue('seek' in next_cursor_info)
+        has_more, _, histories = self.run_server_coroutine(
+            favor_service.get_like_inbox_info_list_for_handler(uid1, next_cursor_info, query_dict, [('ct', -1)]))
+        self.assertEqual((has_more, histories), (False, []))
 
     @tornado.testing.gen_test
     async def test_fans_history_to_me(self):
@@ -16,8 +16,9 @@ from cores.const import const_err, const_mix, const_base, const_post
 from cores.database import db
 from server_app.handler.post_handler import PostCreateHandler
 from cores.tag import tag_service
+from cores.post import post_service
 from tests.base_service import TestCaseEnvUtil, BaseTestCase, TestFuncUtils
-from cores.utils import redis_lock
+from cores.utils import redis_lock, json_codec
 
 
 class TestPostFuncs(BaseTestCase):
@@ -119,6 +120,98 @@ class TestPostFuncs(BaseTestCase):
         self.assertEqual(res['data']['pid'], pid)
         self.assertEqual(ujson.dumps(res['data']['user']), '{}')
 
+    @tornado.testing.gen_test
+    async def test_post_seek_cursor_handlers(self):
+        """
+        测试帖子列表 seek 分页
+        :return:
+        """
+        # 创建测试用户
+        uid, name, session, nick = TestFuncUtils.create_new_login_user_for_test()
+
+        # 创建帖子, 部分帖子创建时间相同
+        now_ts = int(time.time())
+        pids = []
+        for i in range(0, 5):
+            pid, _ = await post_service.create_new_post(uid, '测试内容%s' % i, const_post.POST_TYPE_NORMAL, ct=now_ts - i // 2)
+            pids.append(pid)
+
+        # 逐页查看帖子列表
+        cursor = ''
+        result_pids = []
+        for i in range(0, 3):
+            rsp = requests.post("http://%s/%s/post/user_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+                'session': session,
+                'p_uid': uid,
+                'cursor': cursor or ujson.dumps({'offset': 0, 'limit': 2}),
+            }))
+            res = ujson.loads(rsp.content)
+            self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+            result_pids.extend([post['pid'] for post in res['data']['list']])
+            cursor = res['data']['cursor']
+            self.assertTrue('seek' in ujson.loads(cursor))
+        self.assertEqual(len(result_pids), 5)
+        self.assertEqual(set(result_pids), set(pids))
+        self.assertFalse(res['data']['has_more'])
+
+        # 兼容旧的 offset 分页
+        rsp = requests.post("http://%s/%s/post/user_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'session': session,
+            'p_uid': uid,
+            'cursor': ujson.dumps({'offset': 4, 'limit': 2}),
+        }))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertEqual([post['pid'] for post in res['data']['list']], result_pids[4:])
+
+        # 不合法的 seek 退化为 offset 分页, 不能注入查询操作符
+        seek_keys = ['ct', '_id']
+        for seek in [[now_ts, 1], '[{"$ne": null}, {"$ne": null}]', '[%s, {"$regex": "."}]' % now_ts, 'bad_seek']:
+            rsp = requests.post("http://%s/%s/post/user_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+                'session': session,
+                'p_uid': uid,
+                'cursor': ujson.dumps({'offset': 4, 'limit': 2, 'seek': seek, 'seek_keys': seek_keys}),
+            }))
+            res = ujson.loads(rsp.content)
+            self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+            self.assertEqual([post['pid'] for post in res['data']['list']], result_pids[4:])
+
+    @tornado.testing.gen_test
+    async def test_post_snapshot_funcs(self):
+        """
+        测试帖子展示快照
+        :return:
+        """
+        now_ts = int(time.time())
+        post = {
+            '_id': ObjectId(), 'uid': 'uid_a', 'ptype': const_post.POST_TYPE_NORMAL, 'status': const_post.POST_STATUS_VISIBLE,
+            'title': '测试标题', 'text': '测试内容', 'ct': now_ts, 'ut': now_ts, 'cut': now_ts,
+            'cmts': 0, 'likes': 0, 'dislikes': 0, 'tids': [],
+            'raw_imgs': [{"url": "aaa/bbb.jpg", "w": 100, "h": 200, "type": const_base.IMAGE_TYPE_NORMAL}],
+            'raw_articles': [],
+        }
+        pid = str(post['_id'])
+
+        # 同一内容版本复用快照, 计数与赞踩按最新数据
+        info = post_service.build_post_info(post, {}, {})
+        post2 = dict(post, likes=3, ut=now_ts + 1)
+        info2 = post_service.build_post_info(post2, {}, {}, like_pids=[pid])
+        self.assertTrue(info['imgs'] is info2['imgs'])
+        self.assertEqual((info['likes'], info['liked']), (0, False))
+        self.assertEqual((info2['likes'], info2['liked'], info2['ut']), (3, True, now_ts + 1))
+
+        # 预编码片段原样拼接进响应
+        encoded = json_codec.loads(json_codec.dumps(info2))
+        self.assertEqual(len(encoded['imgs']), 1)
+        self.assertEqual(encoded['articles'], [])
+        self.assertEqual((encoded['pid'], encoded['likes']), (pid, 3))
+
+        # 内容更新后重建快照
+        post3 = dict(post, text='新内容', cut=now_ts + 1)
+        info3 = post_service.build_post_info(post3, {}, {})
+        self.assertEqual(info3['text'], '新内容')
+        self.assertEqual(info['text'], '测试内容')
+
     @tornado.testing.gen_test
     async def test_post_recommend_handlers_v1(self):
         """
@@ -146,8 +239,7 @@ class TestPostFuncs(BaseTestCase):
         pid = res['data']['pid']
 
         # 修改帖子至推荐状态
-        col_post = db.get_col_post()
-        col_post.update({'_id': ObjectId(pid)}, {'$set': {"status": const_post.POST_STATUS_REC, 'rt': int(time.time())}})
+        self.run_server_coroutine(post_service.update_post_status_for_handler(pid, const_post.POST_STATUS_REC))
 
         # 用户获取推荐流帖子
         rsp = requests.post("http://%s/%s/post/recommend_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
@@ -171,7 +263,7 @@ class TestPostFuncs(BaseTestCase):
         self.assertEqual(len(res['data']['list']), 0)
 
         # 新增推荐贴2
-        redis_lock.user_redis_unlock(uid, PostCreateHandler._label)
+        self.run_server_coroutine(redis_lock.user_redis_unlock(uid, PostCreateHandler._label))
         rsp = requests.post("http://%s/%s/post/create" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
             'session': session,
             'tids': [tid],
@@ -185,7 +277,7 @@ class TestPostFuncs(BaseTestCase):
         self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
         pid2 = res['data']['pid']
         # 新增推荐贴2
-        col_post.update({'_id': ObjectId(pid2)}, {'$set': {"status": const_post.POST_STATUS_REC, 'rt': int(time.time())}})
+        self.run_server_coroutine(post_service.update_post_status_for_handler(pid2, const_post.POST_STATUS_REC))
 
         # 用户获取推荐流帖子
         rsp = requests.post("http://%s/%s/post/recommend_query_list" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
@@ -13,6 +13,8 @@ from bson import ObjectId
 from config import config
 from cores.const import const_err, const_mix
 from cores.database import db
+from cores.tag import tag_service
+from cores.utils.counter_aggregator import counter_aggregator
 from tests.base_service import TestCaseEnvUtil, BaseTestCase, TestFuncUtils
 
 
@@ -52,6 +54,58 @@ class TestTagFuncs(BaseTestCase):
         self.assertEqual(len(res['data']['list']), 1)
         self.assertEqual(res['data']['list'][0]['tid'], tid)
 
+    @tornado.testing.gen_test
+    async def test_tag_dict_funcs(self):
+        """
+        测试进程内标签字典
+        :return:
+        """
+        # 创建标签后直接写入字典
+        tid = self.run_server_coroutine(tag_service.create_new_tag('测试标签', {"url": "aaa/bbb.jpg"}))
+        self.assertTrue(tid in tag_service.tag_dict.tags)
+
+        # 暂停定时落库, 保证断言时增量尚未落库
+        async def stop_periodic_flush():
+            counter_aggregator.stop()
+
+        async def start_periodic_flush():
+            counter_aggregator.start()
+
+        tag_col = db.get_col_tag()
+        self.run_server_coroutine(stop_periodic_flush())
+        try:
+            # 计数修改, 落库前叠加未落库的增量
+            self.run_server_coroutine(tag_service.increase_tag_count_stat(tid, post_num_inc_num=2, favor_num_inc=1))
+            # 非法 tid 直接丢弃, 不影响同批次其他增量落库
+            self.run_server_coroutine(tag_service.increase_tag_count_stat([tid, 'bad_tid'], post_num_inc_num=1))
+            self.assertFalse('bad_tid' in counter_aggregator.pending.get(tag_col.name, {}))
+            tag_map = self.run_server_coroutine(tag_service.get_tag_map_by_tids([tid]))
+            self.assertEqual(tag_map[tid]['post_num'], 0)
+            tag_info = tag_service.build_tag_base_info(tag_map[tid])
+            self.assertEqual(tag_info['post_num'], 3)
+            self.assertEqual(tag_info['favor_num'], 1)
+
+            # 计数落库后同步到字典
+            self.run_server_coroutine(counter_aggregator.flush_all())
+        finally:
+            self.run_server_coroutine(start_periodic_flush())
+        self.assertEqual(tag_col.find_one({'_id': ObjectId(tid)})['post_num'], 3)
+        tag_map = self.run_server_coroutine(tag_service.get_tag_map_by_tids([tid]))
+        self.assertEqual(tag_map[tid]['post_num'], 3)
+        self.assertEqual(tag_service.build_tag_base_info(tag_map[tid])['post_num'], 3)
+
+        # 字典中不存在时回源查询
+        tag_service.tag_dict.clear()
+        tag_map = self.run_server_coroutine(tag_service.get_tag_map_by_tids([tid, str(ObjectId())]))
+        self.assertEqual(list(tag_map.keys()), [tid])
+        self.assertTrue(tid in tag_service.tag_dict.tags)
+
+        # 增量刷新
+        tag_col = db.get_col_tag()
+        tag_col.update_one({'_id': ObjectId(tid)}, {'$set': {'name': 'new_name', 'ut': tag_map[tid]['ut'] + 1}})
+        self.run_server_coroutine(tag_service.tag_dict.refresh())
+        tag_map = self.run_server_coroutine(tag_service.get_tag_map_by_tids([tid]))
+        self.assertEqual(tag_map[tid]['name'], 'new_name')
 
 if __name__ == '__main__':
     TestCaseEnvUtil.prepare_server_for_test_cases()
@@ -18,6 +18,7 @@ from server_app.handler.user_handler import SendVerificationCodeHandler
 from cores.base import base_service
 from tests.base_service import BaseTestCase, TestCaseEnvUtil, TestFuncUtils
 from cores.utils import redis_lock
+from cores.user import user_service
 
 
 class TestAccountFuncs(BaseTestCase):
@@ -125,7 +126,7 @@ class TestAccountFuncs(BaseTestCase):
         self.assertEqual(session_info['uid'], new_guest_uid)
 
         # 用户重置密码
-        redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label)
+        self.run_server_coroutine(redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label))
         requests.post("http://%s/%s/account/send_code" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
             'name': name
         }))
@@ -226,6 +227,114 @@ class TestAccountFuncs(BaseTestCase):
         self.assertTrue('333' in user['raw_avatar']['url'])
         self.assertTrue('444' in user['raw_bg']['url'])
 
+    @tornado.testing.gen_test
+    async def test_user_map_cache_funcs(self):
+        """
+        测试用户信息缓存
+        :return:
+        """
+        # 创建测试用户
+        uid, name, session, nick = TestFuncUtils.create_new_login_user_for_test()
+        old_stats = user_service.get_user_map_cache_stats()
+
+        # 首次读取回源
+        user_map = self.run_server_coroutine(user_service.get_user_map_by_uids([uid, str(ObjectId())]))
+        self.assertEqual(list(user_map.keys()), [uid])
+        self.assertFalse('passwd' in user_map[uid])
+        stats = user_service.get_user_map_cache_stats()
+        self.assertEqual(stats['loads'], old_stats['loads'] + 1)
+        self.assertEqual(stats['misses'], old_stats['misses'] + 2)
+
+        # 再次读取命中缓存 (包含不存在的用户)
+        user_map = self.run_server_coroutine(user_service.get_user_map_by_uids([uid, uid]))
+        self.assertEqual(user_map[uid]['nick'], nick)
+        stats2 = user_service.get_user_map_cache_stats()
+        self.assertEqual(stats2['loads'], stats['loads'])
+        self.assertEqual(stats2['local_hits'], stats['local_hits'] + 1)
+
+        # 更新用户后缓存失效
+        self.run_server_coroutine(user_service.update_user_by_uid(uid, nick='cache_nick'))
+        user_map = self.run_server_coroutine(user_service.get_user_map_by_uids([uid]))
+        self.assertEqual(user_map[uid]['nick'], 'cache_nick')
+        self.assertEqual(user_service.get_user_map_cache_stats()['loads'], stats['loads'] + 1)
+
+        # 统计接口
+        rsp = requests.get("http://%s/%s/backstage/server_stats" % (config.TEST_HOST, const_mix.URL_NAME_APP))
+        res = ujson.loads(rsp.content)
+        self.assertEqual(res['ret'], const_err.CODE_SUCCESS)
+        self.assertTrue('user' in res['data']['entity_cache'])
+        self.assertTrue('motor' in res['data']['pool']['mongo'])
+        self.assertTrue(len(res['data']['pool']['redis']) > 0)
+
+    @tornado.testing.gen_test
+    async def test_session_local_cache_funcs(self):
+        """
+        测试 session 进程内缓存
+        :return:
+        """
+        # 创建测试用户
+        uid, name, session, nick = TestFuncUtils.create_new_login_user_for_test()
+        AioRedisSession = base_service.AioRedisSession
+
+        # 读取后写入进程内缓存
+        session_info = self.run_server_coroutine(AioRedisSession.open_session(session))
+        self.assertEqual(session_info['uid'], uid)
+        self.assertEqual(AioRedisSession.local_cache.get(session)['uid'], uid)
+
+        # 延长检查限频
+        self.assertTrue(AioRedisSession.need_extend_check(session))
+        self.assertFalse(AioRedisSession.need_extend_check(session))
+
+        # 删除 session 后缓存失效
+        self.run_server_coroutine(AioRedisSession.delete_session(session))
+        self.assertEqual(AioRedisSession.local_cache.get(session), None)
+        self.assertEqual(self.run_server_coroutine(AioRedisSession.open_session(session)), {})
+
+    @tornado.testing.gen_test
+    async def test_redis_lock_funcs(self):
+        """
+        测试 redis 锁与限频
+        :return:
+        """
+        # 上锁后重复上锁失败, 连续失败后本地直接拒绝
+        self.assertTrue(self.run_server_coroutine(redis_lock.user_redis_lock('uid_a', 'test_lock', 10)))
+        self.assertTrue(db.snap_rd_cli.ttl(redis_lock.USER_LOCK_RD_KEY % ('uid_a', 'test_lock')) > 0)
+        for _ in range(redis_lock.LocalRejectFilter.reject_threshold):
+            self.assertFalse(self.run_server_coroutine(redis_lock.user_redis_lock('uid_a', 'test_lock', 10)))
+        self.assertTrue(redis_lock.local_filter.is_blocked(redis_lock.USER_LOCK_RD_KEY % ('uid_a', 'test_lock')))
+
+        # 解锁后可重新上锁
+        self.run_server_coroutine(redis_lock.user_redis_unlock('uid_a', 'test_lock'))
+        self.assertTrue(self.run_server_coroutine(redis_lock.user_redis_lock('uid_a', 'test_lock', 10)))
+
+        # 滑动窗口: 窗口内最多 2 次
+        for allowed in [True, True, False]:
+            self.assertEqual(self.run_server_coroutine(redis_lock.sliding_window_allow('ip_a', 'test_window', 2, 60)), allowed)
+
+        # 令牌桶: 容量 2, 补充极慢
+        for allowed in [True, True, False]:
+            self.assertEqual(self.run_server_coroutine(redis_lock.token_bucket_allow('did_a', 'test_bucket', 0.001, 2)), allowed)
+        self.run_server_coroutine(redis_lock.rate_limit_reset('did_a', 'test_bucket'))
+        self.assertTrue(self.run_server_coroutine(redis_lock.token_bucket_allow('did_a', 'test_bucket', 0.001, 2)))
+        with self.assertRaises(ValueError):
+            self.run_server_coroutine(redis_lock.token_bucket_allow('did_a', 'test_bucket', 0, 2))
+
+        # 发送验证码按设备限频
+        name = '86-158%s' % base_service.get_random_str(seed='0123456789')
+        for _ in range(const_user.VERIFICATION_CODE_DEVICE_CAPACITY):
+            self.run_server_coroutine(redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label))
+            rsp = requests.post("http://%s/%s/account/send_code" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+                'name': name,
+                'h_did': 'did_b',
+            }))
+            self.assertEqual(ujson.loads(rsp.content)['ret'], const_err.CODE_SUCCESS)
+        self.run_server_coroutine(redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label))
+        rsp = requests.post("http://%s/%s/account/send_code" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
+            'name': name,
+            'h_did': 'did_b',
+        }))
+        self.assertEqual(ujson.loads(rsp.content)['ret'], const_err.CODE_ACT_QUICKLY_ERROR)
+
     @tornado.testing.gen_test
     async def test_account_vc_check_handlers(self):
         """
@@ -243,7 +352,7 @@ class TestAccountFuncs(BaseTestCase):
         code_rd_key = base_service.build_verification_code_rd_key(name)
         db.default_rd_cli.delete(code_rd_key)
         # 触发发送
-        redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label)
+        self.run_server_coroutine(redis_lock.user_redis_unlock(name, SendVerificationCodeHandler._label))
         rsp = requests.post("http://%s/%s/account/send_code" % (config.TEST_HOST, const_mix.URL_NAME_APP), data=ujson.dumps({
             'session': session
         }))
@@ -67,6 +67,12 @@ class BaseTestCase(AsyncTestCase):
         """
         from config import config
         from cores.database import db
+        from cores.utils import entity_cache
+        from cores.base.base_service import AioRedisSession
+        from cores.tag import tag_service
+        from cores.utils.counter_aggregator import counter_aggregator
+        from cores.utils import redis_lock
+        from cores.backstage import backstage_service
 
         # 数据库保险
         if '127.0.0.1' not in config.DB_HOST:
@@ -92,6 +98,16 @@ class BaseTestCase(AsyncTestCase):
             rd_db = db.get_redis(db=db_name)
             rd_db.flushdb()
 
+        # 清空进程内缓存
+        for cache in entity_cache.ALL_ENTITY_CACHES:
+            cache.local_cache.clear()
+        tag_service.tag_dict.clear()
+        AioRedisSession.local_cache.clear()
+        AioRedisSession.extend_checked_cache.clear()
+        counter_aggregator.clear()
+        redis_lock.local_filter.clear()
+        backstage_service.clear_conf_cache()
+
 
 class TestCaseEnvUtil:
     """